@@ -401,6 +401,350 @@ def test_deriv_check_new_031( verbose = False, use_simple_recursions = False ):
     print("Testing partition on short sequence, full zetafold_v031: ", sequence, structure)
     dG = partition( sequence, deriv_check=True, params = params  ) # deriv_check runs asserts
 
+def test_deriv_check_max_bp_span( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Do deriv-check with base pairs restricted by max_bp_span -- recomputed partition functions need the same restriction' )
+    sequence = 'GGGGAAACCCCAUCCGAAAGGAUGC'
+    dG = partition( sequence, deriv_check=True, max_bp_span = 12 ) # deriv_check runs asserts
+
+def test_engines( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that alternative dynamic programming engines give same results as default (explicit) engine' )
+    from zetafold.recursions.jit import numba_available
+    for (sequence, circle) in [ ('GCUCAGUGAGAGC', False), ('CAAUGCUCAUUGGG', True), ('GGGAAACCCAGCUUCGGCUGG', False), (['GGGAAC','GUUCCC'], False) ]:
+        p_ref = partition( sequence, circle = circle, calc_bpp = True, mfe = True, suppress_all_output = True, deriv_params = [] )
+        for engine in [ 'numpy', 'vectorized', 'wavefront', 'jit' ]:
+            p = partition( sequence, circle = circle, calc_bpp = True, mfe = True, suppress_all_output = True, deriv_params = [], engine = engine )
+            assert( p.engine == engine or ( engine == 'jit' and p.engine == 'explicit' and not numba_available ) )
+            assert_equal( p.Z, p_ref.Z, 1.0e-12 )
+            for i in range( p.N ):
+                for j in range( p.N ): assert_equal( p.bpp[i][j], p_ref.bpp[i][j], 1.0e-9 )
+            for (log_deriv, log_deriv_ref) in zip( p.log_derivs, p_ref.log_derivs ): assert_equal( log_deriv, log_deriv_ref, 1.0e-9 )
+            assert( p.bps_MFE == p_ref.bps_MFE )
+
+def test_fused_kernel( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that fused kernel generated in explicit_recursions.py fills same matrices as simple recursions' )
+    for (sequence, circle, structure) in [ ('GCUCAGUGAGAGC', False, None), ('CAAUGCUCAUUGGG', True, None), (['GGGAAC','GUUCCC'], False, None), ('GGGAAACCCAGCUUCGGCUGG', False, '(((...)))............') ]:
+        p = partition( sequence, circle = circle, structure = structure, allow_extra_base_pairs = True, calc_bpp = True, mfe = True, outside = False, suppress_all_output = True )
+        assert( p.update_diagonal != None )
+        p_ref = partition( sequence, circle = circle, structure = structure, allow_extra_base_pairs = True, calc_bpp = True, mfe = True, suppress_all_output = True, use_simple_recursions = True )
+        assert_equal( p.Z, p_ref.Z, 1.0e-12 )
+        assert( p.bps_MFE == p_ref.bps_MFE ) # max kernel
+        assert_equal( p.dG_MFE, p_ref.dG_MFE, 1.0e-12 )
+        for (Z, Z_ref) in zip( p.Z_all + [ p.Z_BPq[ bpt ] for bpt in p.base_pair_types ], p_ref.Z_all + [ p_ref.Z_BPq[ bpt ] for bpt in p_ref.base_pair_types ] ):
+            for i in range( p.N ):
+                for j in range( p.N ): assert_equal( Z.val( i, j ), Z_ref.val( i, j ), 1.0e-12 )
+
+def test_jit_kernel( verbose = False, use_simple_recursions = False ):
+    import zetafold.recursions.jit as jit
+    print()
+    print( 'Check that jit kernel fills same matrices as explicit engine (%s)' % ( 'compiled' if jit.numba_available else 'as plain Python, numba is not installed' ) )
+    numba_available = jit.numba_available
+    jit.numba_available = True # without numba, run kernel uncompiled instead of falling back to explicit engine
+    try:
+        for (sequence, circle, structure) in [ ('GCUCAGUGAGAGC', False, None), ('CAAUGCUCAUUGGG', True, None), (['GGGAAC','GUUCCC'], False, None), ('GGGAAACCCAGCUUCGGCUGG', False, '(((...)))............') ]:
+            p = partition( sequence, circle = circle, structure = structure, allow_extra_base_pairs = True, calc_bpp = True, mfe = True, suppress_all_output = True, engine = 'jit' )
+            assert( p.engine == 'jit' )
+            p_ref = partition( sequence, circle = circle, structure = structure, allow_extra_base_pairs = True, calc_bpp = True, mfe = True, suppress_all_output = True )
+            assert_equal( p.Z, p_ref.Z, 1.0e-12 )
+            for i in range( p.N ):
+                for j in range( p.N ): assert_equal( p.bpp[i][j], p_ref.bpp[i][j], 1.0e-9 )
+            assert( p.bps_MFE == p_ref.bps_MFE )
+    finally:
+        jit.numba_available = numba_available
+    if not numba_available:
+        p = partition( 'GCUCAGUGAGAGC', suppress_all_output = True, engine = 'jit' )
+        assert( p.engine == 'explicit' )
+
+def test_sparse_Z_BPq( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that Z_BPq for each base pair type only stores candidate base pairs' )
+    p = partition( 'GGGAAACCCAGCUUCGGCUGG', calc_bpp = True, outside = False, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    if use_simple_recursions: return
+    for base_pair_type in p.base_pair_types:
+        Z_BPq = p.Z_BPq[ base_pair_type ]
+        for i in range( p.N ):
+            stored = [ j for (j,val) in Z_BPq.row( i ) ]
+            assert( stored == [ j for j in range( p.N ) if base_pair_type in p.possible_base_pair_types[i][j] ] )
+            for (j,val) in Z_BPq.row( i ): assert( val == Z_BPq.val( i, j ) and (i,val) in Z_BPq.column( j ) )
+        for j in range( p.N ):
+            assert( [ i for (i,val) in Z_BPq.column( j ) ] == [ i for i in range( p.N ) if base_pair_type in p.possible_base_pair_types[i][j] ] )
+        assert( len( Z_BPq.get_values() ) == len( p.possible_base_pair_indices[ base_pair_type ][0] ) )
+    # two base pair types with candidates at the same element (1,3)
+    from zetafold.recursions.sparse_dynamic_programming import DynamicProgrammingMatrix, CandidateIndex
+    candidates = [ ( np.array( [0,1] ), np.array( [4,3] ) ), ( np.array( [1,2] ), np.array( [3,4] ) ) ]
+    candidate_index = CandidateIndex( 5, candidates )
+    Z_BPq = [ DynamicProgrammingMatrix( 5 ) for t in range( 2 ) ]
+    for t in range( 2 ): Z_BPq[ t ].set_candidates( candidate_index, t, candidates[ t ] )
+    for ( t, i, j, val ) in [ (0,0,4,1.0), (0,1,3,2.0), (1,1,3,3.0), (1,2,4,4.0) ]: Z_BPq[ t ].set_val( i, j, val )
+    assert( [ Z_BPq[0].val( 1, 3 ), Z_BPq[1].val( 1, 3 ), Z_BPq[0].val( 2, 4 ), Z_BPq[1].val( 0, 4 ) ] == [ 2.0, 3.0, 0.0, 0.0 ] )
+    assert( Z_BPq[0].column( 4 ) == [ (0,1.0) ] and Z_BPq[1].column( 3 ) == [ (1,3.0) ] and Z_BPq[1].row( 2 ) == [ (4,4.0) ] )
+
+def test_outside( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that bpp and derivatives from outside pass match filling all N^2 elements' )
+    for (sequence, params, structure, engine) in [ ('GGGAAACCCAGCUUCGGCUGG', '', None, 'explicit'),
+                                                   (['GAGACGAAAC','GGUCAAGCUC'], 'v0.171', None, 'numpy'),
+                                                   ('GCGCUUCGGCGCAAAGCAGCCCC', 'v0.31', None, 'vectorized'),
+                                                   ('GGGGAAACCCCAUGC', 'v0.171', '((((...))))....', 'wavefront') ]:
+        p = partition( sequence, params = params, structure = structure, engine = engine, calc_bpp = True, deriv_params = [], suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        if use_simple_recursions: return
+        assert( p.use_outside and not p.calc_all_elements )
+        p_ref = partition( sequence, params = params, structure = structure, engine = engine, calc_bpp = True, deriv_params = [], suppress_all_output = True, outside = False )
+        assert( p_ref.calc_all_elements )
+        assert_equal( p.Z, p_ref.Z, 1.0e-12 )
+        for i in range( p.N ):
+            for j in range( p.N ): assert_equal( p.bpp[i][j], p_ref.bpp[i][j], 1.0e-9 )
+        for (tag, log_deriv, log_deriv_ref) in zip( p.params.parameter_tags, p.log_derivs, p_ref.log_derivs ):
+            assert_equal( log_deriv, log_deriv_ref, 1.0e-9 )
+
+def test_scaling( verbose = False, use_simple_recursions = False ):
+    import zetafold.util.scale_util as scale_util
+    print()
+    print( 'Check that rescaling dynamic programming values (to avoid overflow) gives same results' )
+    for (sequence, circle) in [ ('GGGAAACCCAGCUUCGGCUGG', False), ('GGGAAACCCAGCUUCGGCUGG', True), (['GGGAAC','GUUCCC'], False) ]:
+        p_ref = partition( sequence, circle = circle, calc_bpp = True, mfe = True, suppress_all_output = True, deriv_params = [], use_simple_recursions = use_simple_recursions )
+        assert( p_ref.scale == 1.0 )
+        log_scale_threshold = scale_util.LOG_SCALE_THRESHOLD
+        scale_util.LOG_SCALE_THRESHOLD = 0.5 # force lots of rescaling
+        try:
+            p = partition( sequence, circle = circle, calc_bpp = True, mfe = True, suppress_all_output = True, deriv_params = [], use_simple_recursions = use_simple_recursions )
+        finally:
+            scale_util.LOG_SCALE_THRESHOLD = log_scale_threshold
+        assert( p.scale < 1.0 )
+        assert_equal( p.Z, p_ref.Z, 1.0e-12 )
+        for i in range( p.N ):
+            for j in range( p.N ): assert_equal( p.bpp[i][j], p_ref.bpp[i][j], 1.0e-9 )
+        for (log_deriv, log_deriv_ref) in zip( p.log_derivs, p_ref.log_derivs ): assert_equal( log_deriv, log_deriv_ref, 1.0e-9 )
+        assert( p.bps_MFE == p_ref.bps_MFE )
+
+    print( 'Check that partition function of very stable helix does not overflow' )
+    params = get_params( suppress_all_output = True )
+    params.set_parameter( 'Kd_CG', 1.0e-12 )
+    p = partition( 'GC'*25, params = params, calc_bpp = True, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    print( 'log Z = ', p.logZ, ' dG = ', p.dG )
+    assert( p.logZ > log( sys.float_info.max ) ) # Z itself would overflow
+    assert_equal( p.dG, -KT_IN_KCAL * p.logZ )
+    for i in range( p.N ):
+        assert( sum( p.bpp[i] ) <= 1.0 + 1.0e-9 )
+        for j in range( p.N ): assert( 0.0 <= p.bpp[i][j] <= 1.0 + 1.0e-9 )
+    assert( p.bpp[0][49] > 0.99 )
+
+def test_max_bp_span( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that banded folding (max_bp_span) matches full dynamic programming with same base pair restriction' )
+    for params in [ '', 'v0.171' ]:
+        for sequence in [ 'GGGAAACCCAGCUUCGGCUGGAAGCGCAAGCGCU', ['GGGAAACCCAGCUUCG','GCUGGAAGCGCAAGCGCU'] ]:
+            for max_bp_span in [ 4, 9, 14 ]:
+                p = partition( sequence, params = params, mfe = True, count_states = True, calc_bpp = True, deriv_params = [], suppress_all_output = True, max_bp_span = max_bp_span )
+                assert( p.banded ) # outside pass for bpp and derivatives also stays in band
+                assert( get_semiring_partition( p, 'max' ).banded ) # MFE fill and backtrack also stay in band
+                p_ref = partition( sequence, params = params, mfe = True, count_states = True, calc_bpp = True, deriv_params = [], suppress_all_output = True, max_bp_span = max_bp_span, outside = False, use_simple_recursions = use_simple_recursions )
+                assert( not p_ref.banded )
+                assert_equal( p.Z, p_ref.Z, 1.0e-12 )
+                for i in range( p.N ):
+                    for j in range( p.N ): assert_equal( p.bpp[i][j], p_ref.bpp[i][j], 1.0e-9 )
+                for (log_deriv, log_deriv_ref) in zip( p.log_derivs, p_ref.log_derivs ): assert_equal( log_deriv, log_deriv_ref, 1.0e-9 )
+                assert( p.bps_MFE == p_ref.bps_MFE )
+                assert_equal( p.dG_MFE, p_ref.dG_MFE, 1.0e-12 )
+                assert_equal( p.num_states, p_ref.num_states, 1.0e-12 )
+                for (i,j) in p.bps_MFE: assert( j - i <= max_bp_span )
+                for i in range( p_ref.N ):
+                    for j in range( p_ref.N ):
+                        if abs( i - j ) > max_bp_span: assert( p_ref.bpp[i][j] == 0.0 )
+            p = partition( sequence, params = params, suppress_all_output = True, max_bp_span = 40 )
+            p_ref = partition( sequence, params = params, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+            assert_equal( p.Z, p_ref.Z, 1.0e-12 )
+
+def test_local_fold( verbose = False, use_simple_recursions = False ):
+    from zetafold.local_fold import local_fold
+    print()
+    print( 'Check that sliding-window folding (reusing elements of previous window) matches average over separately folded windows' )
+    sequence = 'GGGAAACCCAGCUUCGGCUGGAAGCGCAAGCGCU'
+    N = len( sequence )
+    for (window_size, max_bp_span, params) in [ (12, None, 'v0.171'), (16, 8, 'v0.171'), (24, 6, 'v0.171'), (12, None, '') ]:
+        n_windows = N - window_size + 1
+        bpp_ref      = [ [0.0]*N for i in range( N ) ]
+        unpaired_ref = [ 0.0 ]*N
+        num_windows  = [ [0]*N for i in range( N ) ]
+        for s in range( n_windows ):
+            p = partition( sequence[ s : s+window_size ], params = params, calc_bpp = True, suppress_all_output = True, max_bp_span = max_bp_span, use_simple_recursions = use_simple_recursions )
+            for i in range( window_size ):
+                unpaired_ref[ s+i ] += 1.0 - sum( p.bpp[i] )
+                for j in range( window_size ):
+                    bpp_ref[ s+i ][ s+j ] += p.bpp[i][j]
+                    num_windows[ s+i ][ s+j ] += 1
+
+        count = 0
+        for (i, p_unpaired, bpp_row) in local_fold( sequence, window_size, params = params, max_bp_span = max_bp_span ):
+            assert( i == count )
+            count += 1
+            assert_equal( p_unpaired, unpaired_ref[i] / num_windows[i][i], 1.0e-9 )
+            for j in range( i+1, N ):
+                if num_windows[i][j] == 0: assert( not j in bpp_row )
+                else: assert_equal( bpp_row.get( j, 0.0 ), bpp_ref[i][j] / num_windows[i][j], 1.0e-9 )
+        assert( count == N )
+
+def test_local_fold_shift( verbose = False, use_simple_recursions = False ):
+    from zetafold.local_fold import shift_possible_types
+    print()
+    print( 'Check that candidate base pairs and motifs shifted over from previous window match those computed from scratch' )
+    sequence = 'GGGAAACCCAGCUUCGGCUGGAAGCGCAAGCGCUACGGAAACCGUAG'
+    window_size = 30
+    for (params, max_bp_span) in [ ( '', None ), ( '', 12 ), ( 'zetafold_v0.31', None ) ]:
+        params = get_params( params, suppress_all_output = True )
+        p_prev = None
+        for s in range( len( sequence ) - window_size + 1 ):
+            p = Partition( sequence[ s : s+window_size ], params )
+            p.max_bp_span = max_bp_span
+            initialize_sequence_information( p )
+            initialize_force_base_pair( p )
+            initialize_possible_base_pair_types( p )
+            initialize_possible_motif_types( p )
+            if p_prev != None:
+                p_shift = Partition( p.sequences, params )
+                p_shift.max_bp_span = max_bp_span
+                initialize_sequence_information( p_shift )
+                initialize_force_base_pair( p_shift )
+                shift_possible_types( p_shift, p_prev )
+                for base_pair_type in p.base_pair_types:
+                    for (X, X_shift) in zip( p.possible_base_pair_indices[ base_pair_type ] + p.possible_motif_indices[ base_pair_type ],
+                                             p_shift.possible_base_pair_indices[ base_pair_type ] + p_shift.possible_motif_indices[ base_pair_type ] ):
+                        assert( np.array_equal( X, X_shift ) )
+            p_prev = p
+
+def test_forced_base_pairs( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that forced base pairs allow exactly the base pairs that do not cross them or reuse their positions' )
+    structure = '((..)..(...))..(.)'
+    N = len( structure )
+    bp_list = bps_from_secstruct( structure )
+    in_forced_base_pair = [ False ] * N
+    for i,j in bp_list: in_forced_base_pair[i] = in_forced_base_pair[j] = True
+    def crosses( m, n, i, j ): return ( i < m < j ) != ( i < n < j ) and not ( m in (i,j) or n in (i,j) )
+    for allow_extra_base_pairs in [ False, True ]:
+        allow_base_pair = ForcedBasePairs( bp_list, N, allow_extra_base_pairs )
+        for m in range( N ):
+            for n in range( N ):
+                if m == n: continue
+                allowed_ref = (min(m,n),max(m,n)) in bp_list
+                if allow_extra_base_pairs and not in_forced_base_pair[m] and not in_forced_base_pair[n]:
+                    allowed_ref = not any( crosses( m, n, i, j ) for (i,j) in bp_list )
+                assert( allow_base_pair[m][n] == allowed_ref )
+                assert( allow_base_pair.allowed( m, n ) == allowed_ref )
+
+def test_semirings( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check max-product MFE and count of model states against enumeration of all states' )
+    from zetafold.backtrack import enumerative_backtrack
+    for (sequence, circle) in [ ('GCUCAGUGAGAGC', False), ('CAAUGCUCAUUGGG', True), (['GGGAAC','GUUCCC'], False) ]:
+        p = partition( sequence, circle = circle, mfe = True, count_states = True, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        p_bps = enumerative_backtrack( p )
+        assert_equal( p.num_states, len( p_bps ), 1.0e-6 )
+        ( p_MFE, bps_MFE ) = max( p_bps, key = lambda x: x[0] )
+        assert( sorted( bps_MFE ) == p.bps_MFE )
+        assert_equal( p.dG_MFE, -KT_IN_KCAL * log( p_MFE * p.Z ), 1.0e-6 )
+
+def test_traceback( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that mfe and stochastic backtracks do not recurse' )
+    import sys
+    from zetafold.backtrack import traceback
+    import inspect
+    p = partition( 'G'*30 + 'AAAA' + 'C'*30, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    backtrack_info = p.Z_final.get_backtrack_info( p, 0 )
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit( len( inspect.stack() ) + 25 ) # recursion would need > 30 levels for 30 stacked pairs
+    try:
+        for mode in [ 'mfe', 'stochastic' ]:
+            p_bps = traceback( p, backtrack_info, mode )
+            assert( len( p_bps ) == 1 and len( p_bps[0][1] ) > 0 )
+    finally:
+        sys.setrecursionlimit( recursion_limit )
+
+def test_boltzmann_samples( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check batched Boltzmann samples against probabilities from enumeration' )
+    from zetafold.backtrack import boltzmann_samples, enumerative_backtrack
+    p = partition( 'GGGAAACCCAGCUUCGGCUGG', suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    p_enumerate = {}
+    for (p_bps,bps) in enumerative_backtrack( p ):
+        bps = tuple( sorted( bps ) )
+        p_enumerate[ bps ] = p_enumerate.get( bps, 0.0 ) + p_bps
+    n_samples = 4000
+    counts = boltzmann_samples( p, n_samples, seed = 1 )
+    assert( sum( counts.values() ) == n_samples )
+    assert( counts == boltzmann_samples( p, n_samples, seed = 1 ) )
+    for (bps,count) in counts.most_common( 3 ): assert( abs( float( count )/n_samples - p_enumerate[ bps ] ) < 0.03 )
+    counts_jobs = boltzmann_samples( p, n_samples, seed = 1, jobs = 2 )
+    assert( sum( counts_jobs.values() ) == n_samples )
+    assert( counts_jobs == boltzmann_samples( p, n_samples, seed = 1, jobs = 2 ) )
+    # worker processes that are not forked get a pickled copy of the partition through the Pool initializer
+    import pickle
+    from zetafold.backtrack import initialize_sampling_worker, run_sampling_task, _boltzmann_draws
+    initialize_sampling_worker( pickle.loads( pickle.dumps( p, pickle.HIGHEST_PROTOCOL ) ) )
+    assert( run_sampling_task( ( 100, 7 ) ) == _boltzmann_draws( p, 100, 7 ) )
+
+def test_enumeration_cutoff( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that pruned enumeration gives same structures as full enumeration above cutoff' )
+    from zetafold.backtrack import enumerate_structures
+    for (sequence, circle) in [ ('GCUCAGUGAGAGC', False), ('CAAUGCUCAUUGGG', True) ]:
+        p = partition( sequence, circle = circle, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        p_bps = list( enumerate_structures( p ) )
+        assert_equal( sum( p_bp[0] for p_bp in p_bps ), 1.0 )
+        for p_cutoff in [ 0.001, 0.01, 0.1 ]:
+            assert( list( enumerate_structures( p, p_cutoff ) ) == [ p_bp for p_bp in p_bps if p_bp[0] >= p_cutoff ] )
+        dG_gap_cutoff = 1.0
+        for (p_bp,bps) in enumerate_structures( p, dG_gap_cutoff = dG_gap_cutoff ):
+            assert( -KT_IN_KCAL * log( p_bp ) <= dG_gap_cutoff )
+
+def test_k_best( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check k best structures against sorted enumeration' )
+    from zetafold.backtrack import enumerate_structures, k_best_backtrack
+    for (sequence, circle) in [ ('GCUCAGUGAGAGC', False), ('CAAUGCUCAUUGGG', True) ]:
+        p = partition( sequence, circle = circle, mfe = True, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        p_enumerate = sorted( [ p_bp[0] for p_bp in enumerate_structures( p ) ], reverse = True )
+        p_k_best = [ p_bp[0] for p_bp in k_best_backtrack( p, 20 ) ]
+        assert( len( p_k_best ) == 20 )
+        for (p1,p2) in zip( p_k_best, p_enumerate ): assert_equal( p1, p2 )
+        p_struct = p.k_best( 5 )
+        assert( len( set( struct for (p_bp,struct) in p_struct ) ) == 5 )
+        assert( p_struct[0][1] == p.struct_MFE )
+
+def test_log_derivs_subset( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check that derivatives for a few parameters match the same entries in the full derivative vector' )
+    for (sequence, circle) in [ ('GCUCAGUGAGAGC', True), ('GGGAAACCCAGCUUCGGCUGG', False) ]:
+        p = partition( sequence, circle = circle, params = 'v0.31', deriv_params = [], outside = False, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        deriv_params = [ 'C_eff_motif_NN_NNN', 'Kd_GU', 'C_eff_stack_CG_CG', 'l', 'C_init', 'Kd_CG' ]
+        log_derivs = p.get_log_derivs( deriv_params )
+        for (tag, log_deriv) in zip( deriv_params, log_derivs ):
+            assert_equal( log_deriv, p.log_derivs[ p.params.parameter_tags.index( tag ) ], 1.0e-12 )
+
+def test_outside_recursions( verbose = False, use_simple_recursions = False ):
+    print()
+    print( 'Check expected parameter counts from generated outside recursions against hand-derived formulas and vectorized outside pass' )
+    for (sequence, circle, params) in [ ('GGAGCAAACUCCAAAGGCGAAAGCCUU', True, 'v0.31'), ('UGGCGAAAGCCU', True, ''), ('GGGAAACCCAGCUUCGGCUGG', False, 'v0.31') ]:
+        p = partition( sequence, circle = circle, params = params, deriv_params = [], outside = False, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        counts = get_expected_counts( p )
+        counts_check = get_expected_counts_from_matrices( p )
+        for tag in counts_check: assert( np.allclose( counts[ tag ], counts_check[ tag ], rtol = 1.0e-6, atol = 1.0e-9 ) )
+        if circle or use_simple_recursions: continue
+        p = partition( sequence, circle = circle, params = params, deriv_params = [], outside = True, suppress_all_output = True )
+        counts_check = get_expected_counts( p )
+        for tag in counts_check: assert( np.allclose( counts[ tag ], counts_check[ tag ], rtol = 1.0e-6, atol = 1.0e-9 ) )
+
+def test_recursions_checksum( verbose = False, use_simple_recursions = False ):
+    from zetafold.recursions.checksum import get_stale_copies, get_recursions_checksum
+    print()
+    print( 'Check that hand-written copies of the recursions (vectorized, wavefront, banded, outside) match recursions.py' )
+    stale_copies = get_stale_copies()
+    if stale_copies: print( 'Update these to match recursions.py, then set RECURSIONS_CHECKSUM = %s: %s' % ( repr( get_recursions_checksum() ), ', '.join( stale_copies ) ) )
+    assert( len( stale_copies ) == 0 )
+
 def all_tests_zetafold(verbose, use_simple_recursions):
     for key, value in globals().items():
         if callable(value) and key.startswith('test_'):
@@ -5,7 +5,6 @@ from zetafold.data.training_examples import *
 from zetafold.training import *
 from scipy.optimize import minimize
 import numpy as np
-from multiprocessing import Pool
 import math
 import argparse
 import __builtin__
@@ -28,12 +27,11 @@ parser.add_argument("--allow_extra_base_pairs",action='store_true',default=False
 parser.add_argument("--use_priors",action='store_true', help='add priors to force log parameters to stay in reasonable bounds.')
 parser.add_argument("--use_bounds",action='store_true', help='force log parameters to stay in reasonable bounds; not applied to BFGS')
 parser.add_argument("--method",type=str,default='BFGS',help="Minimization routine")
+parser.add_argument("--production",action='store_true', default=False, help='No MFE or per-example output during loss evaluations; diagnostics go to --report_file')
+parser.add_argument("--report_file",type=str,default='training_report.txt',help="File for MFE structures and dG gaps in --production mode")
+parser.add_argument("--report_every",type=int,default=0,help="In --production mode, report every this many iterations (0 = only at end)")
 args     = parser.parse_args()
 
-# pool of CPU's to use. for testing on local machines, specify -j1 to get builtin CPU -- allows ctrl-c to cancel.
-pool = __builtin__
-if args.jobs > 1: pool = Pool( args.jobs )
-
 # set up parameter file
 params = get_params( args.parameters, suppress_all_output = True )
 if args.no_coax: params.set_parameter( 'K_coax', 0.0 )
@@ -45,18 +43,30 @@ x0                = initialize_parameter_values( params, train_parameters, args.
 bounds = get_bounds( train_parameters ) if args.use_bounds else None
 priors = get_priors( train_parameters ) if args.use_priors else None
 
+# pool of CPU's to use, each holding the training examples. for testing on local machines, specify -j1 to get builtin CPU -- allows ctrl-c to cancel.
+pool = get_training_pool( args.jobs, params, train_parameters, training_examples, args.allow_extra_base_pairs, args.production )
+if args.jobs <= 1: pool = __builtin__
+
 loss = lambda x:free_energy_gap(      x,params,train_parameters,training_examples,args.allow_extra_base_pairs,priors,pool,args.outfile)
-grad = lambda x:free_energy_gap_deriv(x,params,train_parameters,training_examples,args.allow_extra_base_pairs,priors,pool)
-jac = grad if args.use_derivs else None
+# loss and gradient from one evaluation of each training example, cached on x.
+loss_and_grad = memoize_loss_and_grad( lambda x:free_energy_gap_and_deriv(x,params,train_parameters,training_examples,args.allow_extra_base_pairs,priors,pool,args.outfile) )
+grad = lambda x:loss_and_grad( x )[1]
+report = lambda x,iteration:report_training(x,params,train_parameters,training_examples,pool,args.report_file if args.production else None,iteration)
 
 if args.deriv_check: train_deriv_check( x0, loss, grad, train_parameters )
 if args.evaluate:
-    loss( x0 )
+    print( 'Loss:', loss( x0 ) )
+    report( x0, 'evaluate' )
     exit(0)
 
 create_outfile( args.outfile, params, train_parameters )
-result = minimize( loss, x0, method = args.method, jac = jac, bounds = bounds )
+callback = get_report_callback( args.report_every, report )
+if args.use_derivs:
+    result = minimize( loss_and_grad, x0, method = args.method, jac = True, bounds = bounds, callback = callback )
+else:
+    result = minimize( loss, x0, method = args.method, bounds = bounds, callback = callback )
 final_loss = result.fun
+report( result.x, 'final' )
 
 print(result)
 print('Final parameters:', result.x, 'Loss:',final_loss )
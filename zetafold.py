@@ -11,15 +11,23 @@ if __name__ =='__main__':
     parser.add_argument("-params","--parameters",type=str, default='', help='Parameter file to use [default: '', which triggers latest version]')
     parser.add_argument("-struct","--structure",type=str, default=None, help='force specific structure in dot-parens notation')
     parser.add_argument("--allow_extra_base_pairs",action='store_true',default=False, help='allow base pairs compatible with --structure')
-    parser.add_argument("--mfe", action='store_true', default=False, help='Get minimal free energy structure (approximately, backtracking through partition)')
+    parser.add_argument("--mfe", action='store_true', default=False, help='Get minimal free energy structure (max-product dynamic programming and backtrack)')
+    parser.add_argument("--count_states", action='store_true', default=False, help='Count number of model states (each set of base pairs counts once for each way of stacking, forming motifs, etc.)')
     parser.add_argument("--calc_gap_structure",type=str, default=None, help='Compute energy gap to supplied structure')
     parser.add_argument("--bpp", action='store_true', default=False, help='Get base pairing probability')
     parser.add_argument("--stochastic", type=int, default=0, help='Number of Boltzman-weighted stochastic structures to retrieve')
+    parser.add_argument("--seed", type=int, default=None, help='Random seed for --stochastic [default: random]')
+    parser.add_argument("--jobs","-j", type=int, default=1, help='Number of processes to split --stochastic samples over')
+    parser.add_argument("--k_best", type=int, default=0, help='Number of most probable model states to retrieve (best-first backtrack); each structure is listed once, ranked by its most probable state')
     parser.add_argument("--enumerate",action='store_true', default=False, help='Backtrack to get all structures and their Boltzmann weights')
+    parser.add_argument("--enumerate_dG_gap",type=float, default=None, help='With --enumerate, only get structures within this free energy (kcal/mol) of ensemble')
     parser.add_argument("--calc_deriv", action='store_true', default=False, help='Calculate derivative with respect to all parameters')
     parser.add_argument("--no_coax", action='store_true', default=False, help='Turn off coaxial stacking')
     parser.add_argument("-v","--verbose", action='store_true', default=False, help='output dynamic programming matrices')
     parser.add_argument("--simple", action='store_true', default=False, help='Use simple recursions (slow!)')
+    parser.add_argument("--engine",type=str, default='explicit', choices=['explicit','numpy','vectorized','wavefront','jit'], help='Storage/update engine for dynamic programming [default: explicit]')
+    parser.add_argument("--max_bp_span",type=int, default=None, help='Maximum base pair span |i-j| (banded folding, for long sequences) [default: no limit]')
+    parser.add_argument("--no_outside", action='store_true', default=False, help='For linear sequences, get bpp and derivatives by filling wrap-around elements, as for circles, rather than with outside pass')
     parser.add_argument("--bpp_file",type=str, default=None, help='File where bpp output will be stored')
     parser.add_argument("--calc_Kd_deriv_DP", action='store_true', default=False, help='Calculate derivative with respect to Kd_BP inline with dynamic programming [rarely used]')
     parser.add_argument("--deriv_params",help="Parameters for which to calculate derivatives. Default: None, or all params if --calc_deriv",nargs='*')
@@ -29,6 +37,6 @@ if __name__ =='__main__':
     if args.calc_deriv and args.deriv_params == None: args.deriv_params = []
 
     if args.sequences != None: # run tests
-        p = partition( args.sequences, circle = args.circle, params = args.parameters, verbose = args.verbose, mfe = args.mfe, calc_bpp = args.bpp, n_stochastic = int(args.stochastic), do_enumeration = args.enumerate, structure = args.structure, allow_extra_base_pairs = args.allow_extra_base_pairs, calc_gap_structure = args.calc_gap_structure, deriv_params = args.deriv_params, no_coax = args.no_coax, use_simple_recursions = args.simple, deriv_check = args.deriv_check, bpp_file = args.bpp_file  )
+        p = partition( args.sequences, circle = args.circle, params = args.parameters, verbose = args.verbose, mfe = args.mfe, calc_bpp = args.bpp, n_stochastic = int(args.stochastic), do_enumeration = args.enumerate, structure = args.structure, allow_extra_base_pairs = args.allow_extra_base_pairs, calc_gap_structure = args.calc_gap_structure, deriv_params = args.deriv_params, no_coax = args.no_coax, use_simple_recursions = args.simple, deriv_check = args.deriv_check, bpp_file = args.bpp_file, engine = args.engine, max_bp_span = args.max_bp_span, outside = not args.no_outside, count_states = args.count_states, stochastic_seed = args.seed, stochastic_jobs = args.jobs, enumeration_dG_gap = args.enumerate_dG_gap, k_best = args.k_best  )
     else:
         test_zetafold( verbose = args.verbose, use_simple_recursions = args.simple )
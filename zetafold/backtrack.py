@@ -1,105 +1,357 @@
 from .recursions.explicit_recursions import *
+from .util.constants import KT_IN_KCAL
+from collections import Counter
+from bisect import bisect_right
+import heapq
+from math import exp
 import random
 import sys
 
 
 ##################################################################################################
-def backtrack( self, backtrack_info_input, mode = 'mfe' ):
-    '''
-    modes are:
-      mfe = backtrack, following maximum boltzmann weight. note that this is not *quite* MFE
-      stochastic  = choose track based on boltzmann weights
-      enumerative = follow all tracks!
-    '''
-    #print_backtrack_info( backtrack_info_input )
-    if len( backtrack_info_input ) == 0: return []
-    contrib_sum = sum( contrib[0] for contrib in backtrack_info_input )
-    if   mode == 'enumerative':
-        backtrack_info = [ contrib for contrib in backtrack_info_input ] # like a deepcopy
-    elif mode == 'mfe':         backtrack_info = [ max_contrib(backtrack_info_input) ]
-    elif mode == 'stochastic' : backtrack_info = [ get_random_contrib( backtrack_info_input ) ]
-    p_bps = [] # list of tuples of (p_structure, bps_structure) for each structure
-    N = self.N
-
-    for contrib in backtrack_info: # each option ('contribution' to this partition function of this sub-region)
-        if ( contrib[0] == 0.0 ): continue
-        p_contrib = contrib[0]/contrib_sum
-        p_bps_contrib = [ [p_contrib,[]] ]
+def traceback( self, backtrack_info_input, mode = 'mfe', choose_contrib = None ):
+    '''
+    Follow a single track from backtrack_info_input, as list [ [p, bps] ]:
+      mfe        = follow maximum contribution at each cell (exact MFE after a 'max' semiring fill)
+      stochastic = choose contributions based on boltzmann weights
+    Branches wait on an explicit stack instead of recursion, so time is linear in number of
+     visited cells and long sequences do not hit the recursion limit. Base pairs go into
+     one preallocated buffer.
 
-        # each 'branch'; e.g., C_eff(i,k) Z_BP(k+1, j) has a C_eff and a Z_BP branch
-        for backtrack_info in contrib[1]:
-            ( Z_backtrack, i, j )  = backtrack_info
+    choose_contrib( backtrack_info ) returns ( index of contribution, probability of contribution ) --
+     default follows mode; see BoltzmannSampler for the version used for many samples.
+    '''
+    if choose_contrib == None:
+        choose_contrib = choose_max_contrib if mode == 'mfe' else choose_random_contrib
+    N = self.N
+    NN = N * N
+    ( Z_backtrack, base_pair_types ) = ( self.Z_backtrack, self.Z_backtrack_base_pair_type ) # see decode_backtrack_code()
+    bps = [ None ] * ( N//2 + 1 ) # at most N/2 base pairs
+    num_bps = 0
+    p = 1.0
+    stack = [] # codes of 'branches' still to follow; e.g., C_eff(i,k) Z_BP(k+1, j) has a C_eff and a Z_BP branch
+    backtrack_info = backtrack_info_input
+    while backtrack_info != None:
+        if len( backtrack_info ) > 0:
+            ( n, p_contrib ) = choose_contrib( backtrack_info )
+            if backtrack_info.weights[ n ] > 0.0:
+                p *= p_contrib
+                stack.extend( backtrack_info.codes[ backtrack_info.starts[n] : backtrack_info.starts[n+1] ][::-1] ) # last pushed is followed first
+            elif backtrack_info is backtrack_info_input: return []
+        backtrack_info = None
+        while stack:
+            ( m, ij ) = divmod( stack.pop(), NN )
+            ( i, j ) = divmod( ij, N )
             if ( i == j ): continue
-            for base_pair_type in self.params.base_pair_types:
-                if Z_backtrack == self.Z_BPq[ base_pair_type ]:
-                    base_pair = [i%N,j%N]
-                    base_pair.sort()
-                    # TODO: could also add type of base pair here -- we have the info!
-                    p_bps_contrib = [ [p_bp[0], p_bp[1]+[tuple( base_pair )] ] for p_bp in p_bps_contrib ]
-            next_backtrack_info = Z_backtrack.get_backtrack_info(self,i%N,j%N)
-            p_bps_component = backtrack( self, next_backtrack_info, mode ) # recursion!
-            if len( p_bps_component ) == 0: continue
-            # put together all branches
-            p_bps_contrib_new = []
-            for p_bps1 in p_bps_contrib:
-                for p_bps2 in p_bps_component:
-                    p_bps_contrib_new.append( [p_bps1[0]*p_bps2[0], p_bps1[1]+p_bps2[1]] )
-            p_bps_contrib = p_bps_contrib_new
-
-        p_bps += p_bps_contrib
-    return p_bps
+            if base_pair_types[ m ] != None:
+                bps[ num_bps ] = ( min( i, j ), max( i, j ) )
+                num_bps += 1
+            backtrack_info = Z_backtrack[ m ].get_backtrack_info( self, i, j )
+            break
+    return [ [p, bps[:num_bps] ] ]
 
 ##################################################################################################
 def mfe( self, Z_final_contrib ):
-    p_bps = backtrack( self, Z_final_contrib, mode = 'mfe' )
+    p_bps = traceback( self, Z_final_contrib, mode = 'mfe' )
     assert( len(p_bps) == 1 )
     p,bps = p_bps[0]
     bps.sort()
     return (bps,p)
 
 ##################################################################################################
-def boltzmann_sample( self, Z_final_contrib ):
-    p_bps = backtrack( self, Z_final_contrib, mode = 'stochastic' )
-    assert( len(p_bps) == 1 )
-    return (p_bps[0][1],p_bps[0][0])
+def boltzmann_samples( self, n_samples, seed = None, jobs = 1 ):
+    '''
+    Draw n_samples Boltzmann-weighted structures, returned as Counter of { tuple of base pairs : count }.
+    See boltzmann_draws().
+    '''
+    return Counter( boltzmann_draws( self, n_samples, seed, jobs ) )
+
+def boltzmann_draws( self, n_samples, seed = None, jobs = 1 ):
+    '''
+    Draw n_samples Boltzmann-weighted structures, returned in draw order as list of tuples of base pairs.
+
+    Cumulative weights of contributions at each visited cell are built once and reused (BoltzmannSampler).
+    With jobs > 1, samples are split across worker processes, each with its own random number
+     generator, and the draws of each worker follow those of the one before; results are reproducible
+     for given seed and jobs. Workers get the partition through the Pool initializer -- pickled, if
+     processes are not forked.
+    '''
+    rng = random.Random( seed )
+    if jobs <= 1: return _boltzmann_draws( self, n_samples, rng.getrandbits( 64 ) )
+    from multiprocessing import Pool
+    n_per_job = [ n_samples//jobs + ( 1 if n < n_samples % jobs else 0 ) for n in range( jobs ) ]
+    pool = Pool( jobs, initializer = initialize_sampling_worker, initargs = ( self, ) )
+    try:
+        draws = pool.map( run_sampling_task, [ ( n, rng.getrandbits( 64 ) ) for n in n_per_job ] )
+    finally:
+        pool.close()
+        pool.join()
+    return [ bps for job_draws in draws for bps in job_draws ]
+
+sampling_worker = {} # partition for this worker process
+
+def initialize_sampling_worker( partition ):
+    sampling_worker[ 'partition' ] = partition
+
+def run_sampling_task( task ):
+    ( n_samples, seed ) = task
+    return _boltzmann_draws( sampling_worker[ 'partition' ], n_samples, seed )
+
+def _boltzmann_draws( self, n_samples, seed ):
+    sampler = BoltzmannSampler( random.Random( seed ) )
+    backtrack_info = self.Z_final.get_backtrack_info( self, 0 )
+    draws = []
+    for n in range( n_samples ):
+        p_bps = traceback( self, backtrack_info, 'stochastic', sampler )
+        if len( p_bps ) == 0: continue
+        draws.append( tuple( sorted( p_bps[0][1] ) ) )
+    return draws
+
+class BoltzmannSampler:
+    '''
+    Chooses a contribution with probability proportional to its weight, by binary search in
+     cumulative weights. Cumulative weights for each backtrack_info are computed when first seen and then cached.
+    '''
+    def __init__( self, rng = random ):
+        self.rng = rng
+        self.cumsum = {} # id(backtrack_info) -> ( backtrack_info, cumulative weights )
+
+    def __call__( self, backtrack_info ):
+        cached = self.cumsum.get( id( backtrack_info ) )
+        if cached == None:
+            contrib_cumsum = []
+            psum = 0.0
+            for weight in backtrack_info.weights:
+                psum += weight
+                contrib_cumsum.append( psum )
+            cached = ( backtrack_info, contrib_cumsum ) # keep backtrack_info, so its id is not reused
+            self.cumsum[ id( backtrack_info ) ] = cached
+        contrib_cumsum = cached[1]
+        n = min( bisect_right( contrib_cumsum, self.rng.random() * contrib_cumsum[-1] ), len( contrib_cumsum ) - 1 )
+        return ( n, backtrack_info.weights[n]/contrib_cumsum[-1] if contrib_cumsum[-1] > 0.0 else 0.0 )
 
 ##################################################################################################
-def enumerative_backtrack( self ):
-    return backtrack( self, self.Z_final.get_backtrack_info(self,0), 'enumerative' )
+def enumerative_backtrack( self, p_cutoff = 0.0 ):
+    return [ [p, bps] for (p, bps) in enumerate_structures( self, p_cutoff ) ]
+
+def enumerate_structures( self, p_cutoff = 0.0, dG_gap_cutoff = None ):
+    '''
+    Generator over (probability, base pairs) of all structures, in order of contributions and depth-first,
+     so that only the current partial structures are held in memory.
+
+    Structures with probability below p_cutoff, or with free energy more than dG_gap_cutoff (kcal/mol) above
+     the ensemble free energy, are skipped. Partial structures are pruned as soon as their probability times the
+     best possible probability of their unfinished branches (get_max_p) falls below the cutoff.
+    See follow_branches() for how partial structures are stored.
+    '''
+    if dG_gap_cutoff != None: p_cutoff = max( p_cutoff, exp( -dG_gap_cutoff / KT_IN_KCAL ) )
+    max_p = {}
+    contribs = {}
+    stack = [ get_root_state( self, max_p, contribs, False ) ]
+    while stack:
+        ( p, bps, pending, choice, r ) = stack.pop()
+        if choice == None:
+            yield ( p, get_bps_list( bps ) )
+            continue
+        if r + 1 < len( choice ): stack.append( ( p, bps, pending, choice, r + 1 ) ) # next contribution, after this one is done
+        p_bound = get_p_bound( p, bps, pending, choice, r )
+        if p_bound == 0.0 or p_bound < p_cutoff: continue
+        stack.append( follow_branches( self, p, bps, pending, choice[ r ], max_p, contribs, False ) )
+
+def k_best_backtrack( self, k, unique = False ):
+    '''
+    The k most probable states of the model as list of (probability, base pairs), most probable first.
 
+    Best-first search over partial structures, as in k-best parsing: partial structures wait in a priority
+     queue, ordered by their probability times the best possible probability of their unfinished branches
+     (get_max_p). That bound is exact, so each structure popped off the queue complete is the next best.
+    Alternatives are pushed lazily: contributions at each cell are sorted by their bound, and the next one
+     is only pushed when the one before it is popped, so each pop pushes at most two partial structures.
+
+    Note that results are states of the model, not secondary structures -- e.g., the same base pairs with and
+     without coaxial stacks appear separately. With unique = True, each set of base pairs is returned once,
+     with the probability of its most probable state (not summed over its states), and ranked by that.
+    '''
+    max_p = {}
+    choices = {}
+    ( p, bps, pending, choice, r ) = get_root_state( self, max_p, choices, True )
+    queue = [ ( -get_p_bound( p, bps, pending, choice, r ), 0, ( p, bps, pending, choice, r ) ) ]
+    num_pushed = 1 # tie-breaker, so that states are not compared
+    p_bps = []
+    found = set()
+    while queue and len( p_bps ) < k:
+        ( p, bps, pending, choice, r ) = heapq.heappop( queue )[2]
+        if choice == None:
+            bps = get_bps_list( bps )
+            if unique:
+                bps_sorted = tuple( sorted( bps ) )
+                if bps_sorted in found: continue
+                found.add( bps_sorted )
+            p_bps.append( ( p, bps ) )
+            continue
+        if r + 1 < len( choice ):
+            p_bound = get_p_bound( p, bps, pending, choice, r + 1 )
+            if p_bound > 0.0:
+                heapq.heappush( queue, ( -p_bound, num_pushed, ( p, bps, pending, choice, r + 1 ) ) )
+                num_pushed += 1
+        next_state = follow_branches( self, p, bps, pending, choice[ r ], max_p, choices, True )
+        p_bound = get_p_bound( *next_state )
+        if p_bound == 0.0: continue
+        heapq.heappush( queue, ( -p_bound, num_pushed, next_state ) )
+        num_pushed += 1
+    return p_bps
+
+##################################################################################################
+# Partial structures for enumeration and k-best are ( p, bps, pending, choice, r ):
+#   p       = product of probabilities of contributions chosen so far
+#   bps     = base pairs so far, as linked list ( base pair, rest of list ), most recent first, or None
+#   pending = branches (Z, i, j) still to follow, as linked list ( code, bound, rest of list ) or None,
+#              where bound is the product of get_max_p() over this branch and the rest of the list
+#   choice  = contributions to choose from next, as list of ( bound, p_contrib, n, backtrack_info ) (see get_choice()),
+#              or None if the structure is complete
+#   r       = which contribution in choice to take next.
+# Partial structures share their lists, so a step does not copy the base pairs or branches found so far.
+##################################################################################################
+def get_root_state( self, max_p, choices, sort ):
+    backtrack_info = self.Z_final.get_backtrack_info( self, 0 )
+    if len( backtrack_info ) == 0: return ( 1.0, None, None, None, 0 )
+    return ( 1.0, None, None, get_choice( self, backtrack_info, max_p, choices, sort ), 0 )
+
+def follow_branches( self, p, bps, pending, contrib, max_p, choices, sort ):
+    '''
+    Take contribution contrib = ( bound, p_contrib, n, backtrack_info ) of the current choice, then follow pending branches
+     until a cell with more than one contribution. Returns the next partial structure.
+    '''
+    N = self.N
+    NN = N * N
+    ( Z_backtrack, base_pair_types ) = ( self.Z_backtrack, self.Z_backtrack_base_pair_type ) # see decode_backtrack_code()
+    while True:
+        ( bound, p_contrib, n, backtrack_info ) = contrib
+        p *= p_contrib
+        ( codes, starts ) = ( backtrack_info.codes, backtrack_info.starts )
+        for m in range( starts[n+1] - 1, starts[n] - 1, -1 ): # first branch of contribution ends up on top
+            code = codes[ m ]
+            pending = ( code, max_p[ code ] * ( pending[1] if pending != None else 1.0 ), pending )
+        choice = None
+        while pending != None:
+            ( m, ij ) = divmod( pending[0], NN )
+            pending = pending[2]
+            ( i, j ) = divmod( ij, N )
+            if ( i == j ): continue
+            if base_pair_types[ m ] != None: bps = ( ( min( i, j ), max( i, j ) ), bps )
+            backtrack_info = Z_backtrack[ m ].get_backtrack_info( self, i, j )
+            if len( backtrack_info ) == 0: continue
+            choice = get_choice( self, backtrack_info, max_p, choices, sort )
+            break
+        if choice == None or len( choice ) != 1: return ( p, bps, pending, choice, 0 )
+        contrib = choice[0]
+
+def get_choice( self, backtrack_info, max_p, choices, sort ):
+    '''
+    Contributions with nonzero weight in backtrack_info, as list of ( bound, p_contrib, n, backtrack_info ), where
+     bound is p_contrib times get_max_p() of each branch of contribution n. With sort, highest bound comes first;
+     otherwise list is in order of contributions. Cached in choices.
+    '''
+    cached = choices.get( id( backtrack_info ) )
+    if cached != None: return cached[1]
+    ( weights, codes, starts ) = ( backtrack_info.weights, backtrack_info.codes, backtrack_info.starts )
+    contrib_sum = sum( weights )
+    choice = []
+    for n in range( len( weights ) ):
+        if ( weights[n] == 0.0 ): continue
+        p_contrib = weights[n]/contrib_sum
+        bound = p_contrib
+        for m in range( starts[n], starts[n+1] ): bound *= get_max_p( self, codes[m], max_p )
+        choice.append( ( bound, p_contrib, n, backtrack_info ) )
+    if sort: choice.sort( key = lambda contrib: -contrib[0] )
+    choices[ id( backtrack_info ) ] = ( backtrack_info, choice ) # keep backtrack_info, so its id is not reused
+    return choice
+
+def get_p_bound( p, bps, pending, choice, r ):
+    '''
+    Highest probability of any structure that completes partial structure ( p, bps, pending, choice, r ).
+    '''
+    if choice == None: return p
+    if len( choice ) == 0: return 0.0
+    return p * choice[ r ][0] * ( pending[1] if pending != None else 1.0 )
+
+def get_bps_list( bps ):
+    bps_list = []
+    while bps != None:
+        bps_list.append( bps[0] )
+        bps = bps[1]
+    return bps_list[::-1]
+
+def get_max_p( self, code, max_p ):
+    '''
+    Largest probability, over all ways to backtrack from branch (Z, i, j) packed in code, of the product of
+     probabilities of chosen contributions. Memoized in dict max_p; filled with explicit stack rather than recursion.
+    '''
+    if code in max_p: return max_p[ code ]
+    stack = [ code ]
+    while stack:
+        if stack[-1] in max_p:
+            stack.pop()
+            continue
+        ( Z_backtrack, i, j, base_pair_type ) = decode_backtrack_code( self, stack[-1] )
+        if ( i == j ):
+            max_p[ stack.pop() ] = 1.0
+            continue
+        backtrack_info = Z_backtrack.get_backtrack_info( self, i, j )
+        missing = [ next_code for next_code in backtrack_info.codes if next_code not in max_p ]
+        if len( missing ) > 0:
+            stack += missing
+            continue
+        ( weights, codes, starts ) = ( backtrack_info.weights, backtrack_info.codes, backtrack_info.starts )
+        contrib_sum = sum( weights )
+        p_best = 0.0 if len( weights ) > 0 else 1.0
+        for n in range( len( weights ) ):
+            if ( weights[n] == 0.0 ): continue
+            p_contrib = weights[n]/contrib_sum
+            for k in range( starts[n], starts[n+1] ): p_contrib *= max_p[ codes[k] ]
+            p_best = max( p_best, p_contrib )
+        max_p[ stack.pop() ] = p_best
+    return max_p[ code ]
+
+def decode_backtrack_code( self, code ):
+    '''
+    ( Z, i, j, base_pair_type ) for element (i,j) of matrix Z packed in code (see BacktrackRecords in
+     explicit_dynamic_programming.py). base_pair_type is None unless Z is one of the Z_BPq.
+    '''
+    ( m, ij ) = divmod( code, self.N * self.N )
+    ( i, j ) = divmod( ij, self.N )
+    return ( self.Z_backtrack[ m ], i, j, self.Z_backtrack_base_pair_type[ m ] )
 
 ##################################################################################################
-def get_random_contrib( backtrack_info ):
-    # Random sample weighted by probability. Must be a simple function for this.
-    contrib_cumsum = [ backtrack_info[0][0] ]
-    for contrib in backtrack_info[1:]: contrib_cumsum.append( contrib_cumsum[-1] + contrib[0] )
+def choose_random_contrib( backtrack_info ):
+    weights = backtrack_info.weights
+    contrib_cumsum = [ weights[0] ]
+    for weight in weights[1:]: contrib_cumsum.append( contrib_cumsum[-1] + weight )
     r = random.random() * contrib_cumsum[ -1 ]
-    for (idx,psum) in enumerate( contrib_cumsum ):
-        if r < psum: return backtrack_info[idx]
-
-def max_contrib(backtrack_info):
-    max_contrib_val = None
-    best_contrib = None
-    for c in backtrack_info:
-        if max_contrib_val is None or \
-           c[0] > max_contrib_val:
-            best_contrib = c
-            max_contrib_val = c[0]
-    return best_contrib
-
-def print_contrib( contrib ):
+    for (n,psum) in enumerate( contrib_cumsum ):
+        if r < psum: return ( n, weights[n] / contrib_cumsum[-1] )
+
+def choose_max_contrib( backtrack_info ):
+    weights = backtrack_info.weights
+    n = 0
+    for m in range( 1, len( weights ) ):
+        if weights[m] > weights[n]: n = m
+    return ( n, weights[n] / sum( weights ) if weights[n] > 0.0 else 0.0 )
+
+def print_contrib( self, contrib ):
     sys.stdout.write('[')
     print('%s:' % contrib[0])
-    for n,backtrack_info in enumerate(contrib[1]):
-        sys.stdout.write( '%s(%d,%d)' % (backtrack_info[0].name,backtrack_info[1],backtrack_info[2]) )
+    for n,code in enumerate(contrib[1]):
+        ( Z_backtrack, i, j, base_pair_type ) = decode_backtrack_code( self, code )
+        sys.stdout.write( '%s(%d,%d)' % (Z_backtrack.name,i,j) )
         if n < len( contrib[1] )-1: sys.stdout.write(',')
     sys.stdout.write(']')
 
-def print_backtrack_info( backtrack_info ):
+def print_backtrack_info( self, backtrack_info ):
     print('[ ')
-    for contrib in backtrack_info[:-1]:
-        print_contrib( contrib )
+    for n in range( len( backtrack_info ) - 1 ):
+        print_contrib( self, backtrack_info[n] )
         print('; ')
-    print_contrib( backtrack_info[-1] )
+    print_contrib( self, backtrack_info[-1] )
     print('%s\n' % ' ]')
     return
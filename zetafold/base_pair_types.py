@@ -16,6 +16,13 @@ class BasePairType:
         if self.match_lowercase: return ( s1.islower() and s2.islower() and s1 == s2 )
         return ( s1 == self.nt1 and s2 == self.nt2 )
 
+    def is_match_codes( self, codes1, codes2 ):
+        '''
+        is_match() on arrays of integer sequence codes (see get_sequence_codes() in util/sequence_util.py)
+        '''
+        if self.match_lowercase: return ( codes1 >= ord('a') ) & ( codes1 <= ord('z') ) & ( codes1 == codes2 )
+        return ( codes1 == ord( self.nt1 ) ) & ( codes2 == ord( self.nt2 ) )
+
     def get_tag( self ):
         if self.match_lowercase: return 'matchlowercase'
         return self.nt1+self.nt2
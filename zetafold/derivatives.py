@@ -1,86 +1,51 @@
+import numpy as np
 from .base_pair_types import get_base_pair_type_for_tag, get_base_pair_types_for_tag
-from .motif_types import get_motif_type_for_tag, check_equivalent_C_eff_stack_for_motif_type
+from .motif_types import get_motif_type_for_tag, make_motif_type_tag, check_equivalent_C_eff_stack_for_motif_type
+from .recursions.outside import get_array, fill_outside_recursions
 def _get_log_derivs( self, deriv_parameters = [] ):
     '''
     Output
 
        d( log Z )/ d( log parameter )
 
-    using simple expressions that require O( N^2 ) time or less after
-    the original O( N^3 ) dynamic programming calculations
+    All of these are expected counts of parameters in structures, computed together
+    in one outside (backward) sweep by get_expected_counts() -- each parameter is then a lookup.
+
+    The outside sweep runs the outside recursions generated from recursions.py, with the same O( N^3 ) cost
+    as the fill. The hand-derived formulas in get_expected_counts_from_matrices() and in the vectorized
+    outside pass for linear sequences (use_outside) are kept as checks.
     '''
     if deriv_parameters == None: return None
     if deriv_parameters == []:
         for tag in self.params.parameter_tags: deriv_parameters.append( tag )
 
     derivs = [None]*len(deriv_parameters)
+    counts = get_expected_counts( self )
 
-    # Derivatives with respect to each Kd
-    N = self.N
-    Z = self.Z
     for n,parameter in enumerate(deriv_parameters):
-        if parameter == 'l':
-            # Derivatives with respect to loop closure parameters
-            num_internal_linkages = 0.0
-            for i in range( N ):
-                if not self.ligated[i]: continue
-                num_internal_linkages += self.params.l * self.C_eff_no_coax_singlet.val( i+1, i ) / self.params.C_std / Z
-            derivs[ n ] = num_internal_linkages
-        elif parameter == 'l_BP':
-            derivs[ n ] = get_num_base_pairs_closed_by_loops( self )
-        elif parameter == 'C_init':
-            num_loops = 0.0
-            # first count up loops closed by base pairs (i,j), i < j
-            ( C_eff_for_coax, C_eff_for_BP ) = (self.C_eff, self.C_eff ) if self.params.allow_strained_3WJ else (self.C_eff_no_BP_singlet, self.C_eff_no_coax_singlet )
-            for i in range( N ):
-                for j in range( i+2, N ):
-                    if not self.ligated[i]: continue
-                    if not self.ligated[j-1]: continue
-                    num_loops += self.params.l**2 * self.params.l_BP * C_eff_for_BP.val(i+1,j-1) * self.Z_BP.val(j,i) / self.Z
-                    if self.params.K_coax > 0.0:
-                        offset = j - i
-                        for k in range( i+2, i+offset-1 ):
-                            if self.ligated[k]  : num_loops += self.Z_BP.val(i+1,k) * C_eff_for_coax.val(k+1,j-1) * self.params.l**2 * self.params.l_coax * self.params.K_coax * self.Z_BP.val(j,i) / self.Z
-                        for k in range( i+2, i+offset-1 ):
-                            if self.ligated[k-1]: num_loops += C_eff_for_coax.val(i+1,k-1) * self.Z_BP.val(k,j-1) * self.params.l**2 * self.params.l_coax * self.params.K_coax * self.Z_BP.val(j,i) / self.Z
-
-            # one more loop if RNA is a circle.
-            if self.ligated[ N-1 ]: num_loops += 1
-            derivs[ n ] = num_loops
+        if parameter in ( 'l', 'l_BP', 'C_init', 'K_coax', 'l_coax' ):
+            derivs[ n ] = counts[ parameter ]
         elif len(parameter)>=2 and  parameter[:2] == 'Kd':
+            # Derivatives with respect to each Kd
             if parameter == 'Kd':
                 # currently can only handle case where Kd controls *all* of the base pair types
                 for base_pair_type in self.params.base_pair_types: assert( base_pair_type.Kd == self.params.base_pair_types[0].Kd )
-                derivs[ n ] = - get_bpp_tot( self )
+                derivs[ n ] = - get_bpp_tot( self, counts )
             else:
                 Kd_tag = parameter[3:]
-                derivs[ n ] = - get_bpp_tot_for_base_pair_type( self, get_base_pair_type_for_tag( self.params, Kd_tag ) )
+                derivs[ n ] = - get_bpp_tot_for_base_pair_type( self, counts, get_base_pair_type_for_tag( self.params, Kd_tag ) )
         elif len(parameter)>=11 and parameter[:11] == 'C_eff_stack':
-            derivs[ n ] = get_C_eff_stack_deriv( self, parameter )
+            derivs[ n ] = get_C_eff_stack_deriv( self, counts, parameter )
         elif len(parameter)>=11 and parameter[:11] == 'C_eff_motif':
             assert( len(parameter) > 11 )
             tag = parameter[12:]
             C_eff_stack_tag = check_equivalent_C_eff_stack_for_motif_type( tag )
             if C_eff_stack_tag:
-                derivs[ n ] = get_C_eff_stack_deriv( self, C_eff_stack_tag )
+                derivs[ n ] = get_C_eff_stack_deriv( self, counts, C_eff_stack_tag )
             else:
                 motif_type = get_motif_type_for_tag( self.params, tag )
                 assert( motif_type != None )
-                derivs[ n ] = get_motif_prob( self, motif_type )
-        elif parameter == 'K_coax':
-            coax_prob = get_coax_prob( self )
-            derivs[ n ] = coax_prob
-        elif parameter == 'l_coax':
-            coax_prob = get_loop_closed_coax_prob( self )
-            coax_prob = 0.0
-            C_eff_for_coax = self.C_eff if self.params.allow_strained_3WJ else self.C_eff_no_BP_singlet
-            for i in range( N ):
-                for j in range( N ):
-                    if ( i - j ) % N < 2: continue
-                    if not self.ligated[ i-1 ]: continue
-                    if not self.ligated[ j ]: continue
-                    coax_prob += self.Z_coax.val(i,j) * self.params.l_coax * self.params.l**2 * C_eff_for_coax.val(j+1,i-1) / Z
-            derivs[ n ] = coax_prob
+                derivs[ n ] = counts[ 'motif_type' ][ self.params.motif_types.index( motif_type ) ]
         else:
             print("%s" % "Did not recognize parameter ")
             print(parameter)
@@ -88,24 +53,49 @@ def _get_log_derivs( self, deriv_parameters = [] ):
 
     return derivs
 
-def get_bpp_tot_for_base_pair_type( self, base_pair_type ):
+def get_expected_counts( self ):
+    '''
+    Expected number of times each parameter shows up in structures, i.e., d(log Z)/d(log parameter):
+      'l', 'l_BP', 'C_init', 'K_coax', 'l_coax'  (numbers)
+      'base_pair_type' (length T array, number of base pairs of each type, with each pair counted as (i,j) and as (j,i))
+      'stacked_pair'   (T x T array, number of stacked pairs of each type, seen from either pair)
+      'motif_type'     (one number per motif type in params.motif_types)
+    From outside_counts -- filled by the outside recursions generated from recursions.py (see recursions/outside.py).
+    '''
+    if self.outside_counts == None: fill_outside_recursions( self )
+    return get_expected_counts_outside( self )
+
+def get_expected_counts_from_matrices( self ):
+    '''
+    Same as get_expected_counts(), but with hand-derived formulas for each parameter, in one pass over full
+     N x N arrays of the inside values (calc_all_elements). Used as a check of the outside recursions.
+
+    Matrix elements are stored with a factor of scale per nucleotide (see util/scale_util.py)
+    and get divided by Z_final(0) = Z * scale**N, so any nucleotide not covered (or covered twice)
+    by the elements in a product needs a compensating power of scale.
+    '''
     assert( self.calc_all_elements )
-    bpp = 0.0
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ) = self.params.get_variables()
     N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            if self.Z_BPq[base_pair_type].val(i,j) == 0: continue
-            bpp += self.Z_BPq[base_pair_type].val(i,j) * self.Z_BPq[base_pair_type.flipped].val(j,i) * base_pair_type.Kd / self.Z
-    if base_pair_type == base_pair_type.flipped: bpp /= 2.0
-    return bpp
+    Z = self.Z_final.val(0)
+    scale = self.scale
+    base_pair_types = self.base_pair_types
+    flipped = [ base_pair_types.index( base_pair_type.flipped ) for base_pair_type in base_pair_types ]
+    Z_BPq = np.array( [ get_array( self.Z_BPq[ base_pair_type ] ) for base_pair_type in base_pair_types ] ).reshape( len( base_pair_types ), N, N )
+    ( Z_BP, Z_coax, Z_cut, C_eff, C_eff_no_BP_singlet, C_eff_no_coax_singlet ) = [ get_array( X ) for X in
+        ( self.Z_BP, self.Z_coax, self.Z_cut, self.C_eff, self.C_eff_no_BP_singlet, self.C_eff_no_coax_singlet ) ]
+    ( C_eff_for_coax, C_eff_for_BP ) = ( C_eff, C_eff ) if allow_strained_3WJ else ( C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+    lig = np.array( [ float( self.ligated[n] ) for n in range( N ) ] )
+    I = np.arange( N )[:,None]
+    J = np.arange( N )[None,:]
+    ( ip1, jm1 ) = ( (I+1)%N, (J-1)%N )
+    counts = {}
 
-def get_bpp_tot( self ):
-    bpp_tot = []
-    for base_pair_type in self.params.base_pair_types: bpp_tot.append( get_bpp_tot_for_base_pair_type( self, base_pair_type ) )
-    return sum( bpp_tot ) / 2.0
+    # internal linkages -- loop closure
+    n = np.arange( N )
+    counts[ 'l' ] = np.dot( lig, C_eff_no_coax_singlet[ (n+1)%N, n ] ) * l / C_std / Z
 
-def get_num_base_pairs_closed_by_loops( self ):
-    # base pair forms a closed loop
+    # base pair closes a loop (either direction)
     #
     #     ~~~~~
     #  i+1     j-1
@@ -113,20 +103,48 @@ def get_num_base_pairs_closed_by_loops( self ):
     #    i ... j
     #      bp1
     #
-    # loops on both sides count!
-    num_base_pairs_closed_by_loops = 0.0
-    N = self.N
     # this is slightly different than num_closed_loops for C_init -- each base pair is counted
     # if it closes a loop in either direction (i<j) vs. (i>j)
-    for i in range( N ):
-        for j in range( N ):
-            if ( j - i ) % N < 2: continue
-            if not self.ligated[i]: continue
-            if not self.ligated[(j-1)%N]: continue
-            num_base_pairs_closed_by_loops += self.params.l**2 * self.params.l_BP * self.C_eff.val(i+1,j-1) * self.Z_BP.val(j,i) / self.Z
-    return num_base_pairs_closed_by_loops
-
-def get_stack_prob( self, base_pair_type, base_pair_type2 ):
+    closes_loop = lig[ I ] * lig[ jm1 ]
+    counts[ 'l_BP' ] = ( ( ( J - I ) % N >= 2 ) * closes_loop * C_eff[ ip1, jm1 ] * Z_BP.T ).sum() * l**2 * l_BP / Z
+
+    # loops closed by base pairs (i,j), i < j, with k-loops over coaxial stacks done as matrix products
+    weight = ( J >= I+2 ) * closes_loop * Z_BP.T / Z
+    num_loops = ( weight * C_eff_for_BP[ ip1, jm1 ] ).sum() * l**2 * l_BP
+    if K_coax > 0.0:
+        K = J # k as column index (i,k) ...
+        Kr = I # ... or as row index (k,j)
+        stack_on_left  = np.dot( ( K >= I+2 ) * lig[ K ] * Z_BP[ ip1, K ], ( J >= Kr+2 ) * C_eff_for_coax[ (Kr+1)%N, jm1 ] )
+        stack_on_right = np.dot( ( K >= I+2 ) * lig[ K-1 ] * C_eff_for_coax[ ip1, (K-1)%N ], ( J >= Kr+2 ) * Z_BP[ Kr, jm1 ] )
+        num_loops += ( weight * ( stack_on_left + stack_on_right ) ).sum() * l**2 * l_coax * K_coax
+    # one more loop if RNA is a circle, unless the ligation N-1 --> 0 is in a stacked pair, motif, or coaxial stack
+    #  (the other terms of Z_final).
+    if self.ligated[ N-1 ]:
+        num_loops += C_eff_no_coax_singlet[ 0, N-1 ] * l / C_std / Z
+        if K_coax > 0.0:
+            # coaxial stack of (0,j) and (k,N-1) across the ligation, closing the loop j+1 ... k-1
+            loop = ( J >= I+2 ) * C_eff_for_coax[ ip1, jm1 ]
+            num_loops += np.dot( np.dot( lig * Z_BP[ 0, : ], loop ), lig[ (n-1)%N ] * Z_BP[ :, N-1 ] ) * l**2 * l_coax * K_coax / Z
+    counts[ 'C_init' ] = num_loops
+
+    # coaxial stacks
+    #
+    #       ~~~~                   \    /
+    #   -- j    i --            -- j    i --
+    #  /   :    :   \    and    /   :    :   \
+    #  \   :    :   /           \   :    :   /
+    #   ------------             ------------
+    #   (loop closed)            (split segments)
+    #
+    loop_closed_coax = ( ( ( I - J ) % N >= 2 ) * lig[ (I-1)%N ] * lig[ J ] * Z_coax * C_eff_for_coax[ (J+1)%N, (I-1)%N ] ).sum() * l_coax * l**2 / Z
+    loop_open_coax = ( Z_coax * Z_cut.T ).sum() / Z / scale**2 # j and i are in both Z_coax and Z_cut
+    counts[ 'l_coax' ] = loop_closed_coax
+    counts[ 'K_coax' ] = loop_closed_coax + loop_open_coax
+
+    # base pairs -- i and j are in both Z_BPq's
+    Kd = np.array( [ base_pair_type.Kd for base_pair_type in base_pair_types ] )
+    counts[ 'base_pair_type' ] = ( Z_BPq * Z_BPq[ flipped ].transpose( 0, 2, 1 ) ).sum( axis = (1,2) ) * Kd / Z / scale**2
+
     # base pair forms a stacked pair with previous pair
     #
     #      bp2
@@ -135,39 +153,70 @@ def get_stack_prob( self, base_pair_type, base_pair_type2 ):
     #    i ... j
     #      bp1
     #
-    stack_prob = 0.0
-    Z_BPq1 = self.Z_BPq[base_pair_type.flipped]
-    Z_BPq2 = self.Z_BPq[base_pair_type2]
-    N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            if ( j - i ) % N < 3: continue
-            if not self.ligated[i]: continue
-            if not self.ligated[(j-1)%N]: continue
-            if not base_pair_type.flipped.is_match( self.sequence[j],self.sequence[i] ): continue
-            if not base_pair_type2       .is_match( self.sequence[(i+1)%N],self.sequence[(j-1)%N] ): continue
-            stack_prob += self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq1.val(j,i) * Z_BPq2.val(i+1,j-1) / self.Z
+    # Z_BPq is zero unless base pair types match the sequence.
+    outer = Z_BPq.transpose( 0, 2, 1 ) * ( ( ( J - I ) % N >= 3 ) * closes_loop ) # bp1.flipped at (j,i)
+    inner = Z_BPq[ :, ip1, jm1 ] # bp2 at (i+1,j-1)
+    C_eff_stack = np.array( [ [ self.params.C_eff_stack[bpt1][bpt2] for bpt2 in base_pair_types ] for bpt1 in base_pair_types ] )
+    counts[ 'stacked_pair' ] = C_eff_stack * np.tensordot( outer, inner, axes = ( [1,2], [1,2] ) )[ flipped ] / Z
+
+    counts[ 'motif_type' ] = get_motif_counts( self )
+    return counts
+
+def get_expected_counts_outside( self ):
+    '''
+    Same as get_expected_counts(), from outside_counts, which only hold base pairs, stacked pairs,
+     and motifs as seen from the outer pair (as (i,j), i < j, for a linear RNA).
+    '''
+    counts = dict( self.outside_counts )
+    flipped = [ self.base_pair_types.index( base_pair_type.flipped ) for base_pair_type in self.base_pair_types ]
+    bpt_count = self.outside_counts[ 'base_pair_type' ]
+    counts[ 'base_pair_type' ] = bpt_count + bpt_count[ flipped ]
+    # pair bp1 encloses bp2 (i < j), or pair bp2.flipped encloses bp1.flipped (wrap-around, j < i)
+    stack_count = self.outside_counts[ 'stacked_pair' ]
+    counts[ 'stacked_pair' ] = stack_count + stack_count[ flipped ][ :, flipped ].T
+    counts[ 'motif_type' ] = np.array( [ get_motif_prob_outside( self, motif_type ) for motif_type in self.params.motif_types ] )
+    return counts
+
+def get_bpp_tot_for_base_pair_type( self, counts, base_pair_type ):
+    bpp = counts[ 'base_pair_type' ][ self.base_pair_types.index( base_pair_type ) ]
+    if base_pair_type == base_pair_type.flipped: bpp /= 2.0
+    return bpp
+
+def get_bpp_tot( self, counts ):
+    bpp_tot = []
+    for base_pair_type in self.params.base_pair_types: bpp_tot.append( get_bpp_tot_for_base_pair_type( self, counts, base_pair_type ) )
+    return sum( bpp_tot ) / 2.0
+
+def get_stack_prob( self, counts, base_pair_type, base_pair_type2 ):
+    stack_prob = counts[ 'stacked_pair' ][ self.base_pair_types.index( base_pair_type ), self.base_pair_types.index( base_pair_type2 ) ]
     if base_pair_type == base_pair_type2.flipped: stack_prob /= 2.0 # symmetry correction
     return stack_prob
 
-def get_motif_prob( self, motif_type ):
-    motif_prob = 0.0
+def get_motif_counts( self ):
+    '''
+    Expected number of each motif type in params.motif_types, in one pass over possible_motif_types
+    '''
+    motif_counts = np.zeros( len( self.params.motif_types ) )
+    motif_index = dict( (motif_type,m) for (m,motif_type) in enumerate( self.params.motif_types ) )
     N = self.N
+    Z = self.Z_final.val(0)
+    scale = self.scale
     for i in range( N ):
-        for j in range( N ):
-            for base_pair_type in self.params.base_pair_types:
-                if not base_pair_type in self.possible_motif_types[i][j]: continue
-                if not motif_type in self.possible_motif_types[i][j][base_pair_type]: continue
-                if len(motif_type.strands) == 1: # hairpins (1-way junctions)
-                    # base pair closes a hairpin
-                    #            -----
-                    #           |     |
-                    #           i ... j
-                    #          5' bpt  3'
-                    #             -->
-                    motif_prob += motif_type.C_eff * self.Z_BPq[ base_pair_type.flipped ].val(j,i) / self.Z
-                    pass
-                else:
+        row = self.possible_motif_types[ i ]
+        for (j, possible_motif_types) in ( row.items() if isinstance( row, dict ) else [ (j, row[j]) for j in range( N ) ] ):
+            for base_pair_type in possible_motif_types:
+                Z_BPq_flipped = self.Z_BPq[ base_pair_type.flipped ].val(j,i)
+                if Z_BPq_flipped == 0.0: continue
+                for (motif_type,match_base_pair_type_set) in possible_motif_types[ base_pair_type ].items():
+                    if len(motif_type.strands) == 1: # hairpins (1-way junctions)
+                        # base pair closes a hairpin
+                        #            -----
+                        #           |     |
+                        #           i ... j
+                        #          5' bpt  3'
+                        #             -->
+                        motif_counts[ motif_index[ motif_type ] ] += motif_type.C_eff * Z_BPq_flipped * scale**( (j-i)%N - 1 ) / Z
+                        continue
                     assert(len(motif_type.strands) == 2) # internal loops (2-way junctions)
                     # base pair forms a motif with previous pair
                     #
@@ -180,59 +229,35 @@ def get_motif_prob( self, motif_type ):
                     #           i ... j
                     #          5' bpt  3'
                     #             -->
-                    for (base_pair_type_next, i_next, j_next) in self.possible_motif_types[i][j][base_pair_type][motif_type]:
-                        Z_BPq_next = self.Z_BPq[base_pair_type_next]
-                        val = motif_type.C_eff * Z_BPq_next.val(i_next,j_next) * self.Z_BPq[ base_pair_type.flipped ].val(j,i) / self.Z
+                    for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
+                        val = motif_type.C_eff * self.Z_BPq[base_pair_type_next].val(i_next,j_next) * Z_BPq_flipped * scale**( N - (j_next-i_next)%N - (i-j)%N - 2 ) / Z
                         # symmetry correction:
-                        if motif_type in self.possible_motif_types[j_next][i_next][base_pair_type_next.flipped]:
-                            match_base_pair_type_set_reverse = self.possible_motif_types[j_next][i_next][base_pair_type_next.flipped][ motif_type ]
+                        if motif_type in self.possible_motif_types[j_next%N][i_next%N][base_pair_type_next.flipped]:
+                            match_base_pair_type_set_reverse = self.possible_motif_types[j_next%N][i_next%N][base_pair_type_next.flipped][ motif_type ]
                             for (base_pair_reverse,j_reverse,i_reverse) in match_base_pair_type_set_reverse:
-                               if (base_pair_reverse,j_reverse,i_reverse) == (base_pair_type.flipped,j,i):
+                               if (base_pair_reverse,j_reverse%N,i_reverse%N) == (base_pair_type.flipped,j,i):
                                    val /= 2.0
                                    break
-                        motif_prob += val
-    return motif_prob
-
-def get_loop_closed_coax_prob( self ):
-    # If the two coaxially stacked base pairs are connected by a loop.
-    #
-    #       ~~~~
-    #   -- j    i --
-    #  /   :    :   \
-    #  \   :    :   /
-    #   ------------
-    #
-    coax_prob = 0.0
-    C_eff_for_coax = self.C_eff if self.params.allow_strained_3WJ else self.C_eff_no_BP_singlet
-    N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            if ( i - j ) % N < 2: continue
-            if not self.ligated[ i-1 ]: continue
-            if not self.ligated[ j ]: continue
-            coax_prob += self.Z_coax.val(i,j) * self.params.l_coax * self.params.l**2 * C_eff_for_coax.val(j+1,i-1) / self.Z
-    return coax_prob
-
-def get_loop_open_coax_prob( self ):
-    # If the two stacked base pairs are in split segments
-    #
-    #      \    /
-    #   -- j    i --
-    #  /   :    :   \
-    #  \   :    :   /
-    #   ------------
-    #
-    coax_prob = 0.0
-    N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            coax_prob += self.Z_coax.val(i,j) * self.Z_cut.val(j,i) / self.Z
-    return coax_prob
+                        motif_counts[ motif_index[ motif_type ] ] += val
+    return motif_counts
 
-def get_coax_prob( self ):
-    return get_loop_closed_coax_prob( self ) + get_loop_open_coax_prob( self )
+def get_motif_prob_outside( self, motif_type ):
+    '''
+    outside_counts has motifs as seen from their outer base pair (i,j), i < j. The wrap-around terms in
+     get_motif_counts() see the same loops from the inner pair, i.e., with strands permuted, and count
+     towards motif_type if the permuted motif type is motif_type.
+    '''
+    motif_types = [ motif_type ]
+    strands, bp_tags = motif_type.strands, motif_type.bp_tags
+    for n in range( len( strands ) - 1 ):
+        strands = strands[1:] + [ strands[0] ]
+        bp_tags = bp_tags[1:] + [ bp_tags[0] ]
+        permuted_motif_type = get_motif_type_for_tag( self.params, make_motif_type_tag( strands, bp_tags ) )
+        if permuted_motif_type != None and not permuted_motif_type in motif_types: motif_types.append( permuted_motif_type )
+    motif_count = self.outside_counts[ 'motif_type' ]
+    return sum( motif_count[ self.params.motif_types.index( permuted_motif_type ) ] for permuted_motif_type in motif_types )
 
-def get_C_eff_stack_deriv( self, parameter ):
+def get_C_eff_stack_deriv( self, counts, parameter ):
     # Derivatives with respect to motifs (stacked pairs first)
     if parameter == 'C_eff_stacked_pair':
         bpts1 = self.params.base_pair_types
@@ -248,7 +273,7 @@ def get_C_eff_stack_deriv( self, parameter ):
     for bpt1 in bpts1:
         for bpt2 in bpts2:
             if (bpt1, bpt2) in stack_types_computed: continue
-            deriv += get_stack_prob( self, bpt1, bpt2 )
+            deriv += get_stack_prob( self, counts, bpt1, bpt2 )
             stack_types_computed.append( (bpt1, bpt2 ) )
             stack_types_computed.append( (bpt2.flipped, bpt1.flipped ) ) # prevents overcounting
     return deriv
@@ -0,0 +1,187 @@
+##################################################################################################
+# local_fold.py = base pair and unpaired probabilities for long transcripts, averaged over all
+#  windows of window_size nucleotides (as in RNAplfold).
+#
+# The window advances one nucleotide at a time. Elements (i,j) with i <= j of the dynamic programming
+#  matrices depend only on nucleotides i..j, so all of those in the previous window except the new last
+#  column are copied over (shifted by one) instead of being recomputed. Only these elements are filled --
+#  base pair probabilities of each window come from the vectorized outside pass (recursions/outside.py).
+#  Candidate base pairs and motifs are shifted over from the previous window in the same way.
+#  With max_bp_span, matrices are banded (recursions/banded.py), and the band is shifted over instead; only
+#  the exterior loop Z_linear(0,j) beyond the band is refilled, in O(window_size * max_bp_span).
+#
+# The outside pass cannot be shifted -- outside values depend on the whole window -- so each window pays
+#  for a full outside pass, O(window_size^3) (or O(window_size * max_bp_span^2)), and this is about half of
+#  the time for local_fold(), which is O( N * window_size^3 ) overall.
+#
+# Only two windows are held at a time, so memory is O(window_size^2), whatever the transcript length.
+##################################################################################################
+from zetafold.partition import Partition, initialize_sequence_information, initialize_dynamic_programming_matrices, initialize_force_base_pair, initialize_possible_base_pair_types, initialize_possible_motif_types
+from zetafold.partition import get_possible_base_pair_indices, get_possible_motif_indices, initialize_possible_base_pair_types_matrix, initialize_possible_motif_types_matrix
+from zetafold.recursions.outside import fill_outside, get_bpp_outside
+from zetafold.recursions.banded import initialize_banded, fill_banded, update_exterior
+from zetafold.parameters import get_params
+from zetafold.util.scale_util import rescale_if_needed, get_Z_and_log_Z
+import numpy as np
+
+def local_fold( sequence, window_size, params = '', max_bp_span = None, no_coax = False, engine = 'vectorized' ):
+    '''
+    Generator over positions i = 0 ... N-1 of sequence, yielding
+
+       ( i, p_unpaired, bpp_row )
+
+    where bpp_row = { j: probability that i pairs with j } for partners j > i, and each probability is
+     averaged over the windows that contain the nucleotides. Position i is yielded as soon as the window
+     has moved past it.
+
+    max_bp_span = W further restricts base pairs (i,j) to |i-j| <= W.
+    engine must hold matrices as NumPy arrays ('numpy' or 'vectorized').
+    '''
+    assert( engine in ('numpy','vectorized') )
+    if isinstance(params,str): params = get_params( params, suppress_all_output = True )
+    if no_coax:                params.K_coax = 0.0
+
+    N = len( sequence )
+    L = min( window_size, N )
+    n_windows = N - L + 1
+
+    bpp_sum      = {} # i --> array of summed bpp(i,i+d), d = 0 ... L-1; only for i in current window
+    unpaired_sum = {}
+    p = None
+    for s in range( n_windows ):
+        p = fold_window( sequence[ s : s+L ], params, max_bp_span, engine, p_prev = p )
+        for i in range( L ):
+            if not s+i in bpp_sum:
+                bpp_sum[ s+i ] = np.zeros( L )
+                unpaired_sum[ s+i ] = 0.0
+            bpp_sum[ s+i ][ :L-i ] += p.bpp[ i, i: ]
+            unpaired_sum[ s+i ] += 1.0 - p.bpp[ i ].sum()
+
+        # nucleotide s will not show up in any later windows -- done.
+        last = ( s == n_windows - 1 )
+        for i in ( range( s, N ) if last else [ s ] ):
+            bpp_row = {}
+            for d in np.nonzero( bpp_sum[ i ] )[0]:
+                bpp_row[ i+d ] = bpp_sum[ i ][ d ] / num_windows( i, i+d, N, L )
+            yield ( i, unpaired_sum[ i ] / num_windows( i, i, N, L ), bpp_row )
+            del bpp_sum[ i ]
+            del unpaired_sum[ i ]
+
+def num_windows( i, j, N, L ):
+    '''
+    Number of windows of length L in sequence of length N that contain nucleotides i and j (i <= j)
+    '''
+    return min( i, N - L ) - max( 0, j - L + 1 ) + 1
+
+def fold_window( sequence, params, max_bp_span, engine, p_prev = None ):
+    '''
+    Fill elements (i,j) with i < j of dynamic programming matrices for a window, and get its base pair probability
+     matrix from the outside pass.
+    If p_prev holds the window that started one nucleotide earlier, its elements (i+1,j+1) with i <= j
+     are copied into (i,j) rather than recomputed, and its candidate base pairs and motifs are shifted over.
+
+    Returns Partition object, with p.bpp as an N x N ndarray.
+    '''
+    p = Partition( sequence, params )
+    p.engine = engine
+    p.max_bp_span = max_bp_span
+    p.use_outside = True
+    initialize_sequence_information( p )
+    initialize_dynamic_programming_matrices( p )
+    initialize_force_base_pair( p )
+
+    N = p.N
+    reuse = ( p_prev != None and p_prev.N == N )
+    if reuse:
+        shift_possible_types( p, p_prev )
+        upper = np.triu( np.ones( (N-1,N-1), dtype = bool ) )
+        for (Z,Z_prev) in zip( p.Z_all + [ p.Z_BPq[ bpt ] for bpt in p.base_pair_types ],
+                               p_prev.Z_all + [ p_prev.Z_BPq[ bpt ] for bpt in p_prev.base_pair_types ] ):
+            if p.banded:
+                Z.Q.band[ :N-1 ] = Z_prev.Q.band[ 1: ] # band[i, j-i], so rows shift and offsets stay put
+            else:
+                Z.Q[ :N-1, :N-1 ][ upper ] = Z_prev.Q[ 1:, 1: ][ upper ]
+            Z.Q[ N-1 ][ N-1 ] *= p_prev.scale
+        if p.banded: p.Z_linear.Q.first_row[ :p.Z_linear.Q.width ] = p.Z_linear.Q.band[ 0 ]
+        p.scale = p_prev.scale # copied elements were scaled for previous window
+    else:
+        initialize_possible_base_pair_types( p )
+        initialize_possible_motif_types( p )
+
+    if p.banded and not reuse:
+        fill_banded( p )
+    else:
+        if p.banded: initialize_banded( p )
+        for offset in range( 1, N ):
+            for i in range( N - offset ):
+                j = i + offset
+                if reuse and j < N-1: continue
+                if p.banded and offset > p.max_bp_span:
+                    # beyond the band, only coaxial stacks and the exterior loop Z_linear(0,j) are nonzero
+                    if offset < p.Z_coax.Q.width: p.Z_coax.update( p, i, j )
+                    continue
+                for Z in p.Z_all: Z.update( p, i, j )
+            # the exterior loop Z_linear(0,j) beyond the band is held outside the band, so is not copied over.
+            if p.banded and offset > p.max_bp_span: update_exterior( p, offset )
+            # copied elements at larger offsets need rescaling too.
+            rescale_if_needed( p, offset, all_offsets = reuse )
+
+    p.Z_final.update( p, 0 )
+    ( p.Z, p.logZ ) = get_Z_and_log_Z( p )
+
+    fill_outside( p )
+    p.bpp = get_bpp_outside( p )
+    return p
+
+def shift_possible_types( p, p_prev ):
+    '''
+    possible_base_pair_indices and possible_motif_indices for window p, from those of p_prev, the window that
+     started one nucleotide earlier. Candidate base pairs and motifs only depend on their own nucleotides, so
+     those that do not involve the first nucleotide of p_prev are shifted by one, and only those that involve the
+     new last nucleotide N-1 are computed.
+    '''
+    N = p.N
+    # candidate base pairs (i,N-1) and (N-1,j)
+    I = np.concatenate( [ np.arange( N-1 ), np.full( N, N-1, dtype = int ) ] )
+    J = np.concatenate( [ np.full( N-1, N-1, dtype = int ), np.arange( N ) ] )
+    new_candidates = get_possible_base_pair_indices( p, I, J )
+    max_first_strand_length = max( [ len( motif_type.strands[0] ) for motif_type in p.params.motif_types if len( motif_type.strands ) > 1 ] + [ 0 ] )
+
+    p.possible_base_pair_indices = {}
+    shifted_index = {} # index of each candidate of p_prev in p, or -1
+    closing_candidates = {}
+    for base_pair_type in p.base_pair_types:
+        ( I, J ) = p_prev.possible_base_pair_indices[ base_pair_type ]
+        keep = ( I >= 1 ) & ( J >= 1 )
+        ( I_new, J_new ) = new_candidates[ base_pair_type ]
+        I = np.concatenate( [ I[ keep ] - 1, I_new ] )
+        J = np.concatenate( [ J[ keep ] - 1, J_new ] )
+        order = np.argsort( I * N + J, kind = 'mergesort' )
+        p.possible_base_pair_indices[ base_pair_type ] = ( I[ order ], J[ order ] )
+        position = np.zeros( len( order ), dtype = int )
+        position[ order ] = np.arange( len( order ) )
+        shifted_index[ base_pair_type ] = -np.ones( len( keep ), dtype = int )
+        shifted_index[ base_pair_type ][ keep ] = position[ :keep.sum() ]
+        # motifs closed by new candidates, or with first strand i..i_next ending at N-1 (only for i > j)
+        ( I, J ) = p.possible_base_pair_indices[ base_pair_type ]
+        closing_candidates[ base_pair_type ] = np.nonzero( ( order >= keep.sum() ) | ( ( I > J ) & ( I >= N - max_first_strand_length ) ) )[0]
+    initialize_possible_base_pair_types_matrix( p )
+
+    new_motifs = get_possible_motif_indices( p, closing_candidates )
+    p.possible_motif_indices = {}
+    for base_pair_type in p.base_pair_types:
+        ( K, M, T_next, K_next ) = p_prev.possible_motif_indices[ base_pair_type ]
+        K = shifted_index[ base_pair_type ][ K ]
+        K_next = K_next.astype( int )
+        for (t_next,base_pair_type_next) in enumerate( p.base_pair_types ):
+            is_next = ( T_next == t_next )
+            K_next[ is_next ] = shifted_index[ base_pair_type_next ][ K_next[ is_next ] ]
+        recomputed = np.zeros( len( p.possible_base_pair_indices[ base_pair_type ][0] ), dtype = bool )
+        recomputed[ closing_candidates[ base_pair_type ] ] = True
+        keep = ( K >= 0 ) & ( ( K_next >= 0 ) | ( T_next < 0 ) )
+        keep[ keep ] = ~recomputed[ K[ keep ] ]
+        motifs = zip( ( K[ keep ], M[ keep ], T_next[ keep ], K_next[ keep ] ), new_motifs[ base_pair_type ] )
+        ( K, M, T_next, K_next ) = [ np.concatenate( X ).astype( np.int32 ) for X in motifs ]
+        order = np.argsort( K, kind = 'mergesort' ) # keep motif order for each base pair
+        p.possible_motif_indices[ base_pair_type ] = ( K[ order ], M[ order ], T_next[ order ], K_next[ order ] )
+    initialize_possible_motif_types_matrix( p )
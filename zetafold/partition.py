@@ -1,18 +1,23 @@
 from __future__ import print_function
 import sys,os
+import numpy as np
 if __package__ == None: sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from zetafold.backtrack  import mfe, boltzmann_sample, enumerative_backtrack
+from zetafold.backtrack  import mfe, boltzmann_draws, enumerate_structures, k_best_backtrack
 from zetafold.parameters import get_params
-from zetafold.util.wrapped_array  import WrappedArray, initialize_matrix
+from zetafold.util.wrapped_array  import WrappedArray, SparseRow, LazySparseRow, LazyMatrix
 from zetafold.util.secstruct_util import *
 from zetafold.util.output_util    import _show_results, _show_matrices
-from zetafold.util.sequence_util  import initialize_sequence_and_ligated, initialize_all_ligated, get_num_strand_connections
+from zetafold.util.sequence_util  import initialize_sequence_and_ligated, initialize_all_ligated, get_num_strand_connections, get_sequence_codes
 from zetafold.util.constants import KT_IN_KCAL
 from zetafold.util.assert_equal import assert_equal
-from zetafold.derivatives import _get_log_derivs
+from zetafold.util.scale_util import rescale_if_needed, get_Z_and_log_Z
+from zetafold.util.semiring_util import get_semiring_sum, get_semiring_add, get_semiring_params
+from zetafold.derivatives import _get_log_derivs, get_expected_counts, get_expected_counts_from_matrices
 #import zetafold.score_structure
 import score_structure
 from math import log, exp
+from collections import Counter
+from functools import partial
 
 ##################################################################################################
 def partition( sequences, circle = False, params = '', mfe = False, calc_bpp = False,
@@ -21,22 +26,58 @@ def partition( sequences, circle = False, params = '', mfe = False, calc_bpp = F
                no_coax = False,
                verbose = False,  suppress_all_output = False, suppress_bpp_output = False,
                deriv_params = None,
-               use_simple_recursions = False, deriv_check = False, bpp_file = None ):
+               use_simple_recursions = False, deriv_check = False, bpp_file = None,
+               engine = 'explicit', max_bp_span = None, outside = True, count_states = False,
+               stochastic_seed = None, stochastic_jobs = 1, enumeration_dG_gap = None, k_best = 0,
+               sequence_setup = None ):
     '''
     Wrapper function into Partition() class
     Returns Partition object p which holds results like:
 
       p.Z   = final partition function (where unfolded state has unity weight)
+      p.logZ = log of p.Z (stays finite for long sequences, where p.Z can overflow)
       p.bpp = matrix of base pair probabilities (if requested by user with calc_bpp = True)
       p.struct_MFE = minimum free energy secondary structure in dot-parens notation
       p.bps_MFE  = minimum free energy secondary structure as sorted list of base pairs
-
+      p.dG_MFE   = free energy of minimum free energy structure (kcal/mol)
+      p.num_states = number of model states, i.e. structures counted separately for each way of stacking,
+                      forming motifs, etc. (if requested by user with count_states = True)
+      p.stochastic_counts = Counter of { structure : count } for n_stochastic Boltzmann-weighted samples,
+                             drawn with random seed stochastic_seed, split over stochastic_jobs processes.
+      p.struct_k_best = structures of the k most probable model states, most probable first, each structure
+                         listed once (if requested with k_best = k). p.p_k_best holds the probability of the
+                         most probable state with those base pairs -- not summed over states (e.g., with and
+                         without coaxial stacks), so it can be less than the probability of the structure,
+                         and structures are ranked by it.
+      p.struct_enumerate = all structures (if do_enumeration = True), or only structures with free energy within
+                            enumeration_dG_gap kcal/mol of the ensemble free energy p.dG, if that is given.
+
+    engine selects how dynamic programming matrices are stored and filled:
+      'explicit' = lists of lists, updated by explicit_recursions.py [default]
+      'numpy'    = NumPy arrays, updated by explicit_recursions.py
+      'vectorized' = NumPy arrays, with inner loops of recursions done as dot products (vectorized_recursions.py)
+      'wavefront'  = NumPy arrays, filled a whole diagonal (offset j - i) at a time (wavefront.py)
+      'jit'        = NumPy arrays, filled a diagonal at a time by kernels compiled with numba (jit.py).
+                      Falls back to 'explicit', with a warning, if numba is not installed.
+
+    max_bp_span = W restricts base pairs (i,j) to |i-j| <= W. For a linear sequence, matrices are stored as bands
+      and filled in O(N W^2) time and O(N W) memory (banded.py), whatever the engine, and so are the outside
+      values for bpp and derivatives; for circles (or outside = False) the engine runs as usual with the
+      restricted base pairs.
+
+    outside = True: for a linear sequence, get bpp and derivatives from an outside pass over elements (i,j), i < j
+      (outside.py), instead of filling the wrap-around elements (j < i) as is done for circles.
+
+    sequence_setup = dict to hold sequence information and possible base pair and motif types between calls
+      for the same sequences and settings (e.g., in training, where only parameter values change). Filled on first use.
     '''
     if isinstance(params,str): params = get_params( params, suppress_all_output )
     if no_coax:                params.K_coax = 0.0
 
     p = Partition( sequences, params )
     p.use_simple_recursions = use_simple_recursions
+    p.engine    = engine
+    p.max_bp_span = max_bp_span
     p.circle    = circle
     p.structure = get_structure_string( structure )
     p.allow_extra_base_pairs = allow_extra_base_pairs
@@ -46,14 +87,18 @@ def partition( sequences, circle = False, params = '', mfe = False, calc_bpp = F
     if deriv_check and deriv_params == None: deriv_params = []
     p.bpp_file = bpp_file
     if bpp_file: calc_bpp = True
-    p.calc_all_elements = calc_bpp or (deriv_params != None)
+    p.use_outside = outside and ( calc_bpp or deriv_params != None ) and not circle and not use_simple_recursions
+    p.calc_all_elements = ( calc_bpp or deriv_params != None ) and not p.use_outside
     p.deriv_params = deriv_params
     p.deriv_check  = deriv_check
+    p.sequence_setup = sequence_setup
     p.run()
     if calc_bpp or bpp_file:    p.get_bpp_matrix()
     if mfe:                     p.calc_mfe()
-    if n_stochastic > 0:        p.stochastic_backtrack( n_stochastic )
-    if do_enumeration:          p.enumerative_backtrack()
+    if count_states:            p.calc_num_states()
+    if n_stochastic > 0:        p.stochastic_backtrack( n_stochastic, stochastic_seed, stochastic_jobs )
+    if k_best > 0:              p.k_best( k_best )
+    if do_enumeration:          p.enumerative_backtrack( enumeration_dG_gap )
     if verbose:                 p.show_matrices()
     if calc_gap_structure:      p.calculate_energy_gap()
     if not suppress_all_output: p.show_results()
@@ -77,23 +122,38 @@ class Partition:
         self.params = params
         self.circle = False  # user can update later --> circularize sequence
         self.use_simple_recursions = False
+        self.engine = 'explicit'
+        self.max_bp_span = None
+        self.banded = False
         self.calc_all_elements     = False
+        self.use_outside = False
+        self.outside_counts = None
+        self.outside_counts_vectorized = None
         self.calc_bpp = False
         self.base_pair_types = params.base_pair_types
         self.suppress_all_output = False
         self.structure = None
         self.allow_extra_base_pairs = None
         self.deriv_params = None
+        self.semiring = 'sum'
+        self.sequence_setup = None # optional dict to reuse per-sequence setup across runs -- see run()
         self.options = PartitionOptions()
 
         # for output:
         self.Z       = 0
+        self.logZ    = None
+        self.scale   = 1.0 # per-nucleotide scaling of dynamic programming values -- see scale_util.py
         self.dG      = None
         self.dG_gap  = None
         self.bpp     = None
         self.bps_MFE = []
         self.struct_MFE = None
+        self.dG_MFE  = None
+        self.num_states = None
         self.struct_stochastic = []
+        self.stochastic_counts = None
+        self.struct_k_best = []
+        self.p_k_best = []
         self.struct_enumerate  = []
         self.log_derivs = []
         self.derivs     = []
@@ -104,22 +164,46 @@ class Partition:
         '''
         Do the dynamic programming to fill partition function matrices
         '''
-        initialize_sequence_information( self ) # N, sequence, ligated, all_ligated
+        # sequence information and possible base pair/motif types only depend on sequence, constraints, and
+        #  which base pair and motif types are in params -- not on parameter values. Reuse from sequence_setup if it has them.
+        setup = self.sequence_setup
+        if setup: restore_sequence_setup( self, sequence_information_attributes )
+        else: initialize_sequence_information( self ) # N, sequence, ligated, all_ligated, sequence_codes
+        self.options.sum = get_semiring_sum( self.semiring )
+        self.options.add = get_semiring_add( self.semiring )
         initialize_dynamic_programming_matrices( self ) # ( Z_BP, C_eff, Z_linear, Z_cut, Z_coax, etc. )
         initialize_force_base_pair( self )
-        initialize_possible_base_pair_types( self )
-        initialize_possible_motif_types( self )
+        if setup and setup[ 'params' ] is self.params and setup[ 'banded' ] == self.banded:
+            restore_sequence_setup( self, possible_types_attributes )
+        else:
+            initialize_possible_base_pair_types( self )
+            initialize_possible_motif_types( self )
+            if setup == {}: save_sequence_setup( self )
+        initialize_sparse_storage( self )
+        self.scale = 1.0
+        self.outside_counts = None
 
         # do the dynamic programming
-        for offset in range( 1, self.N ): #length of subfragment
-            for i in range( self.N ):     #index of subfragment
-                if (not self.calc_all_elements) and ( i + offset ) >= self.N: continue
-                j = (i + offset) % self.N;  # N cyclizes
-                for Z in self.Z_all: Z.update( self, i, j )
+        if self.banded:
+            fill_banded( self )
+        elif self.engine == 'wavefront':
+            fill_wavefront( self )
+        elif self.engine == 'jit':
+            fill_jit( self )
+        else:
+            for offset in range( 1, self.N ): #length of subfragment
+                num_cells = self.N if self.calc_all_elements else self.N - offset
+                if self.update_diagonal: self.update_diagonal( self, offset, num_cells )
+                else:
+                    for i in range( num_cells ): #index of subfragment
+                        j = (i + offset) % self.N;  # N cyclizes
+                        for Z in self.Z_all: Z.update( self, i, j )
+                rescale_if_needed( self, offset )
 
         n_final = self.N if self.calc_all_elements else 1
         for i in range( n_final ): self.Z_final.update( self, i )
-        self.Z  = self.Z_final.val(0)
+        ( self.Z, self.logZ ) = get_Z_and_log_Z( self )
+        if self.use_outside: fill_outside( self )
 
         self.log_derivs = self.get_log_derivs( self.deriv_params )
         fill_in_outputs( self )
@@ -127,8 +211,10 @@ class Partition:
     # boring member functions -- defined later.
     def get_bpp_matrix( self ): _get_bpp_matrix( self ) # fill base pair probability matrix
     def calc_mfe( self ): _calc_mfe( self )
-    def stochastic_backtrack( self, N ): _stochastic_backtrack( self, N )
-    def enumerative_backtrack( self ): _enumerative_backtrack( self )
+    def calc_num_states( self ): _calc_num_states( self )
+    def stochastic_backtrack( self, N, seed = None, jobs = 1 ): _stochastic_backtrack( self, N, seed, jobs )
+    def enumerative_backtrack( self, dG_gap_cutoff = None ): _enumerative_backtrack( self, dG_gap_cutoff )
+    def k_best( self, k ): return _k_best( self, k )
     def show_results( self ): _show_results( self )
     def show_matrices( self ): _show_matrices( self )
     def get_log_derivs( self, deriv_params ): return _get_log_derivs( self, deriv_params )
@@ -136,9 +222,26 @@ class Partition:
     def calculate_energy_gap( self ): _calculate_energy_gap( self )
     def num_strand_connections( self ):  return get_num_strand_connections( self.sequences, self.circle)
 
+##################################################################################################
+def fill_wavefront( self ):
+    from zetafold.recursions.wavefront import fill_wavefront
+    fill_wavefront( self )
+
+def fill_jit( self ):
+    from zetafold.recursions.jit import fill_jit
+    fill_jit( self )
+
+def fill_banded( self ):
+    from zetafold.recursions.banded import fill_banded
+    fill_banded( self )
+
+def fill_outside( self ):
+    from zetafold.recursions.outside import fill_outside
+    fill_outside( self )
+
 ##################################################################################################
 def fill_in_outputs( self ):
-    if self.Z > 0.0: self.dG = -KT_IN_KCAL * log( self.Z )
+    if self.logZ != None: self.dG = -KT_IN_KCAL * self.logZ
     self.derivs = []
     if self.deriv_params:
         for n,log_deriv in enumerate(self.log_derivs):
@@ -158,17 +261,34 @@ def initialize_sequence_information( self ):
     OUTPUT:
     sequence     = concatenated sequence (string, length N)
     is_ligated   = is not a cut ('nick','chainbreak') (Array of bool, length N)
-    all_ligated  = no cutpoint exists between i and j (N X N)
+    all_ligated  = no cutpoint exists between i and j (all_ligated[i][j], or all_ligated.no_cutpoint(i,j) for arrays)
+    sequence_codes = integer code for each nucleotide (NumPy array, length N)
     '''
     # initialize sequence
     self.sequence, self.ligated, self.sequences = initialize_sequence_and_ligated( self.sequences, self.circle, use_wrapped_array = self.use_simple_recursions )
     self.N = len( self.sequence )
     self.all_ligated = initialize_all_ligated( self.ligated )
+    self.sequence_codes = get_sequence_codes( self.sequence )
+
+##################################################################################################
+sequence_information_attributes = ( 'sequence', 'ligated', 'sequences', 'N', 'all_ligated', 'sequence_codes' )
+possible_types_attributes = ( 'possible_base_pair_types', 'possible_base_pair_indices', 'possible_motif_types', 'possible_motif_indices', 'max_motif_strand_length' )
+
+def save_sequence_setup( self ):
+    for attribute in sequence_information_attributes + possible_types_attributes:
+        self.sequence_setup[ attribute ] = getattr( self, attribute )
+    self.sequence_setup[ 'params' ] = self.params
+    self.sequence_setup[ 'banded' ] = self.banded
+
+def restore_sequence_setup( self, attributes ):
+    for attribute in attributes: setattr( self, attribute, self.sequence_setup[ attribute ] )
 
 ##################################################################################################
 class PartitionOptions:
     def __init__( self ):
         self.calc_backtrack_info  = False
+        self.sum = sum # how contributions are combined -- see semiring_util.py
+        self.add = np.add # same, elementwise for arrays
 
 ##################################################################################################
 def initialize_dynamic_programming_matrices( self ):
@@ -184,10 +304,31 @@ def initialize_dynamic_programming_matrices( self ):
 
     from zetafold.recursions.explicit_recursions import update_Z_BPq, update_Z_BP, update_Z_cut, update_Z_coax, update_C_eff_basic, update_C_eff_no_BP_singlet, update_C_eff_no_coax_singlet, update_C_eff, update_Z_final, update_Z_linear
     from zetafold.recursions.explicit_dynamic_programming import DynamicProgrammingMatrix, DynamicProgrammingList
+    assert( self.engine in ('explicit','numpy','vectorized','wavefront','jit') )
+    assert( self.semiring == 'sum' or self.engine == 'explicit' ) # other engines hard-code sum-product
+    if self.engine == 'jit':
+        from zetafold.recursions.jit import numba_available
+        if not numba_available:
+            if not self.suppress_all_output: print( 'WARNING! numba is not installed, so using engine explicit instead of jit' )
+            self.engine = 'explicit'
+    if self.engine in ('numpy','vectorized','wavefront','jit'):
+        from zetafold.recursions.array_dynamic_programming import DynamicProgrammingMatrix, DynamicProgrammingList
+    self.banded = use_banded_storage( self )
+    if self.engine == 'vectorized' and not self.banded:
+        from zetafold.recursions.vectorized_recursions import update_Z_BPq, update_Z_coax, update_C_eff_basic, update_Z_linear
+    if self.banded:
+        from zetafold.recursions.banded_dynamic_programming import DynamicProgrammingMatrix as BandedDynamicProgrammingMatrix
+        from zetafold.recursions.array_dynamic_programming import DynamicProgrammingList
+        DynamicProgrammingMatrix = partial( BandedDynamicProgrammingMatrix, max_bp_span = self.max_bp_span )
     if self.use_simple_recursions: # over-ride with simpler recursions that are easier for user to input.
         from zetafold.recursions.recursions import update_Z_BPq, update_Z_BP, update_Z_cut, update_Z_coax, update_C_eff_basic, update_C_eff_no_BP_singlet, update_C_eff_no_coax_singlet, update_C_eff, update_Z_final, update_Z_linear
         from zetafold.recursions.dynamic_programming import DynamicProgrammingMatrix, DynamicProgrammingList
 
+    # Z_BPq is only nonzero at candidate base pairs -- store sparsely, unless engine needs whole arrays.
+    Z_BPq_Matrix = DynamicProgrammingMatrix
+    if self.engine == 'explicit' and not self.banded and not self.use_simple_recursions:
+        from zetafold.recursions.sparse_dynamic_programming import DynamicProgrammingMatrix as Z_BPq_Matrix
+
     N = self.N
 
     # Collection of all N X N dynamic programming matrices -- order in this list will
@@ -200,9 +341,9 @@ def initialize_dynamic_programming_matrices( self ):
     # base pairs and co-axial stacks
     self.Z_BPq = {}
     for base_pair_type in self.base_pair_types:
-        # the bpt = base_pair_type holds the base_pair_type info in the lambda (Python FAQ)
-        update_func = lambda partition,i,j,bpt=base_pair_type: update_Z_BPq(partition,i,j,bpt)
-        self.Z_BPq[ base_pair_type ] = DynamicProgrammingMatrix( N, update_func = update_func, options = self.options, name = 'Z_BPq_%s' % base_pair_type.get_tag() )
+        # partial (not a lambda) holds the base_pair_type info, so that the partition can be pickled
+        update_func = partial( update_Z_BPq, base_pair_type = base_pair_type )
+        self.Z_BPq[ base_pair_type ] = Z_BPq_Matrix( N, update_func = update_func, options = self.options, name = 'Z_BPq_%s' % base_pair_type.get_tag() )
 
     self.Z_BP     = DynamicProgrammingMatrix( N, DPlist = Z_all, update_func = update_Z_BP, options = self.options, name = 'Z_BP' );
     self.Z_coax   = DynamicProgrammingMatrix( N, DPlist = Z_all, update_func = update_Z_coax, options = self.options, name = 'Z_coax' );
@@ -219,8 +360,43 @@ def initialize_dynamic_programming_matrices( self ):
     # Last DP 1-D list (not a 2-D N x N matrix)
     self.Z_final = DynamicProgrammingList( N, update_func = update_Z_final, options = self.options, name = 'Z_final'  )
 
+    # All matrices that can show up in backtrack_info, numbered so that element (i,j) of matrix m is
+    #  packed into integer code ( m * N + i ) * N + j. See BacktrackRecords.
+    self.Z_backtrack = [ self.Z_BPq[ base_pair_type ] for base_pair_type in self.base_pair_types ] + Z_all
+    self.Z_backtrack_base_pair_type = list( self.base_pair_types ) + [ None ] * len( Z_all )
+    for (m,Z) in enumerate( self.Z_backtrack ): Z.backtrack_code = m * N * N
+
+    # generated kernel that updates all of Z_all along a diagonal in one call -- for the default pure-Python engine.
+    from zetafold.recursions.explicit_recursions import update_diagonal, update_diagonal_max, fused_update_order
+    self.update_diagonal = None
+    if self.engine == 'explicit' and not self.banded and not self.use_simple_recursions and \
+       [ Z.update_func.__name__ for Z in Z_all ] == fused_update_order:
+        self.update_diagonal = update_diagonal_max if self.semiring == 'max' else update_diagonal
+
     self.params.check_C_eff_stack()
 
+def use_banded_storage( self ):
+    '''
+    Banded matrices only hold elements (i,j) with 0 <= j - i <= max_bp_span -- enough for Z_final(0) of
+     a linear sequence, and for bpp and derivatives from the outside pass (outside.py), but not for the
+     wrap-around elements needed for circles (or with outside = False).
+    '''
+    if self.max_bp_span == None or self.max_bp_span >= self.N - 1: return False
+    if self.circle or self.calc_all_elements or self.use_simple_recursions: return False
+    return True
+
+def initialize_sparse_storage( self ):
+    '''
+    Sparse Z_BPq matrices (sparse_dynamic_programming.py) hold elements for possible_base_pair_indices only,
+     looked up through one CandidateIndex for all base pair types.
+    '''
+    if not any( hasattr( Z_BPq, 'set_candidates' ) for Z_BPq in self.Z_BPq.values() ): return
+    from zetafold.recursions.sparse_dynamic_programming import CandidateIndex
+    candidates = [ self.possible_base_pair_indices[ base_pair_type ] for base_pair_type in self.base_pair_types ]
+    candidate_index = CandidateIndex( self.N, candidates )
+    for (t,base_pair_type) in enumerate( self.base_pair_types ):
+        self.Z_BPq[ base_pair_type ].set_candidates( candidate_index, t, candidates[ t ] )
+
 ##################################################################################################
 def initialize_force_base_pair( self ):
     self.allow_base_pair     = None
@@ -241,71 +417,89 @@ def initialize_force_base_pair( self ):
         self.C_eff.set_val( i, i, 0.0 )
         self.C_eff.set_val( j, j, 0.0 )
 
-    if not self.allow_extra_base_pairs:
-        self.allow_base_pair = initialize_matrix( N, False )
-        # only allow base pairs specified in structure
-        for i,j in bp_list:
-            self.allow_base_pair[ i ][ j ] = True
-            self.allow_base_pair[ j ][ i ] = True
-    else:
-        assert( self.allow_extra_base_pairs )
-        # allow the specified base pairs (indeed, force them), but
-        #  also allow any base pairs that do not cross with them.
-        self.allow_base_pair = initialize_matrix( N, True )
-        for i,j in bp_list:
-            # no crossing pairs
-            for m in range( i+1, j ):
-                for n in range( j+1, i+N ):
-                    if (( m - n ) % N) == 0: continue
-                    self.allow_base_pair[ m ][ n ] = False
-                    self.allow_base_pair[ n ][ m ] = False
-            # no other partners
-            for m in range( N ):
-                if m != j:
-                    self.allow_base_pair[ i ][ m ] = False
-                    self.allow_base_pair[ m ][ i ] = False
-                if m != i:
-                    self.allow_base_pair[ j ][ m ] = False
-                    self.allow_base_pair[ m ][ j ] = False
+    # only allow base pairs specified in structure, or, with allow_extra_base_pairs,
+    #  also allow any base pairs that do not cross with them.
+    self.allow_base_pair = ForcedBasePairs( bp_list, N, self.allow_extra_base_pairs )
 
 ##################################################################################################
 def initialize_possible_base_pair_types( self ):
+    '''
+    possible_base_pair_indices[ base_pair_type ] = ( I, J ), arrays of all (i,j) where base_pair_type can form,
+     sorted by i, then j. Candidates are found with array operations on sequence_codes over all (i,j) at once
+     (or over the band, for banded storage).
+    possible_base_pair_types[i][j] = base pair types that can form between i and j, for recursions that go one
+     element at a time. Each row is made from possible_base_pair_indices the first time it is looked up --
+     engines that fill whole diagonals use possible_base_pair_indices directly.
+    '''
     N = self.N
-    sequence = self.sequence
-    self.possible_base_pair_types = initialize_matrix( N, None, wrapped = self.use_simple_recursions )
+    I = np.arange( N )[:,None]
+    if self.banded:
+        J = I + np.arange( self.max_bp_span + 1 )[None,:]
+    else:
+        J = np.arange( N )[None,:]
+    ( I, J ) = np.broadcast_arrays( I, J )
+    in_range = ( J < N )
+    self.possible_base_pair_indices = get_possible_base_pair_indices( self, I[ in_range ], J[ in_range ] )
+    initialize_possible_base_pair_types_matrix( self )
 
-    for i in range( N ):
-        for j in range( N ):
-            self.possible_base_pair_types[i][j] = []
+def get_possible_base_pair_indices( self, I, J ):
+    '''
+    ( I[ match ], J[ match ] ) for each base_pair_type, where match picks out the elements (I,J) (1-D arrays)
+     at which base_pair_type can form.
+    '''
+    N = self.N
+    allowed = np.ones( len( I ), dtype = bool )
+    if self.max_bp_span != None: allowed &= ( abs( J - I ) <= self.max_bp_span )
 
-            # note that following could be conditions on base_pair_type pretty easily
-            if self.allow_base_pair and not self.allow_base_pair[i][j]: continue
+    # note that following could be conditions on base_pair_type pretty easily
+    if self.allow_base_pair:
+        allowed &= self.allow_base_pair.allowed( I, J )
 
-            # minimum loop length -- no other way to penalize short segments.
-            if ( self.all_ligated[i][j] and ( ((j-i-1) % N)) < self.params.min_loop_length ): continue
-            if ( self.all_ligated[j][i] and ( ((i-j-1) % N)) < self.params.min_loop_length ): continue
+    # minimum loop length -- no other way to penalize short segments.
+    min_loop_length = self.params.min_loop_length
+    allowed &= ~( self.all_ligated.no_cutpoint( I, J ) & ( ( J - I - 1 ) % N < min_loop_length ) )
+    allowed &= ~( self.all_ligated.no_cutpoint( J, I ) & ( ( I - J - 1 ) % N < min_loop_length ) )
 
-            for base_pair_type in self.base_pair_types:
-                if not base_pair_type.is_match( sequence[i], sequence[j] ): continue
-                self.possible_base_pair_types[ i ][ j ].append( base_pair_type )
+    codes = self.sequence_codes
+    possible_base_pair_indices = {}
+    for base_pair_type in self.base_pair_types:
+        match = allowed & base_pair_type.is_match_codes( codes[ I ], codes[ J ] )
+        possible_base_pair_indices[ base_pair_type ] = ( I[ match ], J[ match ] )
+    return possible_base_pair_indices
 
+def initialize_possible_base_pair_types_matrix( self ):
+    N = self.N
+    self.possible_base_pair_types = LazyMatrix( N, partial( get_possible_base_pair_types_row, N, self.base_pair_types,
+                                                            self.possible_base_pair_indices, self.use_simple_recursions ) )
+
+def get_possible_base_pair_types_row( N, base_pair_types, possible_base_pair_indices, wrapped, i ):
+    '''
+    Row i of possible_base_pair_types. Elements with a single base pair type share one list -- do not modify.
+    '''
+    row = WrappedArray( N, [] ) if wrapped else SparseRow( [] )
+    for base_pair_type in base_pair_types:
+        ( I, J ) = possible_base_pair_indices[ base_pair_type ]
+        ( start, stop ) = np.searchsorted( I, [ i, i+1 ] )
+        single = [ base_pair_type ]
+        for j in J[ start:stop ].tolist(): row[ j ] = ( row[ j ] + single ) if row[ j ] else single
+    return row
 
 def intersect(a, b):  return list(set(a) & set(b))
 
 ##################################################################################################
 sequence_match = { 'N':{'A','C','G','U'}, 'A':{'A'},'C':{'C'},'G':{'G'},'U':{'U'}, 'R':{'A','G'}, 'Y':{'C','U'} }
-def check_match( target, s ):
-    if not target in sequence_match: return False
-    if s not in sequence_match[ target ]: return False
-    return True
-
+# sequence_match_table[ c ][ code ] is True if sequence character with ord code matches strand character c
+sequence_match_table = {}
+for ( c, matches ) in sequence_match.items():
+    sequence_match_table[ c ] = np.zeros( 256, dtype = bool )
+    sequence_match_table[ c ][ get_sequence_codes( sorted( matches ) ) ] = True
+no_sequence_match = np.zeros( 256, dtype = bool )
 def initialize_strand_match( self ):
     '''
     check for strand matches (an order N operation -- not need to keep doing it over and over again in motif_type.get_match_base_pair_type_sets()
+    is_strand_match[ strand ] = bool array, True at i if strand matches sequence starting at i.
     '''
     N = self.N
-    sequence = self.sequence
-
     strands = set()
     self.max_motif_strand_length = 0
     for motif_type in self.params.motif_types:
@@ -313,61 +507,164 @@ def initialize_strand_match( self ):
             strands.add( strand )
             self.max_motif_strand_length = max( self.max_motif_strand_length, len(strand) )
 
+    I = np.arange( N )
+    codes = self.sequence_codes
+    if self.in_forced_base_pair: in_forced_base_pair = np.array( [ self.in_forced_base_pair[n] for n in range( N ) ], dtype = bool )
     is_strand_match = {}
     for strand in strands:
-        is_strand_match[strand] = WrappedArray( N, False )
-        for i in range( N ):
-            if not self.all_ligated[ i ][ i+len(strand)-1 ]: continue
-            match = True
-            for offset in range( len( strand ) ):
-                if not check_match( strand[offset], sequence[(i+offset)%N] ):
-                    match = False
-                    break
-            if self.in_forced_base_pair:
-                for offset in range( 1, len(strand) - 1 ): # ensure no internal positions are in forced base pair.
-                    if self.in_forced_base_pair[ (i + offset)%N ]:
-                        match = False
-                        break
-            if match: is_strand_match[strand][i] = True
+        match = self.all_ligated.no_cutpoint( I, I + len(strand) - 1 )
+        for offset in range( len( strand ) ):
+            if not match.any(): break
+            match &= sequence_match_table.get( strand[offset], no_sequence_match )[ codes[ (I + offset) % N ] ]
+        if self.in_forced_base_pair:
+            for offset in range( 1, len(strand) - 1 ): # ensure no internal positions are in forced base pair.
+                match &= ~in_forced_base_pair[ (I + offset) % N ]
+        is_strand_match[strand] = match
 
     return is_strand_match
 
 ##################################################################################################
 def initialize_possible_motif_types( self ):
+    '''
+    possible_motif_indices[ base_pair_type ] = ( K, M, T_next, K_next ), arrays with one entry for each motif
+     closed by a candidate base pair: base pair K in possible_base_pair_indices[ base_pair_type ] closes
+     params.motif_types[ M ], and for internal loops, the next base pair is K_next in
+     possible_base_pair_indices[ base_pair_types[ T_next ] ] (T_next = K_next = -1 for hairpins). Sorted by K.
+    Strand and loop length matches are checked over all candidate (i,j) for a base_pair_type at once.
+    possible_motif_types[i][j][base_pair_type] = { motif_type: True (hairpin) or [ (base_pair_type_next, i_next, j_next), ... ] (internal loop) }
+     for recursions that go one element at a time -- made from possible_motif_indices when first looked up, so a
+     linear fill never makes elements with i > j.
+    '''
+    self.possible_motif_indices = get_possible_motif_indices( self )
+    initialize_possible_motif_types_matrix( self )
+
+def get_possible_motif_indices( self, closing_candidates = None ):
+    '''
+    possible_motif_indices (see initialize_possible_motif_types), for all candidate base pairs, or only for
+     those in closing_candidates[ base_pair_type ] = indices K into possible_base_pair_indices[ base_pair_type ]
+    '''
     N = self.N
-    sequence = self.sequence
     is_strand_match = initialize_strand_match( self )
-    self.possible_motif_types = initialize_matrix( N, None, wrapped = self.use_simple_recursions )
-    # OK assign possible_motif_types
-    for i in range( N ):
-        for j in range( N ):
-            self.possible_motif_types[i][j] = {}
+    matched_strands = set( strand for ( strand, match ) in is_strand_match.items() if match.any() )
+    bpt_index = dict( (base_pair_type,t) for (t,base_pair_type) in enumerate( self.base_pair_types ) )
+    # sorted i*N + j for each base_pair_type, for lookups with searchsorted
+    pair_keys = dict( ( base_pair_type, I * N + J ) for ( base_pair_type, (I, J) ) in self.possible_base_pair_indices.items() )
+    def find_base_pair( base_pair_type, i, j ):
+        '''
+        index of (i,j) in possible_base_pair_indices[ base_pair_type ], or -1
+        '''
+        keys = pair_keys[ base_pair_type ]
+        if len( keys ) == 0: return -np.ones( len( i ), dtype = int )
+        query = ( i % N ) * N + ( j % N )
+        K = np.minimum( np.searchsorted( keys, query ), len( keys ) - 1 )
+        return np.where( keys[ K ] == query, K, -1 )
 
-            for base_pair_type in self.possible_base_pair_types[i][j]:
-                self.possible_motif_types[i][j][base_pair_type] = {}
-
-                for motif_type in self.params.motif_types:
-                    if not base_pair_type.flipped in motif_type.base_pair_type_sets[-1]: continue
-                    strands = motif_type.strands
-                    if not is_strand_match[strands[0]][i]: continue
-                    if len( motif_type.strands ) > 1: # internal loop
-                        if not is_strand_match[strands[1]][j-len(strands[1])+1]: continue
-                    if len( motif_type.strands ) == 1: # hairpin
-                        if not (( j - i) % N) == len( motif_type.strands[0] )-1: continue
-                    if len( motif_type.strands ) > 1: # internal loop
-                        if (( j - i) % N) < len( motif_type.strands[0] ) + len( motif_type.strands[1] ) - 1: continue
-
-                    if len( motif_type.strands) == 1: #hairpin
-                        self.possible_motif_types[i][j][base_pair_type][motif_type] = True # ugly hack
-                    if len( motif_type.strands ) > 1: # internal loop
-                        match_base_pair_type_set = []
-                        i_next = i+len(strands[0])-1
-                        j_next = j-len(strands[1])+1
-                        for base_pair_type2 in motif_type.base_pair_type_sets[0]:
-                            if not base_pair_type2 in self.possible_base_pair_types[ i_next ][ j_next ]: continue
-                            match_base_pair_type_set.append( (base_pair_type2,i_next,j_next) )
-                        if len( match_base_pair_type_set ) == 0: continue
-                        self.possible_motif_types[i][j][base_pair_type][motif_type] = match_base_pair_type_set
+    possible_motif_indices = {}
+    for base_pair_type in self.base_pair_types:
+        ( I, J ) = self.possible_base_pair_indices[ base_pair_type ]
+        K_closing = np.arange( len( I ) ) if closing_candidates == None else closing_candidates[ base_pair_type ]
+        ( I, J ) = ( I[ K_closing ], J[ K_closing ] )
+        motifs = [] # ( K, m, t_next, K_next )
+        for (m,motif_type) in enumerate( self.params.motif_types ):
+            if len( I ) == 0: break
+            if not base_pair_type.flipped in motif_type.base_pair_type_sets[-1]: continue
+            strands = motif_type.strands
+            if not all( strand in matched_strands for strand in strands ): continue
+            match = is_strand_match[strands[0]][ I ]
+            if len( strands ) == 1: # hairpin
+                match &= ( ( J - I ) % N == len( strands[0] ) - 1 )
+                K = np.nonzero( match )[0]
+                if len( K ) > 0: motifs.append( ( K_closing[ K ], m, -1, -np.ones( len( K ), dtype = int ) ) )
+                continue
+
+            # internal loop
+            match &= is_strand_match[strands[1]][ ( J - len(strands[1]) + 1 ) % N ]
+            match &= ( ( J - I ) % N >= len( strands[0] ) + len( strands[1] ) - 1 )
+            K = np.nonzero( match )[0]
+            if len( K ) == 0: continue
+            I_next = I[ K ] + len(strands[0]) - 1
+            J_next = J[ K ] - len(strands[1]) + 1
+            for base_pair_type2 in motif_type.base_pair_type_sets[0]:
+                match = base_pair_type2.is_match_codes( self.sequence_codes[ I_next % N ], self.sequence_codes[ J_next % N ] )
+                if not match.any(): continue
+                K_next = find_base_pair( base_pair_type2, I_next[ match ], J_next[ match ] )
+                found = ( K_next >= 0 )
+                motifs.append( ( K_closing[ K[ match ][ found ] ], m, bpt_index[ base_pair_type2 ], K_next[ found ] ) )
+
+        # int32 -- there can be tens of entries for each candidate base pair.
+        columns = [ [ np.zeros( 0, dtype = np.int32 ) ] for n in range( 4 ) ]
+        for (K_motif, m, t_next, K_next_motif) in motifs:
+            for (column, X) in zip( columns, ( K_motif, np.full( len( K_motif ), m ), np.full( len( K_motif ), t_next ), K_next_motif ) ):
+                column.append( X.astype( np.int32 ) )
+        ( K, M, T_next, K_next ) = [ np.concatenate( column ) for column in columns ]
+        order = np.argsort( K, kind = 'mergesort' ) # keep motif order for each base pair
+        possible_motif_indices[ base_pair_type ] = ( K[ order ], M[ order ], T_next[ order ], K_next[ order ] )
+    return possible_motif_indices
+
+def initialize_possible_motif_types_matrix( self ):
+    N = self.N
+    self.possible_motif_types = LazyMatrix( N, partial( get_possible_motif_types_row, N, self.base_pair_types, self.params.motif_types,
+                                                        self.possible_base_pair_indices, self.possible_motif_indices, self.use_simple_recursions ) )
+
+def get_possible_motif_types_row( N, base_pair_types, motif_types, possible_base_pair_indices, possible_motif_indices, wrapped, i ):
+    '''
+    Row i of possible_motif_types -- elements are made when first looked up, except for simple recursions
+    '''
+    columns = {} # j --> [ (base_pair_type, k), ... ], with (i,j) = base pair k in possible_base_pair_indices[ base_pair_type ]
+    for base_pair_type in base_pair_types:
+        ( I, J ) = possible_base_pair_indices[ base_pair_type ]
+        ( start, stop ) = np.searchsorted( I, [ i, i+1 ] )
+        for (k,j) in enumerate( J[ start:stop ].tolist(), start ): columns.setdefault( j, [] ).append( ( base_pair_type, k ) )
+    get_element = partial( get_possible_motif_types_element, base_pair_types, motif_types, possible_base_pair_indices, possible_motif_indices, columns )
+    if not wrapped: return LazySparseRow( {}, columns, get_element )
+    row = WrappedArray( N, {} )
+    for j in columns: row[ j ] = get_element( j )
+    return row
+
+def get_possible_motif_types_element( base_pair_types, motif_types, possible_base_pair_indices, possible_motif_indices, columns, j ):
+    '''
+    possible_motif_types[i][j], for candidate base pairs columns[ j ] at (i,j)
+    '''
+    element = {}
+    for (base_pair_type, k) in columns[ j ]:
+        motifs = element[ base_pair_type ] = {}
+        ( K, M, T_next, K_next ) = possible_motif_indices[ base_pair_type ]
+        ( first, last ) = np.searchsorted( K, [ k, k+1 ] )
+        for (m, t_next, k_next) in zip( M[first:last].tolist(), T_next[first:last].tolist(), K_next[first:last].tolist() ):
+            motif_type = motif_types[ m ]
+            if t_next < 0:
+                motifs[ motif_type ] = True # ugly hack
+                continue
+            base_pair_type_next = base_pair_types[ t_next ]
+            ( I_next, J_next ) = possible_base_pair_indices[ base_pair_type_next ]
+            if not motif_type in motifs: motifs[ motif_type ] = []
+            motifs[ motif_type ].append( ( base_pair_type_next, int( I_next[ k_next ] ), int( J_next[ k_next ] ) ) )
+    return element
+
+def get_possible_motif_arrays( self ):
+    '''
+    All motifs in possible_motif_indices, as arrays ( t, i, j, m, t_next, i_next, j_next ): base_pair_types[t] at (i,j)
+     closes params.motif_types[m], and for internal loops, next base pair is base_pair_types[t_next] at (i_next,j_next)
+     (all -1 for hairpins). For engines that fill whole diagonals.
+    '''
+    arrays = []
+    for (t,base_pair_type) in enumerate( self.base_pair_types ):
+        ( I, J ) = self.possible_base_pair_indices[ base_pair_type ]
+        ( K, M, T_next, K_next ) = self.possible_motif_indices[ base_pair_type ]
+        I_next = -np.ones( len( K ), dtype = int )
+        J_next = -np.ones( len( K ), dtype = int )
+        for (t_next,base_pair_type_next) in enumerate( self.base_pair_types ):
+            is_next = ( T_next == t_next )
+            ( I_next[ is_next ], J_next[ is_next ] ) = [ X[ K_next[ is_next ] ] for X in self.possible_base_pair_indices[ base_pair_type_next ] ]
+        arrays.append( ( t * np.ones( len( K ), dtype = int ), I[ K ], J[ K ], M, T_next, I_next, J_next ) )
+    return [ np.concatenate( [ X[n] for X in arrays ] ).astype( int ) for n in range( 7 ) ]
+
+def split_by_offset( X, offset, num_offsets ):
+    '''
+    Rows of X, in a list with one array for each offset = 0 ... num_offsets-1
+    '''
+    order = np.argsort( offset, kind = 'mergesort' )
+    return np.split( X[ order ], np.searchsorted( offset[ order ], np.arange( 1, num_offsets ) ) )
 
 ##################################################################################################
 def _get_bpp_matrix( self ):
@@ -377,74 +674,99 @@ def _get_bpp_matrix( self ):
       as structures in j..i encapsulated by those pairs.
     So: it becomes easy to calculate partition function over all structures with base pair (i,j), and then divide by total Z.
     '''
+    if self.use_outside:
+        from zetafold.recursions.outside import get_bpp_outside
+        self.bpp = get_bpp_outside( self ).tolist()
+        return
     assert( self.calc_all_elements )
     self.bpp = [None]*self.N
     for i in range( self.N ): self.bpp[i] = [0.0]*self.N
     for i in range( self.N ):
         for j in range( self.N ):
-            for base_pair_type in self.params.base_pair_types:
-                if not base_pair_type.is_match( self.sequence[i],self.sequence[j] ): continue
-                self.bpp[i][j] += self.Z_BPq[base_pair_type].val(i,j) * self.Z_BPq[base_pair_type.flipped].val(j,i) * base_pair_type.Kd / self.Z_final.val(0)
+            for base_pair_type in self.possible_base_pair_types[i][j]:
+                self.bpp[i][j] += self.Z_BPq[base_pair_type].val(i,j) * self.Z_BPq[base_pair_type.flipped].val(j,i) * base_pair_type.Kd / self.Z_final.val(0) / self.scale**2
 
 ##################################################################################################
 def _calc_mfe( self ):
     '''
-     Wrapper into mfe(), written out in backtrack.py
-     Note that this is not *quite* MFE -- would have to rerun dynamic programming with max() instead of sum over Z
-     And that means that backtracking from different points can lead to different apparent MFE's -- for example
-      a fully unfolded structure can be accumulated with a bunch of dinky hairpins to win over the actual MFE.
-    Example case:
-         CAAUGCUCAUUGGG G --circle
-    vs.
-         GCAAUGCUCAUUGGG
+    Fill dynamic programming matrices again with max() instead of sum() over contributions ('max' semiring,
+     see semiring_util.py). Each element then holds the Boltzmann weight of its best substructure, so one
+     backtrack from Z_final(0) following maximum contributions gives the exact minimum free energy structure.
     '''
-    N = self.N
-    p_MFE   = [0.0]*N
-    bps_MFE = [[]]*N
-
-    # there are actually numerous ways to calculate MFE if we did all N^2 elements -- let's check.
-    n_test = N if self.calc_all_elements else 1
     if not self.suppress_all_output:
-        print('Doing backtrack to get minimum free energy structure...')
-
-    all_bps_MFE = set()
-    for i in range( n_test ):
-        (bps_MFE[i], p_MFE[i] ) = mfe( self, self.Z_final.get_backtrack_info(self,i) )
-        if len(all_bps_MFE) > 0 and not ( tuple(bps_MFE[i]) in all_bps_MFE ):
-            if not self.suppress_all_output:
-                print( 'Warning, MFE structure computed only approximately from partition, and another structure had been found backtracking from position %d:' % i )
-                print( secstruct_from_bps(bps_MFE[i],N), "   ", p_MFE[i], "[MFE?]")
-        all_bps_MFE.add( tuple(bps_MFE[i]) )
-        #assert_equal( p_MFE[i], p_MFE[0] )
-        # actually this doesn't always hold -- in some parameter sets and sequences there are literally ties.
-        # assert( bps_MFE[i] == bps_MFE[0] )
-
-    self.bps_MFE = bps_MFE[0]
-    self.struct_MFE = secstruct_from_bps( bps_MFE[0], N)
+        print('Doing max-product fill and backtrack to get minimum free energy structure...')
+    p_max = get_semiring_partition( self, 'max' )
+    (bps_MFE, p_MFE) = mfe( p_max, p_max.Z_final.get_backtrack_info( p_max, 0 ) )
+    self.bps_MFE = bps_MFE
+    self.struct_MFE = secstruct_from_bps( bps_MFE, self.N )
+    self.dG_MFE = -KT_IN_KCAL * p_max.logZ if p_max.logZ != None else None
+
+def _calc_num_states( self ):
+    '''
+    Fill dynamic programming matrices again with all weights set to 1 ('count' semiring, see semiring_util.py).
+    This counts states of the model -- the same base pairs with and without coaxial stacks, etc. count separately.
+    '''
+    p_count = get_semiring_partition( self, 'count' )
+    self.num_states = p_count.Z
+
+def get_semiring_partition( self, semiring ):
+    '''
+    Partition object with same sequence and constraints as self, with dynamic programming
+     matrices filled (for Z_final(0) only) in semiring. Uses explicit_recursions.py (banded.py with max_bp_span,
+     as in use_banded_storage()), or recursions.py with --simple.
+    '''
+    p = Partition( self.sequences, get_semiring_params( self.params, semiring ) )
+    p.semiring  = semiring
+    p.use_simple_recursions = self.use_simple_recursions
+    p.max_bp_span = self.max_bp_span
+    p.circle    = self.circle
+    p.structure = self.structure
+    p.allow_extra_base_pairs = self.allow_extra_base_pairs
+    p.suppress_all_output = True
+    p.sequence_setup = self.sequence_setup
+    p.run()
+    return p
 
 ##################################################################################################
-def _stochastic_backtrack( self, N_backtrack ):
+def _stochastic_backtrack( self, N_backtrack, seed = None, jobs = 1 ):
     #
     # Get stochastic, Boltzmann-weighted structural samples from partition function
     #
-    print('Doing',N_backtrack,'stochastic backtracks to get Boltzmann-weighted ensemble...')
-    for i in range( N_backtrack ):
-        bps, p = boltzmann_sample( self, self.Z_final.get_backtrack_info(self,0) )
-        self.struct_stochastic.append( secstruct_from_bps(bps,self.N) )
+    if not self.suppress_all_output:
+        print('Doing',N_backtrack,'stochastic backtracks to get Boltzmann-weighted ensemble...')
+    secstructs = {}
+    for bps in boltzmann_draws( self, N_backtrack, seed, jobs ):
+        if bps not in secstructs: secstructs[ bps ] = secstruct_from_bps( list(bps), self.N )
+        self.struct_stochastic.append( secstructs[ bps ] )
+    self.stochastic_counts = Counter( self.struct_stochastic )
     return
 
 ##################################################################################################
-def _enumerative_backtrack( self ):
+def _k_best( self, k ):
     #
-    # Enumerate all structures, and track their probabilities
+    # Get structures of k most probable model states by best-first backtracking; returns list of (probability, structure),
+    #  where probability is that of the most probable state with the structure's base pairs (see k_best_backtrack).
     #
-    print('Doing complete enumeration of Boltzmann-weighted ensemble...')
-    p_bps = enumerative_backtrack( self )
-    for (p,bps) in p_bps:
+    if not self.suppress_all_output:
+        print('Doing best-first backtrack to get structures of',k,'most probable model states...')
+    p_bps = k_best_backtrack( self, k, unique = True )
+    self.p_k_best = [ p for (p,bps) in p_bps ]
+    self.struct_k_best = [ secstruct_from_bps( bps, self.N ) for (p,bps) in p_bps ]
+    return list( zip( self.p_k_best, self.struct_k_best ) )
+
+##################################################################################################
+def _enumerative_backtrack( self, dG_gap_cutoff = None ):
+    #
+    # Enumerate all structures (or all within dG_gap_cutoff of ensemble), and track their probabilities
+    #
+    if dG_gap_cutoff == None: print('Doing complete enumeration of Boltzmann-weighted ensemble...')
+    else: print('Doing enumeration of structures within',dG_gap_cutoff,'kcal/mol of ensemble...')
+    p_tot = 0.0
+    for (p,bps) in enumerate_structures( self, dG_gap_cutoff = dG_gap_cutoff ):
         self.struct_enumerate.append( secstruct_from_bps(bps,self.N) )
-    p_tot = sum( p_bp[0] for p_bp in p_bps )
+        p_tot += p
     print('p_tot = ',p_tot)
-    assert( abs(p_tot - 1.0) < 1.0e-5 )
+    if dG_gap_cutoff == None: assert( abs(p_tot - 1.0) < 1.0e-5 )
     return
 
 ##################################################################################################
@@ -459,13 +781,18 @@ def _run_cross_checks( self ):
     # stringent test that partition function is correct -- all the Z(i,i) agree.
     if self.calc_all_elements:
         for i in range( self.N ): assert_equal( self.Z_final.val(0), self.Z_final.val(i) )
+    # for the outside pass on a linear RNA, Z_final(0) summed N-1 ways.
+    if self.use_outside:
+        from zetafold.recursions.outside import get_Z_final_outside
+        for Z_final in get_Z_final_outside( self ): assert_equal( self.Z_final.val(0), Z_final )
 
     if self.deriv_check:
         print('\nCHECKING LOG DERIVS:')
-        logZ_val  = log( self.Z )
-        p_shift = partition( self.sequences, circle = self.circle, params = self.params, mfe = False, suppress_all_output = True, structure = self.structure, allow_extra_base_pairs = self.allow_extra_base_pairs )
-        print( 'Check logZ value upon recomputation: ',logZ_val, 'vs', log(p_shift.Z) )
-        assert_equal( logZ_val, log(p_shift.Z) )
+        logZ_val  = self.logZ
+        p_shift = partition( self.sequences, circle = self.circle, params = self.params, mfe = False, suppress_all_output = True, structure = self.structure, allow_extra_base_pairs = self.allow_extra_base_pairs,
+                             max_bp_span = self.max_bp_span, engine = self.engine )
+        print( 'Check logZ value upon recomputation: ',logZ_val, 'vs', p_shift.logZ )
+        assert_equal( logZ_val, p_shift.logZ )
         analytic_grad_val = self.log_derivs
         epsilon = 1.0e-8
         numerical_grad_val = []
@@ -475,8 +802,9 @@ def _run_cross_checks( self ):
                 numerical_grad_val.append( 0.0 )
                 continue
             self.params.set_parameter( param,  exp( log(save_val) + epsilon ) )
-            p_shift = partition( self.sequences, circle = self.circle, params = self.params, mfe = False, suppress_all_output = True, structure = self.structure, allow_extra_base_pairs = self.allow_extra_base_pairs )
-            numerical_grad_val.append( ( log( p_shift.Z ) - logZ_val ) / epsilon )
+            p_shift = partition( self.sequences, circle = self.circle, params = self.params, mfe = False, suppress_all_output = True, structure = self.structure, allow_extra_base_pairs = self.allow_extra_base_pairs,
+                             max_bp_span = self.max_bp_span, engine = self.engine )
+            numerical_grad_val.append( ( p_shift.logZ - logZ_val ) / epsilon )
             self.params.set_parameter( param, save_val )
 
         print()
@@ -489,3 +817,14 @@ def _run_cross_checks( self ):
             if abs( val1 ) > 0.001:
                 if abs( val1 - val2 )/val2 > 1.0e-3: print( 'ISSUE!!', val1, val2 )
                 assert_equal( val1, val2, 1.0e-3 ) # seeing numerical issues for very small vals
+
+        if self.calc_all_elements:
+            # hand-derived formulas vs. outside recursions generated from recursions.py
+            print( 'Check expected counts from outside recursions against hand-derived formulas' )
+            counts = get_expected_counts( self )
+            counts_check = get_expected_counts_from_matrices( self )
+            for tag in counts_check: assert( np.allclose( counts[ tag ], counts_check[ tag ], rtol = 1.0e-6, atol = 1.0e-9 ) )
+        elif self.use_outside:
+            # hand-derived terms of the vectorized outside pass vs. outside recursions generated from recursions.py
+            print( 'Check expected counts from outside recursions against vectorized outside pass' )
+            for tag in self.outside_counts_vectorized: assert( np.allclose( self.outside_counts[ tag ], self.outside_counts_vectorized[ tag ], rtol = 1.0e-6, atol = 1.0e-9 ) )
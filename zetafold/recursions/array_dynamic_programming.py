@@ -0,0 +1,77 @@
+#
+# Same interface as explicit_dynamic_programming.py, but values are held in NumPy arrays --
+#  allows whole rows, columns, or diagonals to be read out as contiguous slices.
+#
+import numpy as np
+from collections import defaultdict
+from zetafold.recursions.explicit_dynamic_programming import BacktrackRecords
+
+class DynamicProgrammingMatrix:
+    '''
+    Dynamic Programming 2-D Matrix, stored as an N x N ndarray, that automatically:
+      knows how to update values at i,j
+    '''
+    def __init__( self, N, val = 0.0, diag_val = 0.0, DPlist = None, update_func = None, options = None, name = None ):
+        self.N = N
+
+        self.Q = np.full( (N,N), val, dtype = np.float64 )
+        np.fill_diagonal( self.Q, diag_val )
+
+        self.backtrack_info = [ defaultdict( BacktrackRecords ) for i in range( N ) ] # only filled by get_backtrack_info()
+        self.backtrack_info_updated = set()
+
+        if DPlist != None: DPlist.append( self )
+        self.update_func = update_func
+
+        self.name = name
+
+    def val( self, i, j ): return self.Q[i%self.N, j%self.N]
+    def set_val( self, i, j, val ): self.Q[i%self.N, j%self.N] = val
+
+    def update( self, partition, i, j ):
+        self.Q[ i, j ] = 0
+        if partition.options.calc_backtrack_info: self.backtrack_info[ i ][ j ] = BacktrackRecords()
+        self.update_func( partition, i, j )
+
+    def get_backtrack_info( self, partition, i, j ):
+        if not (i,j) in self.backtrack_info_updated:
+            partition.options.calc_backtrack_info = True
+            self.update( partition, i, j )
+            partition.options.calc_backtrack_info = False
+            self.backtrack_info_updated.add( (i,j) )
+        return self.backtrack_info[i][j]
+
+    def __len__( self ):
+        return self.N
+
+class DynamicProgrammingList:
+    '''
+    Dynamic Programming 1-D list, stored as a length-N ndarray, that automatically:
+      does wrapping modulo N,
+      knows how to update values at i,j
+    Used for Z_final
+    '''
+    def __init__( self, N, val = 0.0, update_func = None, options = None, name = None ):
+        self.N = N
+        self.Q = np.full( N, val, dtype = np.float64 )
+        self.backtrack_info = defaultdict( BacktrackRecords )
+        self.backtrack_info_updated = set()
+        self.update_func = update_func
+        self.name = name
+
+    def __len__( self ): return self.N
+
+    def val( self, i ): return self.Q[i]
+
+    def update( self, partition, i ):
+        self.Q[ i ] = 0.0
+        if partition.options.calc_backtrack_info: self.backtrack_info[ i ] = BacktrackRecords()
+        self.update_func( partition, i )
+
+    def get_backtrack_info( self, partition, i ):
+        if not i in self.backtrack_info_updated:
+            partition.options.calc_backtrack_info = True
+            self.update( partition, i )
+            partition.options.calc_backtrack_info = False
+            self.backtrack_info_updated.add( i )
+        return self.backtrack_info[i]
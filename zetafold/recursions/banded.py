@@ -0,0 +1,222 @@
+##################################################################################################
+# banded.py = fills dynamic programming matrices for a linear RNA (or set of strands) in which base
+#  pairs (i,j) are restricted to j - i <= max_bp_span = W.
+#
+# Only elements (i,j) with j - i <= W are nonzero (except Z_coax, up to 2W+1, and the exterior loop
+#  Z_linear(0,j)), so diagonals are filled one at a time as in wavefront.py, but over the band
+#  held in banded_dynamic_programming.py. Each element sums over O(W) split points, so the fill takes
+#  O(N W^2) time and O(N W) memory. The recursions are the same as in explicit_recursions.py --
+#  if you edit recursions.py, make the same change here, and update RECURSIONS_CHECKSUM.
+#
+# Contributions are combined with partition.options.add (via array_sum), so the fill works in each
+#  semiring of semiring_util.py -- e.g., the 'max' fill for MFE also stays within the band.
+#
+# Matrices keep their update_func's pointing to explicit_recursions.py, so backtracking works as usual.
+##################################################################################################
+import numpy as np
+from zetafold.recursions.explicit_recursions import unpack_variables
+from zetafold.util.scale_util import rescale_if_needed
+from zetafold.util.semiring_util import array_sum
+
+# checksum of recursions.py that this file matches -- see checksum.py
+RECURSIONS_CHECKSUM = 'fbb60b6b9b15fb81d6a1c7acd0f3b8c7'
+
+def initialize_banded( self ):
+    '''
+    Precompute information that does not change during the fill -- same as initialize_wavefront(),
+     but with T x N x (W+1) arrays indexed by (t, i, j-i).
+    '''
+    from zetafold.partition import get_possible_motif_arrays, split_by_offset
+    N = self.N
+    W = self.max_bp_span
+    base_pair_types = self.base_pair_types
+    T = len( base_pair_types )
+
+    self.Z_BPq_band = np.zeros( (T,N,W+1) )
+    for (t,base_pair_type) in enumerate( base_pair_types ):
+        self.Z_BPq_band[t] = self.Z_BPq[ base_pair_type ].Q.band
+        self.Z_BPq[ base_pair_type ].Q.band = self.Z_BPq_band[t]
+
+    self.possible_mask = np.zeros( (T,N,W+1), dtype = bool )
+    for (t,base_pair_type) in enumerate( base_pair_types ):
+        ( I, J ) = self.possible_base_pair_indices[ base_pair_type ]
+        self.possible_mask[ t, I, J-I ] = True
+
+    ( t, i, j, m, t_next, i_next, j_next ) = get_possible_motif_arrays( self )
+    motif_C_eff = np.array( [ motif_type.C_eff for motif_type in self.params.motif_types ] )[ m ]
+    hairpin = ( t_next < 0 )
+    self.hairpin_C_eff = np.zeros( (T,N,W+1) )
+    self.options.add.at( self.hairpin_C_eff, ( t[ hairpin ], i[ hairpin ], j[ hairpin ] - i[ hairpin ] ), motif_C_eff[ hairpin ] )
+    self.internal_loops = split_by_offset( np.array( [ t, i, motif_C_eff, t_next, i_next, j_next - i_next ], dtype = float ).T[ ~hairpin ], ( j - i )[ ~hairpin ], W+1 )
+
+    self.C_eff_stack_array = np.array( [ [ self.params.C_eff_stack[bpt1][bpt2] for bpt2 in base_pair_types ] for bpt1 in base_pair_types ] ).reshape( T, T )
+    self.Kd_array = np.array( [ base_pair_type.Kd for base_pair_type in base_pair_types ] )
+    self.ligated_array = np.array( [ float(self.ligated[n]) for n in range(N) ] )
+    self.allow_extension_array = np.ones( N )
+    if self.in_forced_base_pair:
+        for n in range( N ):
+            if self.in_forced_base_pair[n]: self.allow_extension_array[n] = 0.0
+
+def fill_banded( self ):
+    '''
+    Do the dynamic programming, one diagonal at a time within the band, then
+     extend the exterior loop Z_linear(0,j) out to j = N-1.
+    '''
+    initialize_banded( self )
+    W = self.max_bp_span
+    for offset in range( 1, self.N ):
+        if offset <= W:
+            update_band_diagonal( self, offset )
+        else:
+            if self.params.K_coax > 0.0 and offset <= 2*W+1: update_Z_coax_diagonal( self, offset )
+            update_exterior( self, offset )
+        rescale_if_needed( self, offset )
+
+def update_Z_coax_diagonal( self, d ):
+    '''
+    Z_coax(i,i+d) for all i: coaxial stacks between (i,k) and (k+1,j) -- both pairs must fit in the band.
+    '''
+    N = self.N
+    W = self.max_bp_span
+    I = np.arange( N - d )
+    lig = self.ligated_array
+    Z_BP_band = self.Z_BP.Q.band
+    A = np.arange( max( 1, d-1-W ), min( d-2, W ) + 1 )[:,None] # k = i + a
+    self.Z_coax.Q.band[ I, d ] = array_sum( self.options.add, lig[I+A] * Z_BP_band[ I, A ] * Z_BP_band[ I+A+1, d-A-1 ] ) * self.params.K_coax
+
+def update_band_diagonal( self, d ):
+    '''
+    Update all matrices at (i, i+d) for every i at once.
+    Same math as update_diagonal() in wavefront.py, with element (a,b) read from band[a, b-a].
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    n = N - d
+    I = np.arange( n )
+    J = I + d
+    lig = self.ligated_array
+    lig_i, lig_jm1 = lig[ I ], lig[ J-1 ]
+    closes_loop = lig_i * lig_jm1
+    scale  = self.scale
+    scale2 = scale**2
+    ( Z_BP_band, Z_cut_band, Z_coax_band, Z_linear_band, C_eff_band ) = ( Z_BP.Q.band, Z_cut.Q.band, Z_coax.Q.band, Z_linear.Q.band, C_eff.Q.band )
+
+    add = self.options.add # elementwise 'sum' over contributions -- see semiring_util.py
+
+    ##############################
+    # Z_cut
+    # cutpoint c = i + a, a = 0 ... d-1; strand 1 is i --> c, strand 2 is c+1 --> j
+    A = np.arange( d )[:,None]
+    Z_left  = np.where( A == 0,   1.0, lig_i   * Z_linear_band[ I+1, np.maximum( A-1, 0 ) ] )
+    Z_right = np.where( A == d-1, 1.0, lig_jm1 * Z_linear_band[ I+A+1, np.maximum( d-A-2, 0 ) ] )
+    Z_cut_band[ I, d ] = array_sum( add, ( 1.0 - lig[I+A] ) * Z_left * Z_right ) * scale2
+
+    ##############################
+    # Z_BPq for all base pair types. Numerators shared by all types get divided by Kdq at the end.
+    ( C_eff_for_coax_band, C_eff_for_BP_band ) = (C_eff_band, C_eff_band ) if allow_strained_3WJ else (C_eff_no_BP_singlet.Q.band, C_eff_no_coax_singlet.Q.band )
+    Z_BPq_band = self.Z_BPq_band
+    T = len( self.base_pair_types )
+
+    # base pair brings together two strands that were previously disconnected, or closes a loop
+    contribs = [ C_std * Z_cut_band[ I, d ] ]
+    if d >= 2: contribs.append( closes_loop * C_eff_for_BP_band[ I+1, d-2 ] * l * l * l_BP * scale2 )
+
+    if K_coax > 0.0:
+        # coaxial stack of bp (i,j) and (i+1,k) [k = i+2 ... j-2] and closes loop on right.
+        A = np.arange( 2, d-1 )[:,None]
+        contribs.append( closes_loop * array_sum( add, lig[I+A] * Z_BP_band[ I+1, A-1 ] * C_eff_for_coax_band[ I+A+1, d-A-2 ] ) * l**2 * l_coax * K_coax * scale2 )
+        # coaxial stack of bp (i,j) and (k,j-1) [k = i+2 ... j-2], and closes loop on left.
+        contribs.append( closes_loop * array_sum( add, lig[I+A-1] * C_eff_for_coax_band[ I+1, A-2 ] * Z_BP_band[ I+A, d-A-1 ] ) * l**2 * l_coax * K_coax * scale2 )
+        # "left stack" but no loop closed on right [k = i+2 ... j-1]
+        A = np.arange( 2, d )[:,None]
+        contribs.append( lig_i * array_sum( add, Z_BP_band[ I+1, A-1 ] * Z_cut_band[ I+A, d-A ] ) * C_std * K_coax )
+        # "right stack" but no loop closed on left [k = i ... j-2]
+        A = np.arange( 0, d-1 )[:,None]
+        contribs.append( lig_jm1 * array_sum( add, Z_cut_band[ I, A ] * Z_BP_band[ I+A, d-A-1 ] ) * C_std * K_coax )
+
+    Z_BPq_contribs = [ np.tile( array_sum( add, contribs ), (T,1) ) ]
+
+    # base pair forms a stacked pair with previous pair -- 'sum' over previous base pair type t2 of C_eff_stack[t][t2] * Z_BPq[t2]
+    if d >= 2: Z_BPq_contribs.append( closes_loop * array_sum( add, self.C_eff_stack_array.T[:,:,None] * Z_BPq_band[ :, I+1, d-2 ][:,None,:] ) * scale2 )
+
+    # hairpins
+    Z_BPq_contribs.append( self.hairpin_C_eff[ :, I, d ] * scale**( d+1 ) )
+
+    # internal loops -- scatter C_eff * Z_BPq_next into (t,i)
+    internal_loops = self.internal_loops[ d ]
+    if len( internal_loops ) > 0:
+        ( t, i, motif_C_eff, t_next, i_next, d_next ) = internal_loops.T
+        ( t, i, t_next, i_next, d_next ) = [ x.astype( int ) for x in ( t, i, t_next, i_next, d_next ) ]
+        vals = motif_C_eff * Z_BPq_band[ t_next, i_next, d_next ] * scale**( d - d_next )
+        internal_loop_sum = np.zeros( T*n )
+        add.at( internal_loop_sum, t * n + i, vals )
+        Z_BPq_contribs.append( internal_loop_sum.reshape( T, n ) )
+
+    Z_BPq_diag = self.possible_mask[ :, I, d ] * array_sum( add, Z_BPq_contribs ) / self.Kd_array[:,None]
+    Z_BPq_band[ :, I, d ] = Z_BPq_diag
+
+    ##############################
+    # Z_BP
+    Z_BP_band[ I, d ] = array_sum( add, Z_BPq_diag )
+
+    ##############################
+    # Z_coax
+    if K_coax > 0: update_Z_coax_diagonal( self, d )
+
+    ##############################
+    # C_eff_basic
+    allow_loop_extension = self.allow_extension_array[ J ]
+    contribs = [ lig_jm1 * allow_loop_extension * C_eff_band[ I, d-1 ] * l * scale ]
+
+    # j is base paired or coax-stacked, and its partner is k > i [k = i+a, a = 1 ... d]
+    A = np.arange( 1, d+1 )[:,None]
+    lig_km1 = lig[ I+A-1 ]
+    C_eff_ligated = lig_km1 * C_eff_band[ I, A-1 ]
+    contribs.append( array_sum( add, C_eff_ligated * Z_BP_band[ I+A, d-A ] ) * l * l_BP )
+    if K_coax > 0:
+        contribs.append( array_sum( add, C_eff_ligated * Z_coax_band[ I+A, d-A ] ) * l * l_coax )
+    C_eff_basic_diag = array_sum( add, contribs )
+    C_eff_basic.Q.band[ I, d ] = C_eff_basic_diag
+
+    ##############################
+    # C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff
+    C_eff_no_coax_singlet.Q.band[ I, d ] = add( C_eff_basic_diag, C_init * Z_BP_band[ I, d ] * l_BP )
+    if K_coax > 0.0:
+        C_eff_no_BP_singlet.Q.band[ I, d ] = add( C_eff_basic_diag, C_init * Z_coax_band[ I, d ] * l_coax )
+        C_eff_band[ I, d ] = add( C_eff_no_coax_singlet.Q.band[ I, d ], C_init * Z_coax_band[ I, d ] * l_coax )
+    else:
+        C_eff_band[ I, d ] = C_eff_no_coax_singlet.Q.band[ I, d ]
+
+    ##############################
+    # Z_linear
+    Z_linear_ligated = lig_km1 * Z_linear_band[ I, A-1 ]
+    contribs = [ lig_jm1 * allow_loop_extension * Z_linear_band[ I, d-1 ] * scale, Z_BP_band[ I, d ],
+                 array_sum( add, Z_linear_ligated * Z_BP_band[ I+A, d-A ] ) ]
+    if K_coax > 0.0:
+        contribs += [ Z_coax_band[ I, d ], array_sum( add, Z_linear_ligated * Z_coax_band[ I+A, d-A ] ) ]
+    Z_linear_diag = array_sum( add, contribs )
+    Z_linear_band[ I, d ] = Z_linear_diag
+    Z_linear.Q.first_row[ d ] = Z_linear_diag[ 0 ]
+
+def update_exterior( self, j ):
+    '''
+    Z_linear(0,j) for j beyond the band -- same as update_Z_linear(), with sums over partners k
+     restricted to those that can pair (or coax-stack) with j.
+    '''
+    W = self.max_bp_span
+    lig = self.ligated_array
+    add = self.options.add
+    Z_linear_0 = self.Z_linear.Q.first_row
+
+    contribs = [ lig[j-1] * self.allow_extension_array[j] * Z_linear_0[j-1] * self.scale ]
+
+    K = np.arange( max( 1, j-W ), j+1 )
+    contribs.append( array_sum( add, lig[K-1] * Z_linear_0[K-1] * self.Z_BP.Q.band[ K, j-K ] ) )
+
+    if self.params.K_coax > 0.0:
+        Z_coax = self.Z_coax.Q
+        if j < Z_coax.width: contribs.append( Z_coax.band[ 0, j ] )
+        K = np.arange( max( 1, j-Z_coax.width+1 ), j+1 )
+        contribs.append( array_sum( add, lig[K-1] * Z_linear_0[K-1] * Z_coax.band[ K, j-K ] ) )
+
+    Z_linear_0[ j ] = self.options.sum( contribs )
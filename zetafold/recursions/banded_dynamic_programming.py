@@ -0,0 +1,133 @@
+#
+# Same interface as explicit_dynamic_programming.py, but only elements (i,j) with 0 <= j - i < width are
+#  stored, as an N x width NumPy array 'band' with band[i, j-i] = Q[i][j]. Memory is O(N * width).
+#
+# Used when base pairs are restricted to span max_bp_span (see banded.py); every other element is zero
+#  except Z_coax (a coaxial stack of two pairs can span up to 2*max_bp_span+1) and the first row of
+#  Z_linear (the exterior loop), which is stored in full.
+#
+import numpy as np
+from collections import defaultdict
+from zetafold.recursions.explicit_dynamic_programming import BacktrackRecords
+
+class BandedArray:
+    '''
+    N x N matrix that stores only a band of elements near the diagonal.
+    Q[i][j] reads and writes like a list of lists; elements outside the band read out as 0.0.
+    '''
+    def __init__( self, N, width, full_first_row = False ):
+        self.N = N
+        self.width = width
+        self.band = np.zeros( (N, width) )
+        self.first_row = np.zeros( N ) if full_first_row else None
+
+    def __len__( self ): return self.N
+
+    def __getitem__( self, key ):
+        '''
+        Q[i] gives a row; Q[I, J] gives an ndarray of elements for integer arrays I and J, as for an N x N ndarray.
+        '''
+        if not isinstance( key, tuple ): return BandedRow( self, key )
+        ( I, J, D, in_band ) = self.get_band_indices( key )
+        vals = np.where( in_band, self.band[ I, np.clip( D, 0, self.width - 1 ) ], 0.0 )
+        if self.first_row is not None: vals = np.where( ( I == 0 ) & ( D >= self.width ), self.first_row[ J ], vals )
+        return vals
+
+    def __setitem__( self, key, vals ):
+        '''
+        Q[I, J] = vals -- elements outside the band are dropped, so they must be zero or never read (e.g., outside
+         values of elements that are zero).
+        '''
+        ( I, J, D, in_band ) = self.get_band_indices( key )
+        vals = np.broadcast_to( vals, I.shape )
+        self.band[ I[ in_band ], D[ in_band ] ] = vals[ in_band ]
+        if self.first_row is not None:
+            first_row = ( I == 0 ) & ( D >= 0 )
+            self.first_row[ J[ first_row ] ] = vals[ first_row ]
+
+    def get_band_indices( self, key ):
+        ( I, J ) = np.broadcast_arrays( *key )
+        D = J - I
+        return ( I, J, D, ( D >= 0 ) & ( D < self.width ) )
+
+class BandedRow:
+    def __init__( self, X, i ):
+        self.X = X
+        self.i = i
+
+    def __getitem__( self, j ):
+        X = self.X
+        d = j - self.i
+        if d < 0: return 0.0
+        if d < X.width: return X.band[ self.i, d ]
+        if self.i == 0 and X.first_row is not None: return X.first_row[ d ]
+        return 0.0
+
+    def __setitem__( self, j, val ):
+        X = self.X
+        d = j - self.i
+        if self.i == 0 and X.first_row is not None and d >= 0:
+            X.first_row[ d ] = val
+            if d >= X.width: return
+        if 0 <= d < X.width:
+            X.band[ self.i, d ] = val
+            return
+        assert( val == 0.0 ) # nothing can be stored outside band
+
+class DynamicProgrammingMatrix:
+    '''
+    Dynamic Programming 2-D Matrix, stored as a band of width max_bp_span+1, that automatically:
+      knows how to update values at i,j
+    '''
+    def __init__( self, N, val = 0.0, diag_val = 0.0, DPlist = None, update_func = None, options = None, name = None, max_bp_span = None ):
+        assert( val == 0.0 )
+        assert( max_bp_span != None )
+        self.N = N
+
+        width = max_bp_span + 1
+        if name == 'Z_coax': width = 2 * max_bp_span + 2
+        self.Q = BandedArray( N, min( width, N ), full_first_row = ( name == 'Z_linear' ) )
+        for i in range( N ): self.Q[i][i] = diag_val
+
+        self.backtrack_info = [ defaultdict( BacktrackRecords ) for i in range( N ) ]
+        self.backtrack_info_updated = set()
+
+        if DPlist != None: DPlist.append( self )
+        self.update_func = update_func
+
+        self.name = name
+
+    def val( self, i, j ): return self.Q[i%self.N][j%self.N]
+    def set_val( self, i, j, val ): self.Q[i%self.N][j%self.N] = val
+
+    def update( self, partition, i, j ):
+        self.Q[ i ][ j ] = 0.0
+        if partition.options.calc_backtrack_info: self.backtrack_info[ i ][ j ] = BacktrackRecords()
+        self.update_func( partition, i, j )
+
+    def get_backtrack_info( self, partition, i, j ):
+        if not (i,j) in self.backtrack_info_updated:
+            partition.options.calc_backtrack_info = True
+            self.update( partition, i, j )
+            partition.options.calc_backtrack_info = False
+            self.backtrack_info_updated.add( (i,j) )
+        return self.backtrack_info[i][j]
+
+    def diagonal( self, offset ):
+        '''
+        Elements (i, i+offset) for i = 0 ... N-offset-1
+        '''
+        if offset < self.Q.width: return self.Q.band[ :self.N - offset, offset ]
+        if self.Q.first_row is not None: return self.Q.first_row[ offset:offset+1 ]
+        return np.zeros( 1 )
+
+    def scale_by_offset( self, factor ):
+        '''
+        Multiply each element (i,j) in place by factor[ j - i ]
+        '''
+        factor = np.array( factor )
+        self.Q.band *= factor[ None, :self.Q.width ]
+        if self.Q.first_row is not None: self.Q.first_row *= factor
+
+    def __len__( self ):
+        return self.N
@@ -0,0 +1,44 @@
+##################################################################################################
+# checksum.py = detects hand-written copies of the recursions that have fallen behind recursions.py.
+#
+# explicit_recursions.py, jit_recursions.py, and outside_recursions.py are generated from recursions.py
+#  by create_explicit_recursions.py, but the NumPy kernels in
+#
+#     vectorized_recursions.py, wavefront.py, banded.py, and the vectorized pass in outside.py
+#
+#  rewrite the same recursions by hand. Each of those files holds RECURSIONS_CHECKSUM, the checksum of
+#  recursions.py it was last checked against. create_explicit_recursions.py and tests_zetafold.py fail if
+#  any of these is out of date -- after making the same change in each copy, paste in the new checksum.
+#
+# Imported both from the zetafold package and by create_explicit_recursions.py (run in this directory),
+#  so this module only uses the standard library.
+##################################################################################################
+import os
+import re
+import tokenize
+from hashlib import md5
+
+hand_written_copies = [ 'vectorized_recursions.py', 'wavefront.py', 'banded.py', 'outside.py' ]
+
+def get_recursions_checksum( filename = None ):
+    '''
+    md5 of the tokens of recursions.py, so that comments, blank lines, and spacing can change freely.
+    '''
+    if filename == None: filename = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'recursions.py' )
+    with open( filename ) as f:
+        tokens = [ token[1] for token in tokenize.generate_tokens( f.readline )
+                   if token[0] not in ( tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE ) ]
+    return md5( ' '.join( tokens ).encode( 'utf-8' ) ).hexdigest()
+
+def get_stale_copies( directory = None ):
+    '''
+    Hand-written copies whose RECURSIONS_CHECKSUM does not match the current recursions.py.
+    '''
+    if directory == None: directory = os.path.dirname( os.path.abspath( __file__ ) )
+    checksum = get_recursions_checksum( os.path.join( directory, 'recursions.py' ) )
+    stale = []
+    for filename in hand_written_copies:
+        with open( os.path.join( directory, filename ) ) as f:
+            match = re.search( r"^RECURSIONS_CHECKSUM = '(\w*)'", f.read(), re.MULTILINE )
+        if match == None or match.group( 1 ) != checksum: stale.append( filename )
+    return stale
@@ -1,7 +1,15 @@
 #!/usr/bin/python
 '''
 This is a pretty awful 'compiler' script to convert recursions.py to explicit_recursions.py
+ (and jit_recursions.py, outside_recursions.py). Run in this directory.
+
+Fails at the end if a hand-written copy of the recursions (see checksum.py) has not been updated
+ to match recursions.py.
 '''
+import re
+import ast
+import sys
+from checksum import get_recursions_checksum, get_stale_copies
 
 # a bunch of unfortunate edge cases!
 not_data_objects = ['self.Z_BPq','sequence','self.params.C_eff_stack', 'motif_type.strands',
@@ -53,7 +61,7 @@ for n,line in enumerate(lines):
             lines_new.append( ' '*4 + 'contribs = [] # AUTOGENERATED SUM_AT_END BLOCK\n\n' )
             if len(lines_comment_block) == 0: lines_new.append( lines_sum_at_end[0] )
             lines_new += lines_sum_at_end[1:]
-            lines_new.append( ' '*4 + Z +' = sum( contribs )\n' )
+            lines_new.append( ' '*4 + Z +' = self.options.sum( contribs ) # sum, or max, see semiring_util.py\n' )
             lines_new += '\n'
             lines_sum_at_end    = []
             lines_comment_block = []
@@ -169,7 +177,8 @@ for n,line in enumerate(lines):
     if assign_pos > -1:
         Qpos = find_substring( '.Q', line_new )
         if len( Qpos ) > 0 and Qpos[0] < assign_pos:
-            assert( len( Qpos ) > 1 )
+            # note: contributions with no dynamic programming objects (e.g., hairpin motifs) get backtrack_info
+            #  with empty list of subfragments
 
             Z = line_new[:assign_pos].split()[-1]  # needed to know where to put sum(contribs) at end of code block
             line_sum_at_end = ''
@@ -181,28 +190,420 @@ for n,line in enumerate(lines):
             lines_sum_at_end.append( line_sum_at_end)
 
 
+            # each subfragment (Z,i,j) is packed into an integer code -- see BacktrackRecords in explicit_dynamic_programming.py
             line_backtrack_info = ' '*num_indent
             line_backtrack_info += ' '*4
             line_backtrack_info += 'if %s > 0:\n' % line_new[assign_pos+3:-1]
             line_backtrack_info += ' '*8
             line_backtrack_info += line_new[:Qpos[0]] +  '.backtrack_info'  # extra indent
-            line_backtrack_info += line_new[Qpos[0]+2 : assign_pos+3]
-            line_backtrack_info +=' [ ('
-            line_backtrack_info += line_new[assign_pos+3:-1] + ', ['
+            line_backtrack_info += line_new[Qpos[0]+2 : assign_pos].rstrip()
+            line_backtrack_info += '.add( '
+            line_backtrack_info += line_new[assign_pos+3:-1]
             for (n,info) in enumerate(all_args):
                 if info[ 0 ] <= assign_pos: continue
-                line_backtrack_info += '(%s,' % info[1]
-                if len(info[2])> 1:  line_backtrack_info += '(%s)%%N' % info[2]
-                else: line_backtrack_info += '%s%%N' % info[2]
-                line_backtrack_info+=','
+                line_backtrack_info += ', %s.backtrack_code + ' % info[1]
+                if len(info[2])> 1:  line_backtrack_info += '((%s)%%N)*N + ' % info[2]
+                else: line_backtrack_info += '(%s%%N)*N + ' % info[2]
                 if len(info[3])>1:   line_backtrack_info += '(%s)%%N' % info[3]
                 else: line_backtrack_info += '%s%%N' % info[3]
-                line_backtrack_info+=')'
-                if n < len( all_args )-1: line_backtrack_info += ', '
-            line_backtrack_info += '] ) ]\n'
+            line_backtrack_info += ' )\n'
             lines_backtrack_info.append( line_backtrack_info )
 
 
+##################################################################################################
+# Fused kernels: the sum-at-end parts (no backtrack_info) of the update functions for the 2-D matrices,
+#  inlined in the order of Z_all, for every (i,j) on a diagonal in one call -- with one unpack_variables(),
+#  no per-matrix update() dispatch or lambdas, and each element added up in a local scalar (X_ij)
+#  instead of a list of contribs. One kernel for each way of adding contributions up (see semiring_util.py).
+fused_update_order = ['update_Z_cut','update_Z_BP','update_Z_coax','update_C_eff_basic','update_C_eff_no_BP_singlet',
+                      'update_C_eff_no_coax_singlet','update_C_eff','update_Z_linear']
+# calls to other update functions that get inlined (with their own accumulators)
+fused_inline_updates = { 'Z_BPq': 'update_Z_BPq' }
+# statements that accumulate a contribution into X_ij
+fused_accumulate = { 'update_diagonal':     [ '%(X)s += %(term)s' ],
+                     'update_diagonal_max': [ 'contrib = %(term)s', 'if contrib > %(X)s: %(X)s = contrib' ] } # contributions are >= 0
+# looked up once per diagonal, not for every element
+fused_hoisted = [ ( 'self.scale', 'scale' ), ( 'self.N', 'N' ), ( 'self.in_forced_base_pair', 'in_forced_base_pair' ),
+                  ( 'self.params.C_eff_stack', 'C_eff_stack' ) ]
+# row i of these matrices is looked up once per element, as X_i
+fused_rows = [ 'Z_cut', 'Z_BP', 'Z_coax', 'C_eff_basic', 'C_eff_no_BP_singlet', 'C_eff_no_coax_singlet', 'C_eff', 'Z_linear' ]
+
+def get_function_bodies( lines ):
+    bodies = {}
+    name = None
+    for line in lines:
+        if line.startswith( 'def ' ):
+            name = line[4:line.index('(')].strip()
+            bodies[ name ] = []
+        elif name != None and line.startswith( ' ' ):
+            bodies[ name ].append( line )
+    return bodies
+
+def get_forward_lines( body ):
+    forward_lines = []
+    in_docstring = False
+    for line in body:
+        stripped = line.strip()
+        if stripped.startswith( "'''" ):
+            in_docstring = not in_docstring
+            continue
+        if in_docstring or len( stripped ) == 0 or stripped[0] == '#': continue
+        if stripped.startswith( 'if self.options.calc_backtrack_info' ): break
+        if stripped.startswith( '(C_init,' ) or stripped.count( 'unpack_variables( self )' ): continue
+        forward_lines.append( line )
+    return forward_lines
+
+def expand_val( line ):
+    # Z.val(a,b) --> Z.Q[a%N][b%N], as generated for Z[a][b] above
+    def index( arg ):
+        arg = arg.strip()
+        return '[%s%%N]' % arg if len( arg ) == 1 else '[(%s)%%N]' % arg
+    return re.sub( r'\.val\(([^,()]+),([^,()]+)\)', lambda m: '.Q' + index( m.group(1) ) + index( m.group(2) ), line )
+
+def get_fused_lines( name, accumulate, indent = 0 ):
+    '''
+    Lines of update function name for element (i,j), with contributions added up in local scalar X_ij
+     (X = matrix updated by name) by accumulate, e.g. [ '%(X)s += %(term)s' ].
+    '''
+    X = name.replace( 'update_', '' )
+    fused_lines = []
+    extra_indent = 0
+    for line in get_forward_lines( function_bodies[ name ] ):
+        num_indent = len( line ) - len( line.lstrip() )
+        stripped = line.strip()
+        if stripped == 'contribs = [] # AUTOGENERATED SUM_AT_END BLOCK':
+            fused_lines.append( ' '*(indent+num_indent) + '%s_ij = 0.0\n' % X )
+            continue
+        inline_call = re.match( r'(\w+)\.update\( self, i, j \)$', stripped )
+        if inline_call:
+            fused_lines += get_fused_lines( fused_inline_updates[ inline_call.group(1) ], accumulate, indent + extra_indent + num_indent - 4 )
+            continue
+        early_return = re.match( r'if (.*): return$', stripped )
+        if early_return:
+            # early return leaves this matrix at zero, but rest of the fused kernel still needs to run.
+            assert( num_indent == 4 and extra_indent == 0 )
+            fused_lines.append( ' '*(indent+num_indent) + 'if not ( %s ):\n' % early_return.group(1) )
+            extra_indent = 4
+            continue
+        assert( not stripped.startswith( 'return' ) ) # cannot be fused
+        sum_at_end = re.match( r'(\w+)\.Q\[i%N\]\[j%N\] = self\.options\.sum\( contribs \)', stripped )
+        if sum_at_end:
+            extra_indent = 0
+            if sum_at_end.group(1) in fused_inline_updates:
+                # sparse matrices only store candidate elements -- set_val() finds where.
+                line = ' '*num_indent + '%s.set_val( i, j, %s_ij )\n' % ( sum_at_end.group(1), X )
+            else:
+                line = ' '*num_indent + '%s.Q[i][j] = %s_ij\n' % ( sum_at_end.group(1), X )
+        elif stripped.count( 'contribs.append(' ):
+            start = line.index( 'contribs.append(' )
+            term = line[ start + len( 'contribs.append(' ) : line.rindex( ')' ) ].strip()
+            statements = [ statement % { 'X': X + '_ij', 'term': term } for statement in accumulate ]
+            if len( line[ :start ].strip() ) > 0:
+                # e.g., if ligated[k%N]: contribs.append( ... )
+                if len( statements ) == 1:
+                    line = line[ :start ] + statements[0] + '\n'
+                else:
+                    line = line[ :start ].rstrip() + '\n' + ''.join( ' '*(num_indent+4) + statement + '\n' for statement in statements )
+            else:
+                line = ''.join( ' '*num_indent + statement + '\n' for statement in statements )
+        fused_lines += [ ' '*(indent+extra_indent) + expand_val( line ) for line in line.splitlines( True ) ]
+    return fused_lines
+
+def get_fused_body_lines( accumulate ):
+    '''
+    Lines inside the loop over i of a fused kernel, and the matrices X whose row i is looked up as X_i.
+    '''
+    body = []
+    for name in fused_update_order:
+        body += [ '\n', '    # %s\n' % name.replace( 'update_', '' ) ]
+        body += get_fused_lines( name, accumulate )
+    filled = set()
+    for (n,line) in enumerate( body ):
+        line = line.replace( '[i%N]', '[i]' ).replace( '[j%N]', '[j]' )
+        for ( attribute, local ) in fused_hoisted: line = line.replace( attribute, local )
+        # elements already filled for this (i,j) are in local scalars.
+        for X in filled: line = line.replace( '%s.Q[i][j]' % X, '%s_ij' % X )
+        assigned = re.match( r'\s*(\w+)(\.Q\[i\]\[j\] = |\.set_val\( i, j, )', line )
+        if assigned: filled.add( assigned.group(1) )
+        # offset and scale are set once, below.
+        if re.match( r'\s*(offset = \( j - i \) % N|scale2? += scale(\*\*2)?)( #.*)?$', line ): line = ''
+        for X in fused_rows: line = line.replace( '%s.Q[i][' % X, '%s_i[' % X )
+        body[ n ] = '    ' + line if line.strip() else line
+    rows = [ X for X in fused_rows if ''.join( body ).count( '%s_i[' % X ) ]
+    return ( body, rows )
+
+def get_fused_kernel_lines( kernel_name, accumulate ):
+    ( body, rows ) = get_fused_body_lines( accumulate )
+    return [ 'def %s( self, offset, num_cells ):\n' % kernel_name,
+             "    '''\n",
+             '    Fused kernel -- updates all 2-D matrices at (i,j) = (i, (i+offset)%N) for i = 0 ... num_cells-1, in order:\n',
+             '      %s\n' % ', '.join( [ name.replace( 'update_', '' ) for name in fused_update_order ] ),
+             '    Generated from the update functions above, adding up contributions as: %s.\n' % '; '.join( statement % { 'X': 'X_ij', 'term': '(term)' } for statement in accumulate ),
+             '    Does not fill backtrack_info.\n',
+             "    '''\n",
+             '    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \\\n',
+             '     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )\n' ] + \
+           [ '    %s = %s\n' % ( local, attribute ) for ( attribute, local ) in fused_hoisted if local != 'N' ] + \
+           [ '    scale2 = scale**2\n',
+             '    for i in range( num_cells ):\n',
+             '        j = ( i + offset ) % N\n',
+             '        ( %s ) = ( %s )\n' % ( ', '.join( [ X + '_i' for X in rows ] ), ', '.join( [ X + '.Q[i]' for X in rows ] ) ) ] + body + [ '\n' ]
+
+function_bodies = get_function_bodies( ''.join( lines_new ).splitlines( True ) )
+lines_fused  = [ '#' * 98 + '\n' ]
+lines_fused += [ 'fused_update_order = %s\n\n' % fused_update_order ]
+for kernel_name in sorted( fused_accumulate ): lines_fused += get_fused_kernel_lines( kernel_name, fused_accumulate[ kernel_name ] )
+lines_new += lines_fused
+
 with open('explicit_recursions.py','w') as f:
     f.writelines( lines_new )
 
+
+##################################################################################################
+# jit kernel: update_diagonal (the fused kernel above, for sum), rewritten for numba's nopython mode, which
+#  only takes arrays and numbers. Written to jit_recursions.py, and compiled by jit.py. Base pair types become
+#  integers t, with Z_BPq for all of them in one T x N x N array, and the motifs closed by base pair type t at (i,j)
+#  are motif = motif_start[t*N+i] ... motif_start[t*N+i+1]-1 in the motif_* arrays for the diagonal.
+jit_arguments = [ 'offset', 'num_cells', 'N', 'scale', 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax', 'C_std', 'allow_strained_3WJ',
+                  'ligated', 'in_forced_base_pair' ] + fused_rows + \
+                [ 'Z_BPq', 'possible_mask', 'Kd', 'C_eff_stack', 'motif_start', 'motif_C_eff', 'motif_t_next', 'motif_i_next', 'motif_j_next' ]
+jit_replacements = [ ( r'(\w+)\.Kd\b', r'Kd[\1]' ),
+                     ( r'motif_type\.C_eff', 'motif_C_eff[motif]' ),
+                     ( r'len\(motif_type\.strands\) == 1', 'motif_t_next[motif] < 0' ), # hairpins have no next base pair
+                     ( r'len\(motif_type\.strands\) == 2', 'motif_t_next[motif] >= 0' ),
+                     ( r'C_eff_stack\[(\w+)\]\[(\w+)\]', r'C_eff_stack[\1,\2]' ),
+                     ( r'\( not in_forced_base_pair \) or |in_forced_base_pair and ', '' ), # array, all False if no forced base pairs
+                     ( r'\.Q\[([^\[\]]+)\]\[([^\[\]]+)\]', r'[\1,\2]' ),
+                     ( r'\.Q\[i\]', '[i]' ) ]
+
+def get_jit_body_lines( body ):
+    jit_body = []
+    Z_BPq_index = {} # Z_BPq for a base pair type --> that base pair type, e.g., Z_BPq_next --> base_pair_type_next
+    dedent = None
+    for line in body:
+        num_indent = len( line ) - len( line.lstrip() )
+        stripped = line.strip()
+        if dedent != None and len( stripped ) > 0:
+            if num_indent > dedent: ( line, num_indent ) = ( line[ 4: ], num_indent - 4 )
+            else: dedent = None
+        indent = ' ' * num_indent
+        Z_BPq_lookup = re.match( r'(\w+) = self\.Z_BPq\[\s*(\w+)\s*\]$', stripped )
+        if Z_BPq_lookup:
+            Z_BPq_index[ Z_BPq_lookup.group(1) ] = Z_BPq_lookup.group(2)
+            continue
+        Z_BPq_lookup = re.match( r'\((\w+), (\w+)\)\s*= \( self\.Z_BPq\[ (\w+) \], (.*) \)$', stripped )
+        if Z_BPq_lookup:
+            Z_BPq_index[ Z_BPq_lookup.group(1) ] = Z_BPq_lookup.group(3)
+            line = indent + '%s = %s\n' % ( Z_BPq_lookup.group(2), Z_BPq_lookup.group(4) )
+        if stripped.startswith( 'match_base_pair_type_set = ' ): continue
+        if stripped.startswith( 'possible_motif_types = ' ):
+            assert( stripped == 'possible_motif_types = self.possible_motif_types[i][j]' ) # motif_start is for this diagonal
+            continue
+        loop = re.match( r'for (\w+) in self\.possible_base_pair_types\[([^\[\]]+)\]\[([^\[\]]+)\]:$', stripped )
+        if loop:
+            line = indent + 'for %s in range( T ):\n' % loop.group(1) + \
+                   indent + '    if not possible_mask[%s,%s,%s]: continue\n' % loop.groups()
+        loop = re.match( r'for motif_type in possible_motif_types\[(\w+)\]:$', stripped )
+        if loop:
+            line = indent + 'for motif in range( motif_start[%s*N+i], motif_start[%s*N+i+1] ):\n' % ( loop.group(1), loop.group(1) )
+        loop = re.match( r'for \((\w+), (\w+), (\w+)\) in match_base_pair_type_set:$', stripped )
+        if loop:
+            # one next base pair for each motif in the motif_* arrays.
+            line = indent + '( %s, %s, %s ) = ( motif_t_next[motif], motif_i_next[motif], motif_j_next[motif] )\n' % loop.groups()
+            dedent = num_indent
+        for ( Z_BPq, t ) in Z_BPq_index.items():
+            line = re.sub( r'\b%s\.Q\[([^\[\]]+)\]\[([^\[\]]+)\]' % Z_BPq, r'Z_BPq[%s,\1,\2]' % t, line )
+            line = re.sub( r'\b%s\.set_val\( i, j, (\w+) \)' % Z_BPq, r'Z_BPq[%s,i,j] = \1' % t, line )
+        for ( pattern, replacement ) in jit_replacements: line = re.sub( pattern, replacement, line )
+        assert( not re.search( r'self\.|motif_type|\.Q\b|\.set_val', line ) ) # only arrays and numbers
+        jit_body.append( line )
+    return jit_body
+
+def get_jit_kernel_lines():
+    ( body, rows ) = get_fused_body_lines( fused_accumulate[ 'update_diagonal' ] )
+    arguments = [ '' ]
+    for argument in jit_arguments:
+        if len( arguments[-1] ) + len( argument ) > 100: arguments.append( '' )
+        arguments[-1] += argument + ', '
+    return [ 'def update_diagonal_jit( %s ):\n' % ( '\n' + ' '*24 ).join( [ a.rstrip() for a in arguments ] ).rstrip( ',' ),
+             "    '''\n",
+             '    update_diagonal() of explicit_recursions.py, with matrices as N x N arrays and Z_BPq as a T x N x N array.\n',
+             '    Motifs closed by base pair type t at (i, (i+offset)%N) are motif = motif_start[t*N+i] ... motif_start[t*N+i+1]-1.\n',
+             "    '''\n",
+             '    T = Z_BPq.shape[0]\n',
+             '    scale2 = scale**2\n',
+             '    for i in range( num_cells ):\n',
+             '        j = ( i + offset ) % N\n',
+             '        ( %s ) = ( %s )\n' % ( ', '.join( [ X + '_i' for X in rows ] ), ', '.join( [ X + '[i]' for X in rows ] ) ) ] + \
+           get_jit_body_lines( body ) + [ '\n' ]
+
+lines_jit  = [ '#' * 98 + '\n',
+               '# jit_recursions.py = generated by create_explicit_recursions.py from recursions.py.\n',
+               '#\n',
+               '# update_diagonal_jit() is the fused kernel update_diagonal() of explicit_recursions.py, rewritten to only\n',
+               '#  take arrays and numbers, so that numba can compile it -- see jit.py.\n',
+               '#' * 98 + '\n' ]
+lines_jit += get_jit_kernel_lines()
+
+with open('jit_recursions.py','w') as f:
+    f.writelines( lines_jit )
+
+
+
+##################################################################################################
+# Outside (adjoint) pass: for each update function, a version that runs the same loops and, for each term
+#
+#     Z[i][j] += (product of dynamic programming elements X[a][b] and parameters),
+#
+#  passes the outside value of Z(i,j) back to each element in the term, and adds up (outside value) x (term),
+#  times the power of each parameter in the term, to get d(log Z)/d(log parameter). Written to outside_recursions.py,
+#  and run with matrices replaced by OutsideMatrix objects (see outside.py).
+outside_parameters = [ 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax', 'C_std' ] # counted by name
+# parameters that belong to an object, counted under that object -- Kdq is base_pair_type.Kd, see update_Z_BPq
+outside_parameter_objects = { 'Kdq': 'base_pair_type', 'motif_type.C_eff': 'motif_type', 'self.params.C_eff_stack': '(%s,%s)' }
+
+def get_dotted_name( node ):
+    if isinstance( node, ast.Name ): return node.id
+    if isinstance( node, ast.Attribute ):
+        name = get_dotted_name( node.value )
+        if name != None: return name + '.' + node.attr
+    return None
+
+def get_parameter_powers( node ):
+    '''
+    Powers of each parameter in a term (a product), as { key in self.counts : power }
+    '''
+    if isinstance( node, ast.BinOp ):
+        ( left, right ) = ( get_parameter_powers( node.left ), get_parameter_powers( node.right ) )
+        if isinstance( node.op, ast.Pow ):
+            if len( left ) == 0: return {} # e.g., scale**(offset+1)
+            assert( isinstance( node.right, ast.Num ) )
+            return dict( (key, power * node.right.n) for (key,power) in left.items() )
+        assert( isinstance( node.op, (ast.Mult, ast.Div) ) or ( len( left ) == 0 and len( right ) == 0 ) ) # terms must be products
+        sign = -1 if isinstance( node.op, ast.Div ) else 1
+        for (key,power) in right.items(): left[ key ] = left.get( key, 0 ) + sign * power
+        return dict( (key,power) for (key,power) in left.items() if power != 0 )
+    if isinstance( node, ast.Subscript ) and isinstance( node.value, ast.Subscript ):
+        name = get_dotted_name( node.value.value )
+        if name in outside_parameter_objects:
+            return { outside_parameter_objects[ name ] % ( get_dotted_name( node.value.slice.value ), get_dotted_name( node.slice.value ) ) : 1 }
+        return {} # dynamic programming element
+    name = get_dotted_name( node )
+    if name in outside_parameters: return { "'%s'" % name : 1 }
+    if name in outside_parameter_objects: return { outside_parameter_objects[ name ] : 1 }
+    return {}
+
+def outside_index( arg ):
+    arg = arg.strip()
+    return '[%s%%N]' % arg if len( arg ) == 1 else '[(%s)%%N]' % arg
+
+element_regex = re.compile( r'(?<![\w.])([A-Za-z_]\w*)\[([^\[\]]+)\]\[([^\[\]]+)\]' )
+# other arrays indexed by position get i%N, as in explicit_recursions.py (e.g., self.possible_base_pair_types[j+1][i-1])
+data_regex    = re.compile( r'(?<![\w.])(%s)((?:\[[^\[\]]+\])+)' % '|'.join( re.escape( name ) for name in not_2D_dynamic_programming_objects if not name in not_data_objects ) )
+term_regex    = re.compile( r'^(?:(if .*?):\s*)?([A-Za-z_]\w*)((?:\[[^\]]+\])+)(?:\.Q)?\s*\+=\s*(.*?)\s*$' )
+
+def get_outside_term_lines( target, target_indices, expression, indent ):
+    '''
+    Outside lines for target[ target_indices ] += expression
+    '''
+    is_element = lambda m: not m.group(1) in not_2D_dynamic_programming_objects + not_data_objects
+    elements = [ ( m.group(1), outside_index( m.group(2) ) + outside_index( m.group(3) ) ) for m in element_regex.finditer( expression ) if is_element( m ) ]
+    expression_Q = element_regex.sub( lambda m: m.group(1) + '.Q' + outside_index( m.group(2) ) + outside_index( m.group(3) ) if is_element( m ) else m.group(0), expression )
+    powers = get_parameter_powers( ast.parse( expression, mode = 'eval' ).body )
+    if len( elements ) == 0 and len( powers ) == 0: return [] # nothing to pass back or count
+    target_bar = target + '.bar' + ''.join( outside_index( index ) for index in target_indices )
+    outside_lines = [ ' '*indent + 'count = %s * %s\n' % ( target_bar, expression_Q ),
+                      ' '*indent + 'if count > 0.0:\n' ]
+    for ( Z, element ) in elements:
+        outside_lines.append( ' '*(indent+4) + '%s.bar%s += count / %s.Q%s\n' % ( Z, element, Z, element ) )
+    for (key,power) in sorted( powers.items() ):
+        if power == 1:    outside_lines.append( ' '*(indent+4) + 'self.counts[ %s ] += count\n' % key )
+        elif power == -1: outside_lines.append( ' '*(indent+4) + 'self.counts[ %s ] -= count\n' % key )
+        else:             outside_lines.append( ' '*(indent+4) + 'self.counts[ %s ] += %s * count\n' % ( key, power ) )
+    return outside_lines
+
+def get_outside_function_lines( body ):
+    '''
+    Outside version of an update function, from its lines in recursions.py (without the def line).
+    Calls to Z.update( self, i, j ) (e.g., Z_BPq in update_Z_BP) go after the terms that use Z(i,j) in the
+     same block, so that the outside value of Z(i,j) is complete when Z.update() passes it on.
+    '''
+    term_matches = [ term_regex.match( line.strip() ) for line in body if not line.strip().startswith( '#' ) ]
+    ( target, target_indices ) = [ ( m.group(2), re.findall( r'\[([^\]]+)\]', m.group(3) ) ) for m in term_matches if m ][0]
+    target_bar = target + '.bar' + ''.join( outside_index( index ) for index in target_indices )
+    # all terms are multiplied by outside value of target -- return early if zero, unless other matrices get updated.
+    skip_if_zero_done = any( line.count( '.update(' ) for line in body )
+    outside_lines = []
+    pending_updates = []
+    in_docstring = False
+    statement = ''
+    for line in body:
+        stripped = line.strip()
+        if stripped.startswith( "'''" ):
+            if stripped.count( "'''" ) == 1: in_docstring = not in_docstring
+            continue
+        if in_docstring: continue
+        if len( stripped ) == 0 and len( outside_lines ) == 0: continue
+        if stripped[:1] != '#':
+            line = data_regex.sub( lambda m: m.group(1) + ''.join( outside_index( index ) for index in re.findall( r'\[([^\]]+)\]', m.group(2) ) ), line )
+            stripped = line.strip()
+        num_indent = len( line ) - len( line.lstrip() )
+        if len( stripped ) > 0 and stripped[0] != '#':
+            while len( pending_updates ) > 0 and num_indent < pending_updates[-1][0]: outside_lines.append( pending_updates.pop()[1] )
+        if stripped.count( '.update(' ):
+            pending_updates.append( ( num_indent, line ) )
+            continue
+        m = term_regex.match( stripped )
+        if m:
+            term_lines = get_outside_term_lines( m.group(2), re.findall( r'\[([^\]]+)\]', m.group(3) ), m.group(4), num_indent + ( 4 if m.group(1) else 0 ) )
+            if m.group(1) and len( term_lines ) > 0: outside_lines.append( ' '*num_indent + m.group(1) + ':\n' )
+            outside_lines += term_lines
+            continue
+        outside_lines.append( line )
+        if not skip_if_zero_done and len( stripped ) > 0:
+            # check right after target is defined at top level of function, e.g., by unpack_variables()
+            statement = ( statement + stripped ) if ( statement or num_indent == 4 ) else ''
+            if statement.endswith( '\\' ): continue
+            if statement.count( ' = ' ) and re.search( r'\b%s\b' % target, statement.split( ' = ' )[0] ):
+                outside_lines.append( ' '*4 + 'if %s == 0.0: return\n' % target_bar )
+                skip_if_zero_done = True
+            statement = ''
+    while len( pending_updates ) > 0: outside_lines.append( pending_updates.pop()[1] )
+    return outside_lines
+
+raw_function_bodies = {}
+name = None
+for line in lines:
+    if line.startswith( 'def ' ):
+        name = line[4:line.index('(')].strip()
+        raw_function_bodies[ name ] = []
+    elif name != None and ( line.startswith( ' ' ) or len( line.strip() ) == 0 ):
+        raw_function_bodies[ name ].append( line )
+    else:
+        name = None
+
+lines_outside  = [ '#' * 98 + '\n',
+                   '# outside_recursions.py = generated by create_explicit_recursions.py from recursions.py.\n',
+                   '#\n',
+                   '# update_X_outside( self, i, j ) runs the loops of update_X, and passes the outside value X.bar(i,j) back\n',
+                   '#  to the elements in each term of X(i,j), adding up d(log Z)/d(log parameter) in self.counts.\n',
+                   '#  self is an OutsidePartition, with matrices that hold inside values Q and outside values bar -- see outside.py.\n',
+                   '#' * 98 + '\n' ]
+for line in lines:
+    if not line.startswith( 'def ' ): continue
+    name = line[4:line.index('(')].strip()
+    if not name.startswith( 'update_' ): continue
+    lines_outside += [ line.replace( name + '(', name + '_outside(' ) ]
+    lines_outside += get_outside_function_lines( raw_function_bodies[ name ] )
+    lines_outside += [ '#' * 98 + '\n' ]
+lines_outside += [ 'def unpack_variables( self ):\n' ] + raw_function_bodies[ 'unpack_variables' ]
+
+with open('outside_recursions.py','w') as f:
+    f.writelines( lines_outside )
+
+stale_copies = get_stale_copies( '.' )
+if stale_copies:
+    print 'ERROR! recursions.py has changed, but these hand-written copies have not been updated to match:'
+    for filename in stale_copies: print '  ', filename
+    print 'Make the same change in each, then set RECURSIONS_CHECKSUM =', repr( get_recursions_checksum( 'recursions.py' ) )
+    sys.exit( 1 )
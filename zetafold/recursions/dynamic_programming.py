@@ -1,4 +1,5 @@
 from zetafold.util.wrapped_array import WrappedArray
+from zetafold.recursions.explicit_dynamic_programming import BacktrackRecords
 
 class DynamicProgrammingMatrix:
     '''
@@ -20,8 +21,7 @@ class DynamicProgrammingMatrix:
         self.options = options
         self.update_func = update_func
 
-        self.backtrack_info_updated = [None]*N
-        for i in range( N ): self.backtrack_info_updated[i] = [False]*N
+        self.backtrack_records = {} # (i,j) -> BacktrackRecords, filled by get_backtrack_info()
         self.name = name
 
     def __getitem__( self, idx ):
@@ -37,12 +37,12 @@ class DynamicProgrammingMatrix:
         self.update_func( partition, i, j )
 
     def get_backtrack_info( self, partition, i, j ):
-        if not self.backtrack_info_updated[i][j]:
+        if not (i,j) in self.backtrack_records:
             partition.options.calc_backtrack_info = True
             self.update( partition, i, j )
             partition.options.calc_backtrack_info = False
-            self.backtrack_info_updated[i][j] = True
-        return self.data[i][j].backtrack_info
+            self.backtrack_records[ (i,j) ] = get_backtrack_records( self.data[i][j].backtrack_info )
+        return self.backtrack_records[ (i,j) ]
 
 class DynamicProgrammingList:
     '''
@@ -58,7 +58,7 @@ class DynamicProgrammingList:
             self.data[i] = DynamicProgrammingData( val, options = options )
         self.options = options
         self.update_func = update_func
-        self.backtrack_info_updated = [False]*N
+        self.backtrack_records = {} # i -> BacktrackRecords, filled by get_backtrack_info()
         self.name = name
 
     def __getitem__( self, idx ):
@@ -72,17 +72,27 @@ class DynamicProgrammingList:
     def val( self, i ): return self.data[i].Q
 
     def get_backtrack_info( self, partition, i ):
-        if not self.backtrack_info_updated[i]:
+        if not i in self.backtrack_records:
             partition.options.calc_backtrack_info = True
             self.update( partition, i )
             partition.options.calc_backtrack_info = False
-            self.backtrack_info_updated[i] = True
-        return self.data[i].backtrack_info
+            self.backtrack_records[ i ] = get_backtrack_records( self.data[i].backtrack_info )
+        return self.backtrack_records[ i ]
 
     def update( self, partition, i ):
         self.data[ i ].zero()
         self.update_func( partition, i )
 
+def get_backtrack_records( backtrack_info ):
+    '''
+    Convert contributions [ Q, [ (Z,i,j), ... ] ] accumulated by DynamicProgrammingData into the compact
+     BacktrackRecords used by explicit_recursions.py and backtrack.py
+    '''
+    backtrack_records = BacktrackRecords()
+    for ( Q, info ) in backtrack_info:
+        backtrack_records.add( Q, *[ Z.backtrack_code + (i%Z.N)*Z.N + j%Z.N for (Z,i,j) in info ] )
+    return backtrack_records
+
 class DynamicProgrammingData:
     '''
     Dynamic programming object, with derivs and contribution accumulation.
@@ -102,10 +112,14 @@ class DynamicProgrammingData:
         self.backtrack_info = []
 
     def __iadd__(self, other):
+        if not isinstance( other, DynamicProgrammingData ): # contribution with no subfragments, e.g. hairpin motif
+            if other == 0.0: return self
+            other = DynamicProgrammingData( other )
+            other.info = [ None ]
         if other.Q == 0.0: return self
-        self.Q  += other.Q
+        self.Q  = self.options.sum( [ self.Q, other.Q ] ) if self.options else self.Q + other.Q # sum, or max -- see semiring_util.py
         if self.options and self.options.calc_backtrack_info:
-            if len( other.info ) > 0: self.backtrack_info.append( [other.Q, other.info] )
+            if len( other.info ) > 0: self.backtrack_info.append( [other.Q, [ info for info in other.info if info != None ] ] )
         return self
 
     def __mul__(self, other):
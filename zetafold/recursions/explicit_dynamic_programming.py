@@ -2,6 +2,39 @@
 # Much simpler (less intelligent) object for dynamic programming than in dynamic_programming.py --
 #  forces code to explicitly figure out updates to values, derivatives, and contributions
 #
+# backtrack_info is only stored for elements where get_backtrack_info() has been called --
+#  filling the matrices for Z alone allocates nothing for backtracking.
+#
+from collections import defaultdict
+from array import array
+
+class BacktrackRecords:
+    '''
+    Contributions to one dynamic programming element, for backtracking, in parallel arrays:
+      weights[n]                     = value of contribution n
+      codes[ starts[n]:starts[n+1] ] = subfragments of contribution n, each packed into one integer,
+                                        Z.backtrack_code + i*N + j for element (i,j) of matrix Z.
+    Matrices are numbered in partition.Z_backtrack, which also gives the base pair type of each
+     matrix -- see decode_backtrack_code() in backtrack.py.
+    Indexing gives ( weight, codes ) for each contribution.
+    '''
+    __slots__ = ( 'weights', 'codes', 'starts' )
+    def __init__( self ):
+        self.weights = array( 'd' )
+        self.codes   = array( 'l' )
+        self.starts  = array( 'l', [0] )
+
+    def add( self, weight, *codes ):
+        self.weights.append( weight )
+        self.codes.extend( codes )
+        self.starts.append( len( self.codes ) )
+
+    def __len__( self ): return len( self.weights )
+
+    def __getitem__( self, n ):
+        if n < 0: n += len( self.weights )
+        return ( self.weights[n], self.codes[ self.starts[n] : self.starts[n+1] ] )
+
 class DynamicProgrammingMatrix:
     '''
     Dynamic Programming 2-D Matrix that automatically:
@@ -14,13 +47,8 @@ class DynamicProgrammingMatrix:
         for i in range( N ): self.Q[i] = [val]*N
         for i in range( N ): self.Q[i][i] = diag_val
 
-        self.backtrack_info = [None]*N
-        for i in range( N ):
-            self.backtrack_info[i] = []
-            for j in range( N ): self.backtrack_info[i].append( [] )
-
-        self.backtrack_info_updated = [None]*N
-        for i in range( N ): self.backtrack_info_updated[i] = [False]*N
+        self.backtrack_info = [ defaultdict( BacktrackRecords ) for i in range( N ) ]
+        self.backtrack_info_updated = set()
 
         if DPlist != None: DPlist.append( self )
         self.update_func = update_func
@@ -32,15 +60,15 @@ class DynamicProgrammingMatrix:
 
     def update( self, partition, i, j ):
         self.Q[ i ][ j ] = 0
-        self.backtrack_info[ i ][ j ] = []
+        if partition.options.calc_backtrack_info: self.backtrack_info[ i ][ j ] = BacktrackRecords()
         self.update_func( partition, i, j )
 
     def get_backtrack_info( self, partition, i, j ):
-        if not self.backtrack_info_updated[i][j]:
+        if not (i,j) in self.backtrack_info_updated:
             partition.options.calc_backtrack_info = True
             self.update( partition, i, j )
             partition.options.calc_backtrack_info = False
-            self.backtrack_info_updated[i][j] = True
+            self.backtrack_info_updated.add( (i,j) )
         return self.backtrack_info[i][j]
 
     def __len__( self ):
@@ -56,9 +84,8 @@ class DynamicProgrammingList:
     def __init__( self, N, val = 0.0, update_func = None, options = None, name = None ):
         self.N = N
         self.Q = [ val ]*N
-        self.backtrack_info = [None] * N
-        for i in range( N ): self.backtrack_info[i] = []
-        self.backtrack_info_updated = [False]*N
+        self.backtrack_info = defaultdict( BacktrackRecords )
+        self.backtrack_info_updated = set()
         self.update_func = update_func
         self.name = name
 
@@ -68,13 +95,13 @@ class DynamicProgrammingList:
 
     def update( self, partition, i ):
         self.Q[ i ] = 0.0
-        self.backtrack_info[ i ] = []
+        if partition.options.calc_backtrack_info: self.backtrack_info[ i ] = BacktrackRecords()
         self.update_func( partition, i )
 
     def get_backtrack_info( self, partition, i ):
-        if not self.backtrack_info_updated[i]:
+        if not i in self.backtrack_info_updated:
             partition.options.calc_backtrack_info = True
             self.update( partition, i )
             partition.options.calc_backtrack_info = False
-            self.backtrack_info_updated[i] = True
+            self.backtrack_info_updated.add( i )
         return self.backtrack_info[i]
@@ -16,28 +16,30 @@ def update_Z_cut( self, i, j ):
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
     offset = ( j - i ) % N
+    scale2 = self.scale**2 # i and j themselves are not in any subfragment
     for c in range( i, i+offset ):
         if not ligated[c%N]:
             # strand 1  (i --> c), strand 2  (c+1 -- > j)
-            if c == i and (c+1)%N == j:                                 contribs.append( 1.0)
-            if c == i and (c+1)%N != j and ligated[(j-1)%N]:                contribs.append( Z_linear.Q[(c+1)%N][(j-1)%N] )
-            if c != i and (c+1)%N == j and ligated[i%N]:                  contribs.append( Z_linear.Q[(i+1)%N][c%N] )
-            if c != i and (c+1)%N != j and ligated[i%N] and ligated[(j-1)%N]: contribs.append( Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] )
+            if c == i and (c+1)%N == j:                                 contribs.append( scale2)
+            if c == i and (c+1)%N != j and ligated[(j-1)%N]:                contribs.append( Z_linear.Q[(c+1)%N][(j-1)%N] * scale2 )
+            if c != i and (c+1)%N == j and ligated[i%N]:                  contribs.append( Z_linear.Q[(i+1)%N][c%N] * scale2 )
+            if c != i and (c+1)%N != j and ligated[i%N] and ligated[(j-1)%N]: contribs.append( Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] * scale2 )
 
-    Z_cut.Q[i%N][j%N] = sum( contribs )
+    Z_cut.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         offset = ( j - i ) % N
+        scale2 = self.scale**2 # i and j themselves are not in any subfragment
         for c in range( i, i+offset ):
             if not ligated[c%N]:
-                if Z_linear.Q[(c+1)%N][(j-1)%N] > 0:
-                    if c == i and (c+1)%N != j and ligated[(j-1)%N]:                Z_cut.backtrack_info[i%N][j%N] +=  [ (Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(c+1)%N,(j-1)%N)] ) ]
-                if Z_linear.Q[(i+1)%N][c%N] > 0:
-                    if c != i and (c+1)%N == j and ligated[i%N]:                  Z_cut.backtrack_info[i%N][j%N] +=  [ (Z_linear.Q[(i+1)%N][c%N], [(Z_linear,(i+1)%N,c%N)] ) ]
-                if Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] > 0:
-                    if c != i and (c+1)%N != j and ligated[i%N] and ligated[(j-1)%N]: Z_cut.backtrack_info[i%N][j%N] +=  [ (Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(i+1)%N,c%N), (Z_linear,(c+1)%N,(j-1)%N)] ) ]
+                if Z_linear.Q[(c+1)%N][(j-1)%N] * scale2 > 0:
+                    if c == i and (c+1)%N != j and ligated[(j-1)%N]:                Z_cut.backtrack_info[i%N][j%N].add( Z_linear.Q[(c+1)%N][(j-1)%N] * scale2, Z_linear.backtrack_code + ((c+1)%N)*N + (j-1)%N )
+                if Z_linear.Q[(i+1)%N][c%N] * scale2 > 0:
+                    if c != i and (c+1)%N == j and ligated[i%N]:                  Z_cut.backtrack_info[i%N][j%N].add( Z_linear.Q[(i+1)%N][c%N] * scale2, Z_linear.backtrack_code + ((i+1)%N)*N + c%N )
+                if Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] * scale2 > 0:
+                    if c != i and (c+1)%N != j and ligated[i%N] and ligated[(j-1)%N]: Z_cut.backtrack_info[i%N][j%N].add( Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] * scale2, Z_linear.backtrack_code + ((i+1)%N)*N + c%N, Z_linear.backtrack_code + ((c+1)%N)*N + (j-1)%N )
 
 ##################################################################################################
 def update_Z_BPq( self, i, j, base_pair_type ):
@@ -56,6 +58,10 @@ def update_Z_BPq( self, i, j, base_pair_type ):
 
     (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
 
+    # nucleotides not covered by subfragments each need a factor of scale -- see scale_util.py
+    scale  = self.scale
+    scale2 = scale**2
+
     if ligated[i%N] and ligated[(j-1)%N]:
         # base pair closes a loop
         #
@@ -65,7 +71,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
         #   \       /
         #    i ... j
         #
-        contribs.append( (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) )
+        contribs.append( (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) * scale2 )
 
         # base pair forms a stacked pair with previous pair
         #
@@ -77,7 +83,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
         #   only a modest (~10%) slowdown
         for base_pair_type2 in self.possible_base_pair_types[(i+1)%N][(j-1)%N]:
             Z_BPq2 = self.Z_BPq[base_pair_type2]
-            contribs.append( (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] )
+            contribs.append( (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] * scale2 )
 
     possible_motif_types = self.possible_motif_types[i%N][j%N]
     for motif_type in possible_motif_types[base_pair_type]:
@@ -89,7 +95,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #           i ... j
             #          5' bpt  3'
             #
-            contribs.append( (1.0/Kdq ) * motif_type.C_eff)
+            contribs.append( (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1) )
             pass
         elif len(motif_type.strands) == 2: # internal loops (2-way junctions)
             # base pair forms a motif with previous pair
@@ -105,7 +111,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #
             for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
                 Z_BPq_next = self.Z_BPq[base_pair_type_next]
-                contribs.append( (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] )
+                contribs.append( (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] * scale**( offset - (j_next - i_next) % N ) )
         # could certainly handle 3WJ in O(N^3) time as well
         # but how about 4WJ? anyway to do without an O(N^4) cost?
 
@@ -127,7 +133,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #    i ... j - j-1 ~
             #
             for k in range( i+2, i+offset-1 ):
-                if ligated[k%N]: contribs.append( Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq )
+                if ligated[k%N]: contribs.append( Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2 )
 
             # coaxial stack of bp (i,j) and (k,j-1)...  close loop on left, and "right stack"
             #            ___
@@ -137,7 +143,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #  ~ i+1 - i ... j
             #
             for k in range( i+2, i+offset-1 ):
-                if ligated[(k-1)%N]: contribs.append( C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq )
+                if ligated[(k-1)%N]: contribs.append( C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2 )
 
         # "left stack" but no loop closed on right (free strands hanging off j end)
         #      ___
@@ -161,7 +167,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             for k in range( i, i+offset-1 ):
                 contribs.append( Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq )
 
-    Z_BPq.Q[i%N][j%N] = sum( contribs )
+    Z_BPq.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
@@ -169,41 +175,45 @@ def update_Z_BPq( self, i, j, base_pair_type ):
         offset = ( j - i ) % N
         ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
         (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
+        scale  = self.scale
+        scale2 = scale**2
         if ligated[i%N] and ligated[(j-1)%N]:
-            if (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) > 0:
-                Z_BPq.backtrack_info[i%N][j%N]  +=  [ ((1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP), [(C_eff_for_BP,(i+1)%N,(j-1)%N)] ) ]
+            if (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) * scale2 > 0:
+                Z_BPq.backtrack_info[i%N][j%N].add( (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) * scale2, C_eff_for_BP.backtrack_code + ((i+1)%N)*N + (j-1)%N )
             for base_pair_type2 in self.possible_base_pair_types[(i+1)%N][(j-1)%N]:
                 Z_BPq2 = self.Z_BPq[base_pair_type2]
-                if (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] > 0:
-                    Z_BPq.backtrack_info[i%N][j%N]  +=  [ ((1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N], [(Z_BPq2,(i+1)%N,(j-1)%N)] ) ]
+                if (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] * scale2 > 0:
+                    Z_BPq.backtrack_info[i%N][j%N].add( (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] * scale2, Z_BPq2.backtrack_code + ((i+1)%N)*N + (j-1)%N )
         possible_motif_types = self.possible_motif_types[i%N][j%N]
         for motif_type in possible_motif_types[base_pair_type]:
             match_base_pair_type_set = possible_motif_types[base_pair_type][ motif_type ]
             if len(motif_type.strands) == 1: # hairpins (1-way junctions)
+                if (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1) > 0:
+                    Z_BPq.backtrack_info[i%N][j%N].add( (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1) )
                 pass
             elif len(motif_type.strands) == 2: # internal loops (2-way junctions)
                 for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
                     Z_BPq_next = self.Z_BPq[base_pair_type_next]
-                    if (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] > 0:
-                        Z_BPq.backtrack_info[i%N][j%N] +=  [ ((1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N], [(Z_BPq_next,(i_next)%N,(j_next)%N)] ) ]
+                    if (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] * scale**( offset - (j_next - i_next) % N ) > 0:
+                        Z_BPq.backtrack_info[i%N][j%N].add( (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] * scale**( offset - (j_next - i_next) % N ), Z_BPq_next.backtrack_code + ((i_next)%N)*N + (j_next)%N )
         if (C_std/Kdq) * Z_cut.Q[i%N][j%N] > 0:
-            Z_BPq.backtrack_info[i%N][j%N] +=  [ ((C_std/Kdq) * Z_cut.Q[i%N][j%N], [(Z_cut,i%N,j%N)] ) ]
+            Z_BPq.backtrack_info[i%N][j%N].add( (C_std/Kdq) * Z_cut.Q[i%N][j%N], Z_cut.backtrack_code + (i%N)*N + j%N )
         if K_coax > 0.0:
             if ligated[i%N] and ligated[(j-1)%N]:
                 for k in range( i+2, i+offset-1 ):
-                    if Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq > 0:
-                        if ligated[k%N]: Z_BPq.backtrack_info[i%N][j%N] +=  [ (Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (C_eff_for_coax,(k+1)%N,(j-1)%N)] ) ]
+                    if Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2 > 0:
+                        if ligated[k%N]: Z_BPq.backtrack_info[i%N][j%N].add( Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2, Z_BP.backtrack_code + ((i+1)%N)*N + k%N, C_eff_for_coax.backtrack_code + ((k+1)%N)*N + (j-1)%N )
                 for k in range( i+2, i+offset-1 ):
-                    if C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq > 0:
-                        if ligated[(k-1)%N]: Z_BPq.backtrack_info[i%N][j%N] +=  [ (C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(C_eff_for_coax,(i+1)%N,(k-1)%N), (Z_BP,k%N,(j-1)%N)] ) ]
+                    if C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2 > 0:
+                        if ligated[(k-1)%N]: Z_BPq.backtrack_info[i%N][j%N].add( C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2, C_eff_for_coax.backtrack_code + ((i+1)%N)*N + (k-1)%N, Z_BP.backtrack_code + (k%N)*N + (j-1)%N )
             if ligated[i%N]:
                 for k in range( i+2, i+offset ):
                     if Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq > 0:
-                        Z_BPq.backtrack_info[i%N][j%N] +=  [ (Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (Z_cut,k%N,j%N)] ) ]
+                        Z_BPq.backtrack_info[i%N][j%N].add( Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq, Z_BP.backtrack_code + ((i+1)%N)*N + k%N, Z_cut.backtrack_code + (k%N)*N + j%N )
             if ligated[(j-1)%N]:
                 for k in range( i, i+offset-1 ):
                     if Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq > 0:
-                        Z_BPq.backtrack_info[i%N][j%N] +=  [ (Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq, [(Z_cut,i%N,k%N), (Z_BP,k%N,(j-1)%N)] ) ]
+                        Z_BPq.backtrack_info[i%N][j%N].add( Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq, Z_cut.backtrack_code + (i%N)*N + k%N, Z_BP.backtrack_code + (k%N)*N + (j-1)%N )
 
 ##################################################################################################
 def update_Z_BP( self, i, j ):
@@ -222,7 +232,7 @@ def update_Z_BP( self, i, j ):
         Z_BPq.update( self, i, j )
         contribs.append( Z_BPq.Q[i%N][j%N] )
 
-    Z_BP.Q[i%N][j%N] = sum( contribs )
+    Z_BP.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
@@ -231,7 +241,7 @@ def update_Z_BP( self, i, j ):
             Z_BPq = self.Z_BPq[base_pair_type]
             Z_BPq.update( self, i, j )
             if Z_BPq.Q[i%N][j%N] > 0:
-                Z_BP.backtrack_info[i%N][j%N]  +=  [ (Z_BPq.Q[i%N][j%N], [(Z_BPq,i%N,j%N)] ) ]
+                Z_BP.backtrack_info[i%N][j%N].add( Z_BPq.Q[i%N][j%N], Z_BPq.backtrack_code + (i%N)*N + j%N )
 
 ##################################################################################################
 def update_Z_coax( self, i, j ):
@@ -260,7 +270,7 @@ def update_Z_coax( self, i, j ):
                 if Z_BP.val(k+1,j) == 0.0: continue
                 contribs.append( Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax )
 
-    Z_coax.Q[i%N][j%N] = sum( contribs )
+    Z_coax.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
@@ -273,7 +283,7 @@ def update_Z_coax( self, i, j ):
                     if Z_BP.val(i,k) == 0.0: continue
                     if Z_BP.val(k+1,j) == 0.0: continue
                     if Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax > 0:
-                        Z_coax.backtrack_info[i%N][j%N]  +=  [ (Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax, [(Z_BP,i%N,k%N), (Z_BP,(k+1)%N,j%N)] ) ]
+                        Z_coax.backtrack_info[i%N][j%N].add( Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax, Z_BP.backtrack_code + (i%N)*N + k%N, Z_BP.backtrack_code + ((k+1)%N)*N + j%N )
 
 ##################################################################################################
 def update_C_eff_basic( self, i, j ):
@@ -300,7 +310,7 @@ def update_C_eff_basic( self, i, j ):
     #    i ~~~~~~ j-1 - j
     #
     allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j%N] )
-    if ligated[(j-1)%N] and allow_loop_extension: contribs.append( C_eff.Q[i%N][(j-1)%N] * l )
+    if ligated[(j-1)%N] and allow_loop_extension: contribs.append( C_eff.Q[i%N][(j-1)%N] * l * self.scale )
 
     exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j%N]
 
@@ -324,25 +334,25 @@ def update_C_eff_basic( self, i, j ):
         for k in range( i+1, i+offset):
             if ligated[(k-1)%N]: contribs.append( C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax )
 
-    C_eff_basic.Q[i%N][j%N] = sum( contribs )
+    C_eff_basic.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         offset = ( j - i ) % self.N
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j%N] )
-        if C_eff.Q[i%N][(j-1)%N] * l > 0:
-            if ligated[(j-1)%N] and allow_loop_extension: C_eff_basic.backtrack_info[i%N][j%N] +=  [ (C_eff.Q[i%N][(j-1)%N] * l, [(C_eff,i%N,(j-1)%N)] ) ]
+        if C_eff.Q[i%N][(j-1)%N] * l * self.scale > 0:
+            if ligated[(j-1)%N] and allow_loop_extension: C_eff_basic.backtrack_info[i%N][j%N].add( C_eff.Q[i%N][(j-1)%N] * l * self.scale, C_eff.backtrack_code + (i%N)*N + (j-1)%N )
         exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j%N]
         C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
         for k in range( i+1, i+offset):
             if C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP > 0:
-                if ligated[(k-1)%N]: C_eff_basic.backtrack_info[i%N][j%N] +=  [ (C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP, [(C_eff_for_BP,i%N,(k-1)%N), (Z_BP,k%N,j%N)] ) ]
+                if ligated[(k-1)%N]: C_eff_basic.backtrack_info[i%N][j%N].add( C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP, C_eff_for_BP.backtrack_code + (i%N)*N + (k-1)%N, Z_BP.backtrack_code + (k%N)*N + j%N )
         if K_coax > 0:
             C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
             for k in range( i+1, i+offset):
                 if C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax > 0:
-                    if ligated[(k-1)%N]: C_eff_basic.backtrack_info[i%N][j%N] +=  [ (C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax, [(C_eff_for_coax,i%N,(k-1)%N), (Z_coax,k%N,j%N)] ) ]
+                    if ligated[(k-1)%N]: C_eff_basic.backtrack_info[i%N][j%N].add( C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax, C_eff_for_coax.backtrack_code + (i%N)*N + (k-1)%N, Z_coax.backtrack_code + (k%N)*N + j%N )
 
 ##################################################################################################
 def update_C_eff_no_coax_singlet( self, i, j ):
@@ -355,15 +365,15 @@ def update_C_eff_no_coax_singlet( self, i, j ):
     contribs.append( C_eff_basic.Q[i%N][j%N] )
     contribs.append( C_init * Z_BP.Q[i%N][j%N] * l_BP )
 
-    C_eff_no_coax_singlet.Q[i%N][j%N] = sum( contribs )
+    C_eff_no_coax_singlet.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         if C_eff_basic.Q[i%N][j%N] > 0:
-            C_eff_no_coax_singlet.backtrack_info[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)] ) ]
+            C_eff_no_coax_singlet.backtrack_info[i%N][j%N].add( C_eff_basic.Q[i%N][j%N], C_eff_basic.backtrack_code + (i%N)*N + j%N )
         if C_init * Z_BP.Q[i%N][j%N] * l_BP > 0:
-            C_eff_no_coax_singlet.backtrack_info[i%N][j%N] +=  [ (C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)] ) ]
+            C_eff_no_coax_singlet.backtrack_info[i%N][j%N].add( C_init * Z_BP.Q[i%N][j%N] * l_BP, Z_BP.backtrack_code + (i%N)*N + j%N )
 
 ##################################################################################################
 def update_C_eff_no_BP_singlet( self, i, j ):
@@ -376,16 +386,16 @@ def update_C_eff_no_BP_singlet( self, i, j ):
         contribs.append( C_eff_basic.Q[i%N][j%N] )
         contribs.append( C_init * Z_coax.Q[i%N][j%N] * l_coax )
 
-    C_eff_no_BP_singlet.Q[i%N][j%N] = sum( contribs )
+    C_eff_no_BP_singlet.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         if K_coax > 0.0:
             if C_eff_basic.Q[i%N][j%N] > 0:
-                C_eff_no_BP_singlet.backtrack_info[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)] ) ]
+                C_eff_no_BP_singlet.backtrack_info[i%N][j%N].add( C_eff_basic.Q[i%N][j%N], C_eff_basic.backtrack_code + (i%N)*N + j%N )
             if C_init * Z_coax.Q[i%N][j%N] * l_coax > 0:
-                C_eff_no_BP_singlet.backtrack_info[i%N][j%N] +=  [ (C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)] ) ]
+                C_eff_no_BP_singlet.backtrack_info[i%N][j%N].add( C_init * Z_coax.Q[i%N][j%N] * l_coax, Z_coax.backtrack_code + (i%N)*N + j%N )
 
 ##################################################################################################
 def update_C_eff( self, i, j ):
@@ -414,18 +424,18 @@ def update_C_eff( self, i, j ):
         #
         contribs.append( C_init * Z_coax.Q[i%N][j%N] * l_coax )
 
-    C_eff.Q[i%N][j%N] = sum( contribs )
+    C_eff.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         if C_eff_basic.Q[i%N][j%N] > 0:
-            C_eff.backtrack_info[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)] ) ]
+            C_eff.backtrack_info[i%N][j%N].add( C_eff_basic.Q[i%N][j%N], C_eff_basic.backtrack_code + (i%N)*N + j%N )
         if C_init * Z_BP.Q[i%N][j%N] * l_BP > 0:
-            C_eff.backtrack_info[i%N][j%N] +=  [ (C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)] ) ]
+            C_eff.backtrack_info[i%N][j%N].add( C_init * Z_BP.Q[i%N][j%N] * l_BP, Z_BP.backtrack_code + (i%N)*N + j%N )
         if K_coax > 0.0:
             if C_init * Z_coax.Q[i%N][j%N] * l_coax > 0:
-                C_eff.backtrack_info[i%N][j%N] +=  [ (C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)] ) ]
+                C_eff.backtrack_info[i%N][j%N].add( C_init * Z_coax.Q[i%N][j%N] * l_coax, Z_coax.backtrack_code + (i%N)*N + j%N )
 
 ##################################################################################################
 def update_Z_linear( self, i, j ):
@@ -446,7 +456,7 @@ def update_Z_linear( self, i, j ):
     #    i ~~~~~~ j-1 - j
     #
     allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j%N] )
-    if ligated[(j-1)%N] and allow_loop_extension: contribs.append( Z_linear.Q[i%N][(j-1)%N] )
+    if ligated[(j-1)%N] and allow_loop_extension: contribs.append( Z_linear.Q[i%N][(j-1)%N] * self.scale )
 
     # j is base paired, and its partner is i
     #     ___
@@ -483,26 +493,26 @@ def update_Z_linear( self, i, j ):
             if ligated[(k-1)%N]: contribs.append( Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] )
 
 
-    Z_linear.Q[i%N][j%N] = sum( contribs )
+    Z_linear.Q[i%N][j%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         offset = ( j - i ) % self.N
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j%N] )
-        if Z_linear.Q[i%N][(j-1)%N] > 0:
-            if ligated[(j-1)%N] and allow_loop_extension: Z_linear.backtrack_info[i%N][j%N] +=  [ (Z_linear.Q[i%N][(j-1)%N], [(Z_linear,i%N,(j-1)%N)] ) ]
+        if Z_linear.Q[i%N][(j-1)%N] * self.scale > 0:
+            if ligated[(j-1)%N] and allow_loop_extension: Z_linear.backtrack_info[i%N][j%N].add( Z_linear.Q[i%N][(j-1)%N] * self.scale, Z_linear.backtrack_code + (i%N)*N + (j-1)%N )
         if Z_BP.Q[i%N][j%N] > 0:
-            Z_linear.backtrack_info[i%N][j%N] +=  [ (Z_BP.Q[i%N][j%N], [(Z_BP,i%N,j%N)] ) ]
+            Z_linear.backtrack_info[i%N][j%N].add( Z_BP.Q[i%N][j%N], Z_BP.backtrack_code + (i%N)*N + j%N )
         for k in range( i+1, i+offset):
             if Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N] > 0:
-                if ligated[(k-1)%N]: Z_linear.backtrack_info[i%N][j%N] +=  [ (Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_BP,k%N,j%N)] ) ]
+                if ligated[(k-1)%N]: Z_linear.backtrack_info[i%N][j%N].add( Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N], Z_linear.backtrack_code + (i%N)*N + (k-1)%N, Z_BP.backtrack_code + (k%N)*N + j%N )
         if K_coax > 0.0:
             if Z_coax.Q[i%N][j%N] > 0:
-                Z_linear.backtrack_info[i%N][j%N] +=  [ (Z_coax.Q[i%N][j%N], [(Z_coax,i%N,j%N)] ) ]
+                Z_linear.backtrack_info[i%N][j%N].add( Z_coax.Q[i%N][j%N], Z_coax.backtrack_code + (i%N)*N + j%N )
             for k in range( i+1, i+offset):
                 if Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] > 0:
-                    if ligated[(k-1)%N]: Z_linear.backtrack_info[i%N][j%N] +=  [ (Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_coax,k%N,j%N)] ) ]
+                    if ligated[(k-1)%N]: Z_linear.backtrack_info[i%N][j%N].add( Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N], Z_linear.backtrack_code + (i%N)*N + (k-1)%N, Z_coax.backtrack_code + (k%N)*N + j%N )
 
 ##################################################################################################
 def update_Z_final( self, i ):
@@ -515,6 +525,7 @@ def update_Z_final( self, i ):
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
 
     Z_final = self.Z_final
+    scale = self.scale
     if not ligated[((i - 1))%N]:
         #
         #      i ------- i-1
@@ -552,9 +563,9 @@ def update_Z_final( self, i ):
             #
             if ligated[j%N]:
                 if Z_BP.val(i,j) > 0.0 and Z_BP.val(j+1,i-1) > 0.0:
-                    for base_pair_type in self.params.base_pair_types:
+                    for base_pair_type in self.possible_base_pair_types[i%N][j%N]:
                         if self.Z_BPq[base_pair_type].val(i,j) == 0.0: continue
-                        for base_pair_type2 in self.params.base_pair_types:
+                        for base_pair_type2 in self.possible_base_pair_types[(j+1)%N][(i-1)%N]:
                             if self.Z_BPq[base_pair_type2].val(j+1,i-1) == 0.0: continue
                             Z_BPq1 = self.Z_BPq[base_pair_type]
                             Z_BPq2 = self.Z_BPq[base_pair_type2]
@@ -584,7 +595,7 @@ def update_Z_final( self, i ):
                         for (base_pair_type0,j_next,k_next) in match_base_pair_type_set:
                             Z_BPq0 = self.Z_BPq[base_pair_type0]
                             Z_BPq1 = self.Z_BPq[base_pair_type1]
-                            contribs.append( motif_type.C_eff * Z_BPq0.Q[(j_next)%N][(k_next)%N] * Z_BPq1.Q[k%N][j%N] )
+                            contribs.append( motif_type.C_eff * Z_BPq0.Q[(j_next)%N][(k_next)%N] * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - (k_next-j_next)%N - 2 ) )
 
 
         # ligation allows a hairpin to close across i-1 to i
@@ -608,7 +619,7 @@ def update_Z_final( self, i ):
                     possible_motif_types = self.possible_motif_types[j%N][k%N]
                     if not motif_type in possible_motif_types[ base_pair_type ]: continue
                     Z_BPq1 = self.Z_BPq[base_pair_type.flipped]
-                    contribs.append( motif_type.C_eff * Z_BPq1.Q[k%N][j%N] )
+                    contribs.append( motif_type.C_eff * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - 1 ) )
 
         if K_coax > 0:
             C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
@@ -642,35 +653,36 @@ def update_Z_final( self, i ):
                     if Z_BP.val(i,j) == 0: continue
                     if Z_BP.val(k,i-1) == 0: continue
                     if (k-j)%N == 1 and ligated[j%N]: continue
-                    contribs.append( Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax )
+                    contribs.append( Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax / scale**2 )
 
 
-    Z_final.Q[i%N] = sum( contribs )
+    Z_final.Q[i%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         (C_init, l, l_BP, K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         Z_final = self.Z_final
+        scale = self.scale
         if not ligated[((i - 1))%N]:
             if Z_linear.Q[i%N][(i-1)%N] > 0:
-                Z_final.backtrack_info[i%N] +=  [ (Z_linear.Q[i%N][(i-1)%N], [(Z_linear,i%N,(i-1)%N)] ) ]
+                Z_final.backtrack_info[i%N].add( Z_linear.Q[i%N][(i-1)%N], Z_linear.backtrack_code + (i%N)*N + (i-1)%N )
         else:
             if C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std > 0:
-                Z_final.backtrack_info[i%N] +=  [ (C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std, [(C_eff_no_coax_singlet,i%N,(i-1)%N)] ) ]
+                Z_final.backtrack_info[i%N].add( C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std, C_eff_no_coax_singlet.backtrack_code + (i%N)*N + (i-1)%N )
             for c in range( i, i + N - 1):
                 if Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N] > 0:
-                    if not ligated[c%N]: Z_final.backtrack_info[i%N] +=  [ (Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N], [(Z_linear,i%N,c%N), (Z_linear,(c+1)%N,(i-1)%N)] ) ]
+                    if not ligated[c%N]: Z_final.backtrack_info[i%N].add( Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N], Z_linear.backtrack_code + (i%N)*N + c%N, Z_linear.backtrack_code + ((c+1)%N)*N + (i-1)%N )
             for j in range( i+1, (i + N - 1) ):
                 if ligated[j%N]:
                     if Z_BP.val(i,j) > 0.0 and Z_BP.val(j+1,i-1) > 0.0:
-                        for base_pair_type in self.params.base_pair_types:
+                        for base_pair_type in self.possible_base_pair_types[i%N][j%N]:
                             if self.Z_BPq[base_pair_type].val(i,j) == 0.0: continue
-                            for base_pair_type2 in self.params.base_pair_types:
+                            for base_pair_type2 in self.possible_base_pair_types[(j+1)%N][(i-1)%N]:
                                 if self.Z_BPq[base_pair_type2].val(j+1,i-1) == 0.0: continue
                                 Z_BPq1 = self.Z_BPq[base_pair_type]
                                 Z_BPq2 = self.Z_BPq[base_pair_type2]
                                 if self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N] > 0:
-                                    Z_final.backtrack_info[i%N] +=  [ (self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N], [(Z_BPq2,(j+1)%N,(i-1)%N), (Z_BPq1,i%N,j%N)] ) ]
+                                    Z_final.backtrack_info[i%N].add( self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N], Z_BPq2.backtrack_code + ((j+1)%N)*N + (i-1)%N, Z_BPq1.backtrack_code + (i%N)*N + j%N )
                 for k in range( i, i + self.max_motif_strand_length - 1 ):
                     for base_pair_type in self.possible_base_pair_types[j%N][k%N]:
                         possible_motif_types = self.possible_motif_types[j%N][k%N]
@@ -682,8 +694,8 @@ def update_Z_final( self, i ):
                             for (base_pair_type0,j_next,k_next) in match_base_pair_type_set:
                                 Z_BPq0 = self.Z_BPq[base_pair_type0]
                                 Z_BPq1 = self.Z_BPq[base_pair_type1]
-                                if motif_type.C_eff * Z_BPq0.Q[(j_next)%N][(k_next)%N] * Z_BPq1.Q[k%N][j%N] > 0:
-                                    Z_final.backtrack_info[i%N]  +=  [ (motif_type.C_eff * Z_BPq0.Q[(j_next)%N][(k_next)%N] * Z_BPq1.Q[k%N][j%N], [(Z_BPq0,(j_next)%N,(k_next)%N), (Z_BPq1,k%N,j%N)] ) ]
+                                if motif_type.C_eff * Z_BPq0.Q[(j_next)%N][(k_next)%N] * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - (k_next-j_next)%N - 2 ) > 0:
+                                    Z_final.backtrack_info[i%N].add( motif_type.C_eff * Z_BPq0.Q[(j_next)%N][(k_next)%N] * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - (k_next-j_next)%N - 2 ), Z_BPq0.backtrack_code + ((j_next)%N)*N + (k_next)%N, Z_BPq1.backtrack_code + (k%N)*N + j%N )
             for motif_type in self.params.motif_types:
                 if len( motif_type.strands) != 1: continue
                 L = len( motif_type.strands[0] ) # for a tetraloop this is 1+4+1 = 6
@@ -693,8 +705,8 @@ def update_Z_final( self, i ):
                         possible_motif_types = self.possible_motif_types[j%N][k%N]
                         if not motif_type in possible_motif_types[ base_pair_type ]: continue
                         Z_BPq1 = self.Z_BPq[base_pair_type.flipped]
-                        if motif_type.C_eff * Z_BPq1.Q[k%N][j%N] > 0:
-                            Z_final.backtrack_info[i%N]  +=  [ (motif_type.C_eff * Z_BPq1.Q[k%N][j%N], [(Z_BPq1,k%N,j%N)] ) ]
+                        if motif_type.C_eff * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - 1 ) > 0:
+                            Z_final.backtrack_info[i%N].add( motif_type.C_eff * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - 1 ), Z_BPq1.backtrack_code + (k%N)*N + j%N )
             if K_coax > 0:
                 C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
                 for j in range( i + 1, i + N - 2):
@@ -704,13 +716,13 @@ def update_Z_final( self, i ):
                         if Z_BP.val(i,j) == 0: continue
                         if Z_BP.val(k,i-1) == 0: continue
                         if Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax > 0:
-                            Z_final.backtrack_info[i%N] +=  [ (Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax, [(Z_BP,i%N,j%N), (C_eff_for_coax,(j+1)%N,(k-1)%N), (Z_BP,k%N,(i-1)%N)] ) ]
+                            Z_final.backtrack_info[i%N].add( Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax, Z_BP.backtrack_code + (i%N)*N + j%N, C_eff_for_coax.backtrack_code + ((j+1)%N)*N + (k-1)%N, Z_BP.backtrack_code + (k%N)*N + (i-1)%N )
                     for k in range( j + 1, i + N - 1):
                         if Z_BP.val(i,j) == 0: continue
                         if Z_BP.val(k,i-1) == 0: continue
                         if (k-j)%N == 1 and ligated[j%N]: continue
-                        if Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax > 0:
-                            Z_final.backtrack_info[i%N] +=  [ (Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax, [(Z_BP,i%N,j%N), (Z_cut,j%N,k%N), (Z_BP,k%N,(i-1)%N)] ) ]
+                        if Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax / scale**2 > 0:
+                            Z_final.backtrack_info[i%N].add( Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax / scale**2, Z_BP.backtrack_code + (i%N)*N + j%N, Z_cut.backtrack_code + (j%N)*N + k%N, Z_BP.backtrack_code + (k%N)*N + (i-1)%N )
 
 ##################################################################################################
 def unpack_variables( self ):
@@ -725,7 +737,7 @@ def unpack_variables( self ):
            ( self.N, self.sequence, self.ligated, self.all_ligated,  \
              self.Z_BP,self.C_eff_basic,self.C_eff_no_BP_singlet,self.C_eff_no_coax_singlet,self.C_eff,\
              self.Z_linear,self.Z_cut,self.Z_coax )
-    Z_final.Q[i%N] = sum( contribs )
+    Z_final.Q[i%N] = self.options.sum( contribs ) # sum, or max, see semiring_util.py
 
     if self.options.calc_backtrack_info: # AUTOGENERATED CONTRIBS BLOCK
         return self.params.get_variables() + \
@@ -733,3 +745,298 @@ def unpack_variables( self ):
                  self.Z_BP,self.C_eff_basic,self.C_eff_no_BP_singlet,self.C_eff_no_coax_singlet,self.C_eff,\
                  self.Z_linear,self.Z_cut,self.Z_coax )
 
+##################################################################################################
+fused_update_order = ['update_Z_cut', 'update_Z_BP', 'update_Z_coax', 'update_C_eff_basic', 'update_C_eff_no_BP_singlet', 'update_C_eff_no_coax_singlet', 'update_C_eff', 'update_Z_linear']
+
+def update_diagonal( self, offset, num_cells ):
+    '''
+    Fused kernel -- updates all 2-D matrices at (i,j) = (i, (i+offset)%N) for i = 0 ... num_cells-1, in order:
+      Z_cut, Z_BP, Z_coax, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear
+    Generated from the update functions above, adding up contributions as: X_ij += (term).
+    Does not fill backtrack_info.
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    scale = self.scale
+    in_forced_base_pair = self.in_forced_base_pair
+    C_eff_stack = self.params.C_eff_stack
+    scale2 = scale**2
+    for i in range( num_cells ):
+        j = ( i + offset ) % N
+        ( Z_cut_i, Z_BP_i, Z_coax_i, C_eff_basic_i, C_eff_no_BP_singlet_i, C_eff_no_coax_singlet_i, C_eff_i, Z_linear_i ) = ( Z_cut.Q[i], Z_BP.Q[i], Z_coax.Q[i], C_eff_basic.Q[i], C_eff_no_BP_singlet.Q[i], C_eff_no_coax_singlet.Q[i], C_eff.Q[i], Z_linear.Q[i] )
+
+        # Z_cut
+        Z_cut_ij = 0.0
+        for c in range( i, i+offset ):
+            if not ligated[c%N]:
+                if c == i and (c+1)%N == j:                                 Z_cut_ij += scale2
+                if c == i and (c+1)%N != j and ligated[(j-1)%N]:                Z_cut_ij += Z_linear.Q[(c+1)%N][(j-1)%N] * scale2
+                if c != i and (c+1)%N == j and ligated[i]:                  Z_cut_ij += Z_linear.Q[(i+1)%N][c%N] * scale2
+                if c != i and (c+1)%N != j and ligated[i] and ligated[(j-1)%N]: Z_cut_ij += Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] * scale2
+        Z_cut_i[j] = Z_cut_ij
+
+        # Z_BP
+        Z_BP_ij = 0.0
+        for base_pair_type in self.possible_base_pair_types[i][j]:
+            Z_BPq = self.Z_BPq[base_pair_type]
+            Z_BPq_ij = 0.0
+            ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+            (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
+            if ligated[i] and ligated[(j-1)%N]:
+                Z_BPq_ij += (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) * scale2
+                for base_pair_type2 in self.possible_base_pair_types[(i+1)%N][(j-1)%N]:
+                    Z_BPq2 = self.Z_BPq[base_pair_type2]
+                    Z_BPq_ij += (1.0/Kdq ) * C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] * scale2
+            possible_motif_types = self.possible_motif_types[i][j]
+            for motif_type in possible_motif_types[base_pair_type]:
+                match_base_pair_type_set = possible_motif_types[base_pair_type][ motif_type ]
+                if len(motif_type.strands) == 1: # hairpins (1-way junctions)
+                    Z_BPq_ij += (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1)
+                    pass
+                elif len(motif_type.strands) == 2: # internal loops (2-way junctions)
+                    for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
+                        Z_BPq_next = self.Z_BPq[base_pair_type_next]
+                        Z_BPq_ij += (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] * scale**( offset - (j_next - i_next) % N )
+            Z_BPq_ij += (C_std/Kdq) * Z_cut_ij
+            if K_coax > 0.0:
+                if ligated[i] and ligated[(j-1)%N]:
+                    for k in range( i+2, i+offset-1 ):
+                        if ligated[k%N]: Z_BPq_ij += Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                    for k in range( i+2, i+offset-1 ):
+                        if ligated[(k-1)%N]: Z_BPq_ij += C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                if ligated[i]:
+                    for k in range( i+2, i+offset ):
+                        Z_BPq_ij += Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j] * C_std * K_coax / Kdq
+                if ligated[(j-1)%N]:
+                    for k in range( i, i+offset-1 ):
+                        Z_BPq_ij += Z_cut_i[k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq
+            Z_BPq.set_val( i, j, Z_BPq_ij )
+            Z_BP_ij += Z_BPq_ij
+        Z_BP_i[j] = Z_BP_ij
+
+        # Z_coax
+        Z_coax_ij = 0.0
+        if not ( (offset == N-1) and ligated[j] ):
+            if K_coax > 0:
+                for k in range( i+1, i+offset-1 ):
+                    if ligated[k%N]:
+                        if Z_BP_i[k%N] == 0.0: continue
+                        if Z_BP.Q[(k+1)%N][j] == 0.0: continue
+                        Z_coax_ij += Z_BP_i[k%N] * Z_BP.Q[(k+1)%N][j] * K_coax
+        Z_coax_i[j] = Z_coax_ij
+
+        # C_eff_basic
+        C_eff_basic_ij = 0.0
+        allow_loop_extension = not ( in_forced_base_pair and in_forced_base_pair[j] )
+        if ligated[(j-1)%N] and allow_loop_extension: C_eff_basic_ij += C_eff_i[(j-1)%N] * l * scale
+        exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j]
+        C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]: C_eff_basic_ij += C_eff_for_BP.Q[i][(k-1)%N] * l * Z_BP.Q[k%N][j] * l_BP
+        if K_coax > 0:
+            C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
+            for k in range( i+1, i+offset):
+                if ligated[(k-1)%N]: C_eff_basic_ij += C_eff_for_coax.Q[i][(k-1)%N] * Z_coax.Q[k%N][j] * l * l_coax
+        C_eff_basic_i[j] = C_eff_basic_ij
+
+        # C_eff_no_BP_singlet
+        C_eff_no_BP_singlet_ij = 0.0
+        if K_coax > 0.0:
+            C_eff_no_BP_singlet_ij += C_eff_basic_ij
+            C_eff_no_BP_singlet_ij += C_init * Z_coax_ij * l_coax
+        C_eff_no_BP_singlet_i[j] = C_eff_no_BP_singlet_ij
+
+        # C_eff_no_coax_singlet
+        C_eff_no_coax_singlet_ij = 0.0
+        C_eff_no_coax_singlet_ij += C_eff_basic_ij
+        C_eff_no_coax_singlet_ij += C_init * Z_BP_ij * l_BP
+        C_eff_no_coax_singlet_i[j] = C_eff_no_coax_singlet_ij
+
+        # C_eff
+        C_eff_ij = 0.0
+        C_eff_ij += C_eff_basic_ij
+        C_eff_ij += C_init * Z_BP_ij * l_BP
+        if K_coax > 0.0:
+            C_eff_ij += C_init * Z_coax_ij * l_coax
+        C_eff_i[j] = C_eff_ij
+
+        # Z_linear
+        Z_linear_ij = 0.0
+        allow_loop_extension = ( not in_forced_base_pair ) or ( not in_forced_base_pair[j] )
+        if ligated[(j-1)%N] and allow_loop_extension: Z_linear_ij += Z_linear_i[(j-1)%N] * scale
+        Z_linear_ij += Z_BP_ij
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]: Z_linear_ij += Z_linear_i[(k-1)%N] * Z_BP.Q[k%N][j]
+        if K_coax > 0.0:
+            Z_linear_ij += Z_coax_ij
+            for k in range( i+1, i+offset):
+                if ligated[(k-1)%N]: Z_linear_ij += Z_linear_i[(k-1)%N] * Z_coax.Q[k%N][j]
+        Z_linear_i[j] = Z_linear_ij
+
+def update_diagonal_max( self, offset, num_cells ):
+    '''
+    Fused kernel -- updates all 2-D matrices at (i,j) = (i, (i+offset)%N) for i = 0 ... num_cells-1, in order:
+      Z_cut, Z_BP, Z_coax, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear
+    Generated from the update functions above, adding up contributions as: contrib = (term); if contrib > X_ij: X_ij = contrib.
+    Does not fill backtrack_info.
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    scale = self.scale
+    in_forced_base_pair = self.in_forced_base_pair
+    C_eff_stack = self.params.C_eff_stack
+    scale2 = scale**2
+    for i in range( num_cells ):
+        j = ( i + offset ) % N
+        ( Z_cut_i, Z_BP_i, Z_coax_i, C_eff_basic_i, C_eff_no_BP_singlet_i, C_eff_no_coax_singlet_i, C_eff_i, Z_linear_i ) = ( Z_cut.Q[i], Z_BP.Q[i], Z_coax.Q[i], C_eff_basic.Q[i], C_eff_no_BP_singlet.Q[i], C_eff_no_coax_singlet.Q[i], C_eff.Q[i], Z_linear.Q[i] )
+
+        # Z_cut
+        Z_cut_ij = 0.0
+        for c in range( i, i+offset ):
+            if not ligated[c%N]:
+                if c == i and (c+1)%N == j:
+                    contrib = scale2
+                    if contrib > Z_cut_ij: Z_cut_ij = contrib
+                if c == i and (c+1)%N != j and ligated[(j-1)%N]:
+                    contrib = Z_linear.Q[(c+1)%N][(j-1)%N] * scale2
+                    if contrib > Z_cut_ij: Z_cut_ij = contrib
+                if c != i and (c+1)%N == j and ligated[i]:
+                    contrib = Z_linear.Q[(i+1)%N][c%N] * scale2
+                    if contrib > Z_cut_ij: Z_cut_ij = contrib
+                if c != i and (c+1)%N != j and ligated[i] and ligated[(j-1)%N]:
+                    contrib = Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] * scale2
+                    if contrib > Z_cut_ij: Z_cut_ij = contrib
+        Z_cut_i[j] = Z_cut_ij
+
+        # Z_BP
+        Z_BP_ij = 0.0
+        for base_pair_type in self.possible_base_pair_types[i][j]:
+            Z_BPq = self.Z_BPq[base_pair_type]
+            Z_BPq_ij = 0.0
+            ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+            (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
+            if ligated[i] and ligated[(j-1)%N]:
+                contrib = (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) * scale2
+                if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+                for base_pair_type2 in self.possible_base_pair_types[(i+1)%N][(j-1)%N]:
+                    Z_BPq2 = self.Z_BPq[base_pair_type2]
+                    contrib = (1.0/Kdq ) * C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] * scale2
+                    if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+            possible_motif_types = self.possible_motif_types[i][j]
+            for motif_type in possible_motif_types[base_pair_type]:
+                match_base_pair_type_set = possible_motif_types[base_pair_type][ motif_type ]
+                if len(motif_type.strands) == 1: # hairpins (1-way junctions)
+                    contrib = (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1)
+                    if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+                    pass
+                elif len(motif_type.strands) == 2: # internal loops (2-way junctions)
+                    for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
+                        Z_BPq_next = self.Z_BPq[base_pair_type_next]
+                        contrib = (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] * scale**( offset - (j_next - i_next) % N )
+                        if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+            contrib = (C_std/Kdq) * Z_cut_ij
+            if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+            if K_coax > 0.0:
+                if ligated[i] and ligated[(j-1)%N]:
+                    for k in range( i+2, i+offset-1 ):
+                        if ligated[k%N]:
+                            contrib = Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                            if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+                    for k in range( i+2, i+offset-1 ):
+                        if ligated[(k-1)%N]:
+                            contrib = C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                            if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+                if ligated[i]:
+                    for k in range( i+2, i+offset ):
+                        contrib = Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j] * C_std * K_coax / Kdq
+                        if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+                if ligated[(j-1)%N]:
+                    for k in range( i, i+offset-1 ):
+                        contrib = Z_cut_i[k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq
+                        if contrib > Z_BPq_ij: Z_BPq_ij = contrib
+            Z_BPq.set_val( i, j, Z_BPq_ij )
+            contrib = Z_BPq_ij
+            if contrib > Z_BP_ij: Z_BP_ij = contrib
+        Z_BP_i[j] = Z_BP_ij
+
+        # Z_coax
+        Z_coax_ij = 0.0
+        if not ( (offset == N-1) and ligated[j] ):
+            if K_coax > 0:
+                for k in range( i+1, i+offset-1 ):
+                    if ligated[k%N]:
+                        if Z_BP_i[k%N] == 0.0: continue
+                        if Z_BP.Q[(k+1)%N][j] == 0.0: continue
+                        contrib = Z_BP_i[k%N] * Z_BP.Q[(k+1)%N][j] * K_coax
+                        if contrib > Z_coax_ij: Z_coax_ij = contrib
+        Z_coax_i[j] = Z_coax_ij
+
+        # C_eff_basic
+        C_eff_basic_ij = 0.0
+        allow_loop_extension = not ( in_forced_base_pair and in_forced_base_pair[j] )
+        if ligated[(j-1)%N] and allow_loop_extension:
+            contrib = C_eff_i[(j-1)%N] * l * scale
+            if contrib > C_eff_basic_ij: C_eff_basic_ij = contrib
+        exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j]
+        C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]:
+                contrib = C_eff_for_BP.Q[i][(k-1)%N] * l * Z_BP.Q[k%N][j] * l_BP
+                if contrib > C_eff_basic_ij: C_eff_basic_ij = contrib
+        if K_coax > 0:
+            C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
+            for k in range( i+1, i+offset):
+                if ligated[(k-1)%N]:
+                    contrib = C_eff_for_coax.Q[i][(k-1)%N] * Z_coax.Q[k%N][j] * l * l_coax
+                    if contrib > C_eff_basic_ij: C_eff_basic_ij = contrib
+        C_eff_basic_i[j] = C_eff_basic_ij
+
+        # C_eff_no_BP_singlet
+        C_eff_no_BP_singlet_ij = 0.0
+        if K_coax > 0.0:
+            contrib = C_eff_basic_ij
+            if contrib > C_eff_no_BP_singlet_ij: C_eff_no_BP_singlet_ij = contrib
+            contrib = C_init * Z_coax_ij * l_coax
+            if contrib > C_eff_no_BP_singlet_ij: C_eff_no_BP_singlet_ij = contrib
+        C_eff_no_BP_singlet_i[j] = C_eff_no_BP_singlet_ij
+
+        # C_eff_no_coax_singlet
+        C_eff_no_coax_singlet_ij = 0.0
+        contrib = C_eff_basic_ij
+        if contrib > C_eff_no_coax_singlet_ij: C_eff_no_coax_singlet_ij = contrib
+        contrib = C_init * Z_BP_ij * l_BP
+        if contrib > C_eff_no_coax_singlet_ij: C_eff_no_coax_singlet_ij = contrib
+        C_eff_no_coax_singlet_i[j] = C_eff_no_coax_singlet_ij
+
+        # C_eff
+        C_eff_ij = 0.0
+        contrib = C_eff_basic_ij
+        if contrib > C_eff_ij: C_eff_ij = contrib
+        contrib = C_init * Z_BP_ij * l_BP
+        if contrib > C_eff_ij: C_eff_ij = contrib
+        if K_coax > 0.0:
+            contrib = C_init * Z_coax_ij * l_coax
+            if contrib > C_eff_ij: C_eff_ij = contrib
+        C_eff_i[j] = C_eff_ij
+
+        # Z_linear
+        Z_linear_ij = 0.0
+        allow_loop_extension = ( not in_forced_base_pair ) or ( not in_forced_base_pair[j] )
+        if ligated[(j-1)%N] and allow_loop_extension:
+            contrib = Z_linear_i[(j-1)%N] * scale
+            if contrib > Z_linear_ij: Z_linear_ij = contrib
+        contrib = Z_BP_ij
+        if contrib > Z_linear_ij: Z_linear_ij = contrib
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]:
+                contrib = Z_linear_i[(k-1)%N] * Z_BP.Q[k%N][j]
+                if contrib > Z_linear_ij: Z_linear_ij = contrib
+        if K_coax > 0.0:
+            contrib = Z_coax_ij
+            if contrib > Z_linear_ij: Z_linear_ij = contrib
+            for k in range( i+1, i+offset):
+                if ligated[(k-1)%N]:
+                    contrib = Z_linear_i[(k-1)%N] * Z_coax.Q[k%N][j]
+                    if contrib > Z_linear_ij: Z_linear_ij = contrib
+        Z_linear_i[j] = Z_linear_ij
+
@@ -0,0 +1,62 @@
+##################################################################################################
+# jit.py = fills dynamic programming matrices with kernels compiled by numba (engine = 'jit').
+#
+# Same layout as wavefront.py -- NumPy-backed matrices from array_dynamic_programming.py, Z_BPq for
+#  all base pair types in one T x N x N array, base pair types coded as integers by initialize_wavefront() --
+#  but each diagonal is filled by update_diagonal_jit(), compiled in nopython mode. That kernel is generated
+#  from recursions.py into jit_recursions.py by create_explicit_recursions.py -- do not edit it by hand.
+#
+# If numba is not installed, partition() falls back to engine = 'explicit', with a warning. The kernel is
+#  still valid Python, and runs (slowly) without numba if fill_jit() is called directly -- used for testing.
+##################################################################################################
+import numpy as np
+from zetafold.recursions.wavefront import initialize_wavefront
+from zetafold.recursions.jit_recursions import update_diagonal_jit
+from zetafold.util.scale_util import rescale_if_needed
+
+try:
+    from numba import njit
+    numba_available = True
+except ImportError:
+    numba_available = False
+    def njit( *args, **kwargs ):
+        return lambda f: f
+
+update_diagonal_kernel = njit( cache = True )( update_diagonal_jit )
+
+def fill_jit( self ):
+    '''
+    Do the dynamic programming, one diagonal at a time, with compiled kernel.
+    '''
+    initialize_wavefront( self )
+    N = self.N
+    T = len( self.base_pair_types )
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ) = self.params.get_variables()
+    ligated = np.array( [ bool( self.ligated[n] ) for n in range( N ) ] )
+    in_forced_base_pair = ( self.allow_extension_array == 0.0 )
+    Z = [ self.Z_cut.Q, self.Z_BP.Q, self.Z_coax.Q, self.C_eff_basic.Q, self.C_eff_no_BP_singlet.Q, self.C_eff_no_coax_singlet.Q, self.C_eff.Q, self.Z_linear.Q ]
+    motifs = get_motifs_by_offset( self )
+    for offset in range( 1, N ):
+        num_cells = N if self.calc_all_elements else N - offset
+        ( motif_key, motif_C_eff, motif_t_next, motif_i_next, motif_j_next ) = motifs[ offset ]
+        motif_start = np.searchsorted( motif_key, np.arange( T*N + 1 ) )
+        update_diagonal_kernel( offset, num_cells, N, self.scale, C_init, l, l_BP, K_coax, l_coax, C_std, bool( allow_strained_3WJ ),
+                                ligated, in_forced_base_pair, Z[0], Z[1], Z[2], Z[3], Z[4], Z[5], Z[6], Z[7],
+                                self.Z_BPq_array, self.possible_mask, self.Kd_array, self.C_eff_stack_array,
+                                motif_start, motif_C_eff, motif_t_next, motif_i_next, motif_j_next )
+        rescale_if_needed( self, offset )
+
+def get_motifs_by_offset( self ):
+    '''
+    For each offset, motifs closed by base pair type t at (i, i+offset), sorted by key t*N+i, as arrays
+      ( key, C_eff, t_next, i_next, j_next ), with next base pair for internal loops (all -1 for hairpins).
+    '''
+    from zetafold.partition import get_possible_motif_arrays, split_by_offset
+    N = self.N
+    ( t, i, j, m, t_next, i_next, j_next ) = get_possible_motif_arrays( self )
+    C_eff = np.array( [ motif_type.C_eff for motif_type in self.params.motif_types ] )
+    motifs = []
+    for X in split_by_offset( np.array( [ t*N + i, m, t_next, i_next, j_next ], dtype = np.int64 ).T, ( j - i ) % N, N ):
+        X = X[ np.argsort( X[:,0], kind = 'mergesort' ) ]
+        motifs.append( ( X[:,0].copy(), C_eff[ X[:,1] ], X[:,2].copy(), X[:,3].copy(), X[:,4].copy() ) )
+    return motifs
@@ -0,0 +1,125 @@
+##################################################################################################
+# jit_recursions.py = generated by create_explicit_recursions.py from recursions.py.
+#
+# update_diagonal_jit() is the fused kernel update_diagonal() of explicit_recursions.py, rewritten to only
+#  take arrays and numbers, so that numba can compile it -- see jit.py.
+##################################################################################################
+def update_diagonal_jit( offset, num_cells, N, scale, C_init, l, l_BP, K_coax, l_coax, C_std, allow_strained_3WJ, ligated,
+                        in_forced_base_pair, Z_cut, Z_BP, Z_coax, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet,
+                        C_eff, Z_linear, Z_BPq, possible_mask, Kd, C_eff_stack, motif_start, motif_C_eff, motif_t_next,
+                        motif_i_next, motif_j_next ):
+    '''
+    update_diagonal() of explicit_recursions.py, with matrices as N x N arrays and Z_BPq as a T x N x N array.
+    Motifs closed by base pair type t at (i, (i+offset)%N) are motif = motif_start[t*N+i] ... motif_start[t*N+i+1]-1.
+    '''
+    T = Z_BPq.shape[0]
+    scale2 = scale**2
+    for i in range( num_cells ):
+        j = ( i + offset ) % N
+        ( Z_cut_i, Z_BP_i, Z_coax_i, C_eff_basic_i, C_eff_no_BP_singlet_i, C_eff_no_coax_singlet_i, C_eff_i, Z_linear_i ) = ( Z_cut[i], Z_BP[i], Z_coax[i], C_eff_basic[i], C_eff_no_BP_singlet[i], C_eff_no_coax_singlet[i], C_eff[i], Z_linear[i] )
+
+        # Z_cut
+        Z_cut_ij = 0.0
+        for c in range( i, i+offset ):
+            if not ligated[c%N]:
+                if c == i and (c+1)%N == j:                                 Z_cut_ij += scale2
+                if c == i and (c+1)%N != j and ligated[(j-1)%N]:                Z_cut_ij += Z_linear[(c+1)%N,(j-1)%N] * scale2
+                if c != i and (c+1)%N == j and ligated[i]:                  Z_cut_ij += Z_linear[(i+1)%N,c%N] * scale2
+                if c != i and (c+1)%N != j and ligated[i] and ligated[(j-1)%N]: Z_cut_ij += Z_linear[(i+1)%N,c%N] * Z_linear[(c+1)%N,(j-1)%N] * scale2
+        Z_cut_i[j] = Z_cut_ij
+
+        # Z_BP
+        Z_BP_ij = 0.0
+        for base_pair_type in range( T ):
+            if not possible_mask[base_pair_type,i,j]: continue
+            Z_BPq_ij = 0.0
+            ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+            Kdq = Kd[base_pair_type]
+            if ligated[i] and ligated[(j-1)%N]:
+                Z_BPq_ij += (1.0/Kdq ) * ( C_eff_for_BP[(i+1)%N,(j-1)%N] * l * l * l_BP) * scale2
+                for base_pair_type2 in range( T ):
+                    if not possible_mask[base_pair_type2,(i+1)%N,(j-1)%N]: continue
+                    Z_BPq_ij += (1.0/Kdq ) * C_eff_stack[base_pair_type,base_pair_type2] * Z_BPq[base_pair_type2,(i+1)%N,(j-1)%N] * scale2
+            for motif in range( motif_start[base_pair_type*N+i], motif_start[base_pair_type*N+i+1] ):
+                if motif_t_next[motif] < 0: # hairpins (1-way junctions)
+                    Z_BPq_ij += (1.0/Kdq ) * motif_C_eff[motif] * scale**(offset+1)
+                    pass
+                elif motif_t_next[motif] >= 0: # internal loops (2-way junctions)
+                    ( base_pair_type_next, i_next, j_next ) = ( motif_t_next[motif], motif_i_next[motif], motif_j_next[motif] )
+                    Z_BPq_ij += (1.0/Kdq ) * motif_C_eff[motif] * Z_BPq[base_pair_type_next,(i_next)%N,(j_next)%N] * scale**( offset - (j_next - i_next) % N )
+            Z_BPq_ij += (C_std/Kdq) * Z_cut_ij
+            if K_coax > 0.0:
+                if ligated[i] and ligated[(j-1)%N]:
+                    for k in range( i+2, i+offset-1 ):
+                        if ligated[k%N]: Z_BPq_ij += Z_BP[(i+1)%N,k%N] * C_eff_for_coax[(k+1)%N,(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                    for k in range( i+2, i+offset-1 ):
+                        if ligated[(k-1)%N]: Z_BPq_ij += C_eff_for_coax[(i+1)%N,(k-1)%N] * Z_BP[k%N,(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                if ligated[i]:
+                    for k in range( i+2, i+offset ):
+                        Z_BPq_ij += Z_BP[(i+1)%N,k%N] * Z_cut[k%N,j] * C_std * K_coax / Kdq
+                if ligated[(j-1)%N]:
+                    for k in range( i, i+offset-1 ):
+                        Z_BPq_ij += Z_cut_i[k%N] * Z_BP[k%N,(j-1)%N] * C_std * K_coax / Kdq
+            Z_BPq[base_pair_type,i,j] = Z_BPq_ij
+            Z_BP_ij += Z_BPq_ij
+        Z_BP_i[j] = Z_BP_ij
+
+        # Z_coax
+        Z_coax_ij = 0.0
+        if not ( (offset == N-1) and ligated[j] ):
+            if K_coax > 0:
+                for k in range( i+1, i+offset-1 ):
+                    if ligated[k%N]:
+                        if Z_BP_i[k%N] == 0.0: continue
+                        if Z_BP[(k+1)%N,j] == 0.0: continue
+                        Z_coax_ij += Z_BP_i[k%N] * Z_BP[(k+1)%N,j] * K_coax
+        Z_coax_i[j] = Z_coax_ij
+
+        # C_eff_basic
+        C_eff_basic_ij = 0.0
+        allow_loop_extension = not ( in_forced_base_pair[j] )
+        if ligated[(j-1)%N] and allow_loop_extension: C_eff_basic_ij += C_eff_i[(j-1)%N] * l * scale
+        exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j]
+        C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]: C_eff_basic_ij += C_eff_for_BP[i,(k-1)%N] * l * Z_BP[k%N,j] * l_BP
+        if K_coax > 0:
+            C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
+            for k in range( i+1, i+offset):
+                if ligated[(k-1)%N]: C_eff_basic_ij += C_eff_for_coax[i,(k-1)%N] * Z_coax[k%N,j] * l * l_coax
+        C_eff_basic_i[j] = C_eff_basic_ij
+
+        # C_eff_no_BP_singlet
+        C_eff_no_BP_singlet_ij = 0.0
+        if K_coax > 0.0:
+            C_eff_no_BP_singlet_ij += C_eff_basic_ij
+            C_eff_no_BP_singlet_ij += C_init * Z_coax_ij * l_coax
+        C_eff_no_BP_singlet_i[j] = C_eff_no_BP_singlet_ij
+
+        # C_eff_no_coax_singlet
+        C_eff_no_coax_singlet_ij = 0.0
+        C_eff_no_coax_singlet_ij += C_eff_basic_ij
+        C_eff_no_coax_singlet_ij += C_init * Z_BP_ij * l_BP
+        C_eff_no_coax_singlet_i[j] = C_eff_no_coax_singlet_ij
+
+        # C_eff
+        C_eff_ij = 0.0
+        C_eff_ij += C_eff_basic_ij
+        C_eff_ij += C_init * Z_BP_ij * l_BP
+        if K_coax > 0.0:
+            C_eff_ij += C_init * Z_coax_ij * l_coax
+        C_eff_i[j] = C_eff_ij
+
+        # Z_linear
+        Z_linear_ij = 0.0
+        allow_loop_extension = ( not in_forced_base_pair[j] )
+        if ligated[(j-1)%N] and allow_loop_extension: Z_linear_ij += Z_linear_i[(j-1)%N] * scale
+        Z_linear_ij += Z_BP_ij
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]: Z_linear_ij += Z_linear_i[(k-1)%N] * Z_BP[k%N,j]
+        if K_coax > 0.0:
+            Z_linear_ij += Z_coax_ij
+            for k in range( i+1, i+offset):
+                if ligated[(k-1)%N]: Z_linear_ij += Z_linear_i[(k-1)%N] * Z_coax[k%N,j]
+        Z_linear_i[j] = Z_linear_ij
+
@@ -0,0 +1,513 @@
+##################################################################################################
+# outside.py = base pair probabilities and derivatives d(log Z)/d(log parameter) for a linear RNA
+#  (or set of strands) from the inside elements (i,j) with i < j, without the wrap-around elements.
+#
+# The outside value of an element, e.g. Z_BPq_outside(i,j) = d Z_final(0) / d Z_BPq(i,j), sums over
+#  everything outside the fragment i..j. Outside values are filled one diagonal at a time, from the
+#  longest fragment down, by running each recursion in explicit_recursions.py backwards (wavefront.py
+#  runs the same recursions forwards). Then
+#
+#     bpp(i,j) = sum over base pair types q of  Z_BPq(i,j) * Z_BPq_outside(i,j) / Z_final(0)
+#
+#  and, in general, (outside value) x (term of a recursion) / Z_final(0) is the expected number of
+#  times that term shows up -- summed over terms holding a parameter, this gives d(log Z)/d(log parameter).
+#  Those sums are collected in outside_counts_vectorized, and checked against the outside_counts from
+#  fill_outside_recursions() below in --deriv_check.
+#
+# Derivatives always come from fill_outside_recursions(), which runs the outside recursions generated from
+#  recursions.py -- for linear RNAs over the elements with i < j, and for circles over all N^2 elements
+#  (calc_all_elements). The vectorized pass is written by hand -- if you edit recursions.py, make the same
+#  change here, and update RECURSIONS_CHECKSUM.
+#
+# With max_bp_span = W, matrices are stored as bands (banded_dynamic_programming.py), and so are the outside
+#  values. Both passes then visit only the band, plus the exterior loop Z_linear(0,j) beyond it, and take
+#  O(N W^2) time and O(N W) memory, like the inside fill in banded.py.
+##################################################################################################
+import numpy as np
+from collections import defaultdict
+from zetafold.recursions.banded_dynamic_programming import BandedArray
+
+# checksum of recursions.py that this file matches -- see checksum.py
+RECURSIONS_CHECKSUM = 'fbb60b6b9b15fb81d6a1c7acd0f3b8c7'
+
+def get_array( Z ):
+    '''
+    N x N ndarray with values of dynamic programming matrix Z (lists of lists, ndarray, sparse rows, or
+     DynamicProgrammingData objects for simple recursions) -- a copy, except for ndarray storage.
+    '''
+    if hasattr( Z, 'row' ):
+        X = np.zeros( (Z.N, Z.N) )
+        for i in range( Z.N ):
+            for (j,val) in Z.row( i ): X[i,j] = val
+        return X
+    if not hasattr( Z, 'Q' ): return np.array( [ [ Z.val(i,j) for j in range( Z.N ) ] for i in range( Z.N ) ] )
+    return np.asarray( Z.Q, dtype = np.float64 )
+
+def get_storage_array( Z ):
+    '''
+    N x N ndarray holding the values of dense dynamic programming matrix Z, without keeping a copy --
+     lists of lists (explicit_dynamic_programming.py) are replaced by an ndarray in Z.Q, and Z.Q[i][j] still works.
+    Banded storage is returned as is -- BandedArray takes the same Q[ I, J ] indexing.
+    '''
+    if not isinstance( Z.Q, ( np.ndarray, BandedArray ) ): Z.Q = np.array( Z.Q, dtype = np.float64 )
+    return Z.Q
+
+def get_zeros_like( X ):
+    if isinstance( X, BandedArray ): return BandedArray( X.N, X.width, full_first_row = ( X.first_row is not None ) )
+    return np.zeros( X.shape )
+
+def get_diagonal( X ):
+    if isinstance( X, BandedArray ): return X.band[ :, 0 ]
+    return np.diag( X )
+
+def get_candidate_values( Z, candidates ):
+    '''
+    Values of Z_BPq at candidates = ( I, J ) from possible_base_pair_indices -- sparse storage holds them in that order.
+    '''
+    if hasattr( Z, 'get_values' ): return Z.get_values()
+    return get_storage_array( Z )[ candidates ]
+
+def initialize_outside( self ):
+    '''
+    Inside values and information that does not change during the outside pass:
+      inside_arrays  = ( Z_cut, Z_BPq, Z_BP, Z_coax, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear ),
+                         the storage of the dynamic programming matrices as N x N ndarrays, except for Z_BPq,
+                         which has one value for each candidate base pair c (all base pair types together)
+      base_pair_candidates = ( t, i, j ), arrays with base_pair_types[t] at (i,j) for each candidate c, from possible_base_pair_indices
+      diagonal_candidates  = for each offset, candidates c with j - i = offset
+      loop_motifs          = for each offset, arrays (c, m, c_next) for motifs m closed by candidate c, with next
+                              base pair c_next for internal loops, or c_next = -1 for hairpins
+    '''
+    from zetafold.partition import split_by_offset
+    N = self.N
+    base_pair_types = self.base_pair_types
+    T = len( base_pair_types )
+
+    candidates = [ self.possible_base_pair_indices[ base_pair_type ] for base_pair_type in base_pair_types ]
+    Z_BPq = np.concatenate( [ get_candidate_values( self.Z_BPq[ base_pair_type ], candidates[t] ) for (t,base_pair_type) in enumerate( base_pair_types ) ] )
+    self.inside_arrays = ( get_storage_array( self.Z_cut ), Z_BPq, get_storage_array( self.Z_BP ), get_storage_array( self.Z_coax ), get_storage_array( self.C_eff_basic ),
+                           get_storage_array( self.C_eff_no_BP_singlet ), get_storage_array( self.C_eff_no_coax_singlet ), get_storage_array( self.C_eff ), get_storage_array( self.Z_linear ) )
+
+    ( I, J ) = [ np.concatenate( [ candidate[n] for candidate in candidates ] ) for n in range( 2 ) ]
+    self.base_pair_candidates = ( np.repeat( np.arange( T ), [ len( candidate[0] ) for candidate in candidates ] ), I, J )
+    c = np.nonzero( I < J )[0]
+    self.diagonal_candidates = split_by_offset( c, J[ c ] - I[ c ], N )
+
+    # candidates are numbered by base pair type, then as in possible_base_pair_indices
+    first = np.cumsum( [ 0 ] + [ len( candidate[0] ) for candidate in candidates ] ).astype( np.int32 )
+    motifs = [ self.possible_motif_indices[ base_pair_type ] for base_pair_type in base_pair_types ]
+    c      = np.concatenate( [ K + first[t] for (t,(K, M, T_next, K_next)) in enumerate( motifs ) ] )
+    m      = np.concatenate( [ M for (K, M, T_next, K_next) in motifs ] )
+    c_next = np.concatenate( [ np.where( T_next < 0, -1, K_next + first[ T_next ] ) for (K, M, T_next, K_next) in motifs ] )
+    keep = ( I[ c ] < J[ c ] )
+    self.loop_motifs = split_by_offset( np.array( [ c[ keep ], m[ keep ], c_next[ keep ] ], dtype = np.int32 ).T, ( J - I )[ c[ keep ] ], N )
+    self.motif_C_eff_array = np.array( [ motif_type.C_eff for motif_type in self.params.motif_types ] )
+
+    self.C_eff_stack_array = np.array( [ [ self.params.C_eff_stack[bpt1][bpt2] for bpt2 in base_pair_types ] for bpt1 in base_pair_types ] ).reshape( T, T )
+    self.Kd_array = np.array( [ base_pair_type.Kd for base_pair_type in base_pair_types ] )
+    self.ligated_array = np.array( [ float(self.ligated[n]) for n in range(N) ] )
+    self.allow_extension_array = np.ones( N )
+    if self.in_forced_base_pair:
+        for n in range( N ):
+            if self.in_forced_base_pair[n]: self.allow_extension_array[n] = 0.0
+
+def fill_outside( self ):
+    '''
+    Outside pass, after the inside fill. Fills in
+      outside_arrays  = same layout as inside_arrays, with d Z_final(0)/ d (element)
+      outside_counts_vectorized = expected number of factors of each parameter, i.e., d(log Z)/d(log parameter),
+                         from the hand-derived terms below, and used as a check of fill_outside_recursions():
+                         'l', 'l_BP', 'C_init', 'K_coax', 'l_coax'  (numbers)
+                         'base_pair_type' (length T array, number of base pairs (i,j), i < j, of each type)
+                         'stacked_pair'   (T x T array, number of stacked pairs of each type, outer pair first)
+                         'motif_type'     (one number per motif type in params.motif_types, as seen from outer pair)
+    '''
+    assert( not self.circle )
+    initialize_outside( self )
+    N = self.N
+    T = len( self.base_pair_types )
+    self.outside_arrays = tuple( get_zeros_like( X ) for X in self.inside_arrays )
+    self.outside_counts_vectorized = { 'l':0.0, 'l_BP':0.0, 'C_init':0.0, 'K_coax':0.0, 'l_coax':0.0,
+                                       'base_pair_type':np.zeros( T ), 'stacked_pair':np.zeros( (T,T) ), 'motif_type':np.zeros( len( self.params.motif_types ) ) }
+
+    # Z_final(0) = Z_linear(0,N-1), since there is a cutpoint at the end of a linear RNA.
+    Z_linear_outside = self.outside_arrays[ -1 ]
+    Z_linear_outside[ 0, N-1 ] = 1.0
+    for offset in range( N-1, 0, -1 ):
+        if self.banded and offset > self.max_bp_span:
+            update_outside_exterior( self, offset )
+        else:
+            update_outside_diagonal( self, offset )
+
+    # loops with no nucleotides (C_eff(i,i) = C_init)
+    for (X, X_outside) in zip( self.inside_arrays[4:8], self.outside_arrays[4:8] ):
+        self.outside_counts_vectorized[ 'C_init' ] += np.dot( get_diagonal( X ), get_diagonal( X_outside ) )
+
+    Z = self.Z_final.val( 0 )
+    for tag in self.outside_counts_vectorized: self.outside_counts_vectorized[ tag ] /= Z
+
+def update_outside_diagonal( self, offset ):
+    '''
+    Outside values at (i, i+offset) for every i are complete -- pass them back to the elements
+     that went into each recursion, in the reverse order of Z_all.
+    For each term, 'weight' is (outside value) x (all factors in the term except the element getting the update),
+     and sums of weight x element give counts of parameters.
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ ) = self.params.get_variables()
+    ( Z_cut, Z_BPq, Z_BP, Z_coax, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear ) = self.inside_arrays
+    ( Z_cut_out, Z_BPq_out, Z_BP_out, Z_coax_out, C_eff_basic_out, C_eff_no_BP_singlet_out, C_eff_no_coax_singlet_out, C_eff_out, Z_linear_out ) = self.outside_arrays
+    counts = self.outside_counts_vectorized
+    N = self.N
+    T = len( self.base_pair_types )
+    d = offset
+    n = N - d
+    I = np.arange( n )
+    J = I + d
+    lig = self.ligated_array
+    lig_i, lig_jm1 = lig[ I ], lig[ J-1 ]
+    closes_loop = lig_i * lig_jm1
+    allow_loop_extension = self.allow_extension_array[ J ]
+    scale  = self.scale
+    scale2 = scale**2
+
+    ##############################
+    # Z_linear
+    out = Z_linear_out[ I, J ]
+    weight = out * lig_jm1 * allow_loop_extension * scale
+    Z_linear_out[ I, J-1 ] += weight
+    Z_BP_out[ I, J ] += out
+    if K_coax > 0.0: Z_coax_out[ I, J ] += out
+    if d >= 2:
+        A = np.arange( 1, d )[:,None] # k = i + a
+        weight = out * lig[ I+A-1 ]
+        Z_linear_out[ I, I+A-1 ] += weight * Z_BP[ I+A, J ]
+        Z_BP_out[ I+A, J ]       += weight * Z_linear[ I, I+A-1 ]
+        if K_coax > 0.0:
+            Z_linear_out[ I, I+A-1 ] += weight * Z_coax[ I+A, J ]
+            Z_coax_out[ I+A, J ]     += weight * Z_linear[ I, I+A-1 ]
+
+    ##############################
+    # C_eff, C_eff_no_coax_singlet, C_eff_no_BP_singlet
+    for ( out, singlets ) in [ ( C_eff_out[ I, J ], True ), ( C_eff_no_coax_singlet_out[ I, J ], False ) ]:
+        C_eff_basic_out[ I, J ] += out
+        Z_BP_out[ I, J ] += out * C_init * l_BP
+        count = np.dot( out, Z_BP[ I, J ] ) * C_init * l_BP
+        counts[ 'C_init' ] += count
+        counts[ 'l_BP' ]   += count
+        if singlets and K_coax > 0.0:
+            Z_coax_out[ I, J ] += out * C_init * l_coax
+            count = np.dot( out, Z_coax[ I, J ] ) * C_init * l_coax
+            counts[ 'C_init' ] += count
+            counts[ 'l_coax' ] += count
+    if K_coax > 0.0:
+        out = C_eff_no_BP_singlet_out[ I, J ]
+        C_eff_basic_out[ I, J ] += out
+        Z_coax_out[ I, J ] += out * C_init * l_coax
+        count = np.dot( out, Z_coax[ I, J ] ) * C_init * l_coax
+        counts[ 'C_init' ] += count
+        counts[ 'l_coax' ] += count
+
+    ##############################
+    # C_eff_basic
+    out = C_eff_basic_out[ I, J ]
+    weight = out * lig_jm1 * allow_loop_extension * l * scale
+    C_eff_out[ I, J-1 ] += weight
+    counts[ 'l' ] += np.dot( weight, C_eff[ I, J-1 ] )
+    if d >= 2:
+        A = np.arange( 1, d )[:,None] # k = i + a
+        weight = out * lig[ I+A-1 ] * l * l_BP
+        C_eff_out[ I, I+A-1 ] += weight * Z_BP[ I+A, J ]
+        Z_BP_out[ I+A, J ]    += weight * C_eff[ I, I+A-1 ]
+        count = ( weight * C_eff[ I, I+A-1 ] * Z_BP[ I+A, J ] ).sum()
+        counts[ 'l' ]    += count
+        counts[ 'l_BP' ] += count
+        if K_coax > 0.0:
+            weight = out * lig[ I+A-1 ] * l * l_coax
+            C_eff_out[ I, I+A-1 ] += weight * Z_coax[ I+A, J ]
+            Z_coax_out[ I+A, J ]  += weight * C_eff[ I, I+A-1 ]
+            count = ( weight * C_eff[ I, I+A-1 ] * Z_coax[ I+A, J ] ).sum()
+            counts[ 'l' ]      += count
+            counts[ 'l_coax' ] += count
+
+    ##############################
+    # Z_coax
+    if K_coax > 0.0 and d >= 3:
+        A = np.arange( 1, d-1 )[:,None] # k = i + a
+        weight = Z_coax_out[ I, J ] * lig[ I+A ] * K_coax
+        Z_BP_out[ I, I+A ]     += weight * Z_BP[ I+A+1, J ]
+        Z_BP_out[ I+A+1, J ]   += weight * Z_BP[ I, I+A ]
+        counts[ 'K_coax' ] += ( weight * Z_BP[ I, I+A ] * Z_BP[ I+A+1, J ] ).sum()
+
+    ##############################
+    # Z_BP
+    ( t_c, i_c, j_c ) = self.base_pair_candidates
+    c = self.diagonal_candidates[ d ]
+    ( t, i ) = ( t_c[ c ], i_c[ c ] )
+    Z_BPq_out[ c ] += Z_BP_out[ i, i+d ]
+
+    ##############################
+    # Z_BPq -- all terms have a factor of 1/Kdq; those that do not depend on base pair type are summed over types.
+    out = Z_BPq_out[ c ]
+    counts[ 'base_pair_type' ] += np.bincount( t, weights = out * Z_BPq[ c ], minlength = T )
+    out_q = np.zeros( (T,n) )
+    out_q[ t, i ] = out / self.Kd_array[ t ]
+    out = out_q.sum( axis = 0 )
+    ( C_eff_for_coax, C_eff_for_BP ) = ( C_eff, C_eff ) if allow_strained_3WJ else ( C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+    ( C_eff_for_coax_out, C_eff_for_BP_out ) = ( C_eff_out, C_eff_out ) if allow_strained_3WJ else ( C_eff_no_BP_singlet_out, C_eff_no_coax_singlet_out )
+
+    if d >= 2:
+        # base pair closes a loop
+        weight = out * closes_loop * l * l * l_BP * scale2
+        C_eff_for_BP_out[ I+1, J-1 ] += weight
+        count = np.dot( weight, C_eff_for_BP[ I+1, J-1 ] )
+        counts[ 'l' ]    += 2 * count
+        counts[ 'l_BP' ] += count
+
+        # base pair forms a stacked pair with previous pair -- inner pair (i+1,j-1) is candidate c2
+        weight_q = out_q * closes_loop * scale2
+        c2 = self.diagonal_candidates[ d-2 ]
+        c2 = c2[ ( i_c[ c2 ] >= 1 ) & ( i_c[ c2 ] <= n ) ]
+        ( t2, i2 ) = ( t_c[ c2 ], i_c[ c2 ] - 1 )
+        Z_BPq_out[ c2 ] += np.dot( self.C_eff_stack_array.T, weight_q )[ t2, i2 ]
+        Z_BPq_inner = np.zeros( (T,n) )
+        Z_BPq_inner[ t2, i2 ] = Z_BPq[ c2 ]
+        counts[ 'stacked_pair' ] += np.dot( weight_q, Z_BPq_inner.T ) * self.C_eff_stack_array
+
+    ( c, m, c_next ) = self.loop_motifs[ d ].T
+    hairpin = ( c_next < 0 )
+
+    # hairpins
+    ( c_hairpin, m_hairpin ) = ( c[ hairpin ], m[ hairpin ] )
+    weight = out_q[ t_c[ c_hairpin ], i_c[ c_hairpin ] ] * self.motif_C_eff_array[ m_hairpin ] * scale**( d+1 )
+    counts[ 'motif_type' ] += np.bincount( m_hairpin, weights = weight, minlength = len( counts[ 'motif_type' ] ) )
+
+    # internal loops
+    ( c, m, c_next ) = ( c[ ~hairpin ], m[ ~hairpin ], c_next[ ~hairpin ] )
+    weight = out_q[ t_c[ c ], i_c[ c ] ] * self.motif_C_eff_array[ m ] * scale**( d - ( j_c[ c_next ] - i_c[ c_next ] ) )
+    np.add.at( Z_BPq_out, c_next, weight ) # several loops can share inner pair
+    counts[ 'motif_type' ] += np.bincount( m, weights = weight * Z_BPq[ c_next ], minlength = len( counts[ 'motif_type' ] ) )
+
+    # base pair brings together two strands that were previously disconnected
+    Z_cut_out[ I, J ] += out * C_std
+
+    if K_coax > 0.0:
+        if d >= 4:
+            A = np.arange( 2, d-1 )[:,None] # k = i + a
+            # coaxial stack of bp (i,j) and (i+1,k), and closes loop on right.
+            weight = out * closes_loop * lig[ I+A ] * l**2 * l_coax * K_coax * scale2
+            Z_BP_out[ I+1, I+A ]             += weight * C_eff_for_coax[ I+A+1, J-1 ]
+            C_eff_for_coax_out[ I+A+1, J-1 ] += weight * Z_BP[ I+1, I+A ]
+            count = ( weight * Z_BP[ I+1, I+A ] * C_eff_for_coax[ I+A+1, J-1 ] ).sum()
+            # coaxial stack of bp (i,j) and (k,j-1), and closes loop on left.
+            weight = out * closes_loop * lig[ I+A-1 ] * l**2 * l_coax * K_coax * scale2
+            C_eff_for_coax_out[ I+1, I+A-1 ] += weight * Z_BP[ I+A, J-1 ]
+            Z_BP_out[ I+A, J-1 ]             += weight * C_eff_for_coax[ I+1, I+A-1 ]
+            count += ( weight * C_eff_for_coax[ I+1, I+A-1 ] * Z_BP[ I+A, J-1 ] ).sum()
+            counts[ 'l' ]      += 2 * count
+            counts[ 'l_coax' ] += count
+            counts[ 'K_coax' ] += count
+
+        if d >= 3:
+            # "left stack" but no loop closed on right
+            A = np.arange( 2, d )[:,None]
+            weight = out * lig_i * C_std * K_coax
+            Z_BP_out[ I+1, I+A ] += weight * Z_cut[ I+A, J ]
+            Z_cut_out[ I+A, J ]  += weight * Z_BP[ I+1, I+A ]
+            counts[ 'K_coax' ] += ( weight * Z_BP[ I+1, I+A ] * Z_cut[ I+A, J ] ).sum()
+
+        if d >= 2:
+            # "right stack" but no loop closed on left
+            A = np.arange( 0, d-1 )[:,None]
+            weight = out * lig_jm1 * C_std * K_coax
+            Z_cut_out[ I, I+A ]  += weight * Z_BP[ I+A, J-1 ]
+            Z_BP_out[ I+A, J-1 ] += weight * Z_cut[ I, I+A ]
+            counts[ 'K_coax' ] += ( weight * Z_cut[ I, I+A ] * Z_BP[ I+A, J-1 ] ).sum()
+
+    ##############################
+    # Z_cut -- cutpoint c = i + a; strand 1 is i --> c, strand 2 is c+1 --> j
+    out = Z_cut_out[ I, J ]
+    A = np.arange( d )[:,None]
+    weight = out * ( 1.0 - lig[ I+A ] ) * scale2
+    Z_left  = np.where( A == 0,   1.0, lig_i   * Z_linear[ I+1, np.maximum( I+A, I+1 ) ] )
+    Z_right = np.where( A == d-1, 1.0, lig_jm1 * Z_linear[ np.minimum( I+A+1, J-1 ), J-1 ] )
+    if d >= 2:
+        Z_linear_out[ I+1, I+A[1:] ]      += ( weight * lig_i * Z_right )[1:]
+        Z_linear_out[ I+A[:-1]+1, J-1 ]   += ( weight * lig_jm1 * Z_left )[:-1]
+
+def update_outside_exterior( self, j ):
+    '''
+    Outside pass for offset j beyond the band (banded storage) -- the exterior loop Z_linear(0,j), and Z_coax(i,i+j),
+     which can span up to 2*max_bp_span+1. Same terms as update_outside_diagonal(), with sums over partners k
+     restricted to those that can pair (or coax-stack) with j, as in update_exterior() in banded.py.
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ ) = self.params.get_variables()
+    ( Z_cut, Z_BPq, Z_BP, Z_coax, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear ) = self.inside_arrays
+    ( Z_cut_out, Z_BPq_out, Z_BP_out, Z_coax_out, C_eff_basic_out, C_eff_no_BP_singlet_out, C_eff_no_coax_singlet_out, C_eff_out, Z_linear_out ) = self.outside_arrays
+    N = self.N
+    W = self.max_bp_span
+    lig = self.ligated_array
+
+    ##############################
+    # Z_linear(0,j) -- Z_BP(0,j) is beyond the band.
+    out = Z_linear_out.first_row[ j ]
+    Z_linear_out[ 0, j-1 ] += out * lig[ j-1 ] * self.allow_extension_array[ j ] * self.scale
+    K = np.arange( max( 1, j-W ), j ) # partner k of j
+    weight = out * lig[ K-1 ]
+    Z_linear_out[ 0, K-1 ] += weight * Z_BP[ K, j ]
+    Z_BP_out[ K, j ]       += weight * Z_linear[ 0, K-1 ]
+    if K_coax > 0.0:
+        Z_coax_out[ 0, j ] += out
+        K = np.arange( max( 1, j-Z_coax.width+1 ), j )
+        weight = out * lig[ K-1 ]
+        Z_linear_out[ 0, K-1 ] += weight * Z_coax[ K, j ]
+        Z_coax_out[ K, j ]     += weight * Z_linear[ 0, K-1 ]
+
+    ##############################
+    # Z_coax -- both pairs must fit in the band.
+    d = j
+    if K_coax > 0.0 and d < Z_coax.width:
+        I = np.arange( N - d )
+        J = I + d
+        A = np.arange( max( 1, d-1-W ), min( d-2, W ) + 1 )[:,None] # k = i + a
+        weight = Z_coax_out[ I, J ] * lig[ I+A ] * K_coax
+        Z_BP_out[ I, I+A ]     += weight * Z_BP[ I+A+1, J ]
+        Z_BP_out[ I+A+1, J ]   += weight * Z_BP[ I, I+A ]
+        self.outside_counts_vectorized[ 'K_coax' ] += ( weight * Z_BP[ I, I+A ] * Z_BP[ I+A+1, J ] ).sum()
+
+def get_bpp_outside( self ):
+    '''
+    N x N ndarray of base pair probabilities (symmetric)
+    '''
+    Z_BPq = self.inside_arrays[ 1 ]
+    Z_BPq_out = self.outside_arrays[ 1 ]
+    ( t, i, j ) = self.base_pair_candidates
+    bpp = np.zeros( (self.N, self.N) )
+    np.add.at( bpp, ( i, j ), Z_BPq * Z_BPq_out )
+    bpp /= self.Z_final.val( 0 )
+    return bpp + bpp.T
+
+def get_Z_final_outside( self ):
+    '''
+    Z_final(0) summed N-1 ways, after fill_outside() -- the cross-check for a linear RNA that takes the place of
+     comparing Z_final(i) for all i (which needs the wrap-around elements).
+    Every structure's chain Z_linear(0,N-1) --> ... --> Z_linear(0,k-1) --> ... steps across each position m
+     (0 <= m < N-1) exactly once, so Z_final(0) = sum over j > m of Z_linear_out(0,j) x (terms of Z_linear(0,j)
+     that leave no Z_linear(0,k-1) with k-1 > m).
+    '''
+    K_coax = self.params.K_coax
+    ( Z_BP, Z_coax, Z_linear ) = [ self.inside_arrays[ n ] for n in ( 2, 3, 8 ) ]
+    N = self.N
+    n = np.arange( N )
+    lig = self.ligated_array
+    out = self.outside_arrays[ -1 ][ 0, n ]
+    Z_linear_0 = Z_linear[ 0, n ]
+    def Z_end( i, j ): return Z_BP[ i, j ] + Z_coax[ i, j ] if K_coax > 0.0 else Z_BP[ i, j ]
+
+    # Z_linear(0,j) <-- Z_linear(0,j-1), steps across m = j-1
+    Z_final = out[ 1: ] * Z_linear_0[ :-1 ] * lig[ :-1 ] * self.allow_extension_array[ 1: ] * self.scale
+    # Z_linear(0,j) <-- Z_BP(0,j), Z_coax(0,j), steps across all m < j
+    Z_final += np.cumsum( ( out * Z_end( 0, n ) )[ ::-1 ] )[ ::-1 ][ 1: ]
+    # Z_linear(0,j) <-- Z_linear(0,k-1) x ( Z_BP(k,j) + Z_coax(k,j) ), 0 < k < j, steps across k-1 <= m < j --
+    #  each term goes into steps at k-1 and comes back out at j, so the running sum over m gives the terms across m.
+    max_offset = N
+    if isinstance( Z_BP, BandedArray ): max_offset = Z_coax.width if K_coax > 0.0 else Z_BP.width
+    steps = np.zeros( N )
+    for d in range( 1, max_offset ): # d = j - k
+        K = np.arange( 1, N-d )
+        term = lig[ K-1 ] * Z_linear_0[ K-1 ] * Z_end( K, K+d ) * out[ K+d ]
+        steps[ K-1 ] += term
+        steps[ K+d ] -= term
+    Z_final += np.cumsum( steps )[ :-1 ]
+    return Z_final
+
+##################################################################################################
+# Outside pass that gives the derivatives, for any engine -- circles need all N^2 elements (calc_all_elements).
+#  Runs the update_X_outside() functions generated from recursions.py (see create_explicit_recursions.py), so there
+#  are no hand-derived formulas to keep in sync. Slower than fill_outside() above, which is vectorized, but only O(N^3).
+##################################################################################################
+def get_storage( Z ):
+    '''
+    Inside values of Z indexed as Q[i][j] -- the storage of Z itself, except for simple recursions
+    '''
+    if hasattr( Z, 'Q' ): return Z.Q
+    return get_array( Z ).tolist()
+
+class OutsideMatrix:
+    '''
+    Inside values Q and outside values bar = d Z_final(0) / d Q, with the same indexing as DynamicProgrammingMatrix
+    '''
+    def __init__( self, Q, update_func = None ):
+        self.Q = Q
+        self.N = len( Q )
+        if isinstance( Q, BandedArray ): self.bar = get_zeros_like( Q )
+        else: self.bar = [ [ 0.0 ] * self.N for i in range( self.N ) ] if hasattr( Q[0], '__getitem__' ) else [ 0.0 ] * self.N
+        self.update_func = update_func
+
+    def val( self, i, j = None ):
+        if j == None: return self.Q[ i % self.N ]
+        return self.Q[ i % self.N ][ j % self.N ]
+
+    def update( self, partition, i, j = None ):
+        if j == None: self.update_func( partition, i )
+        else:         self.update_func( partition, i, j )
+
+class OutsidePartition:
+    '''
+    Stands in for Partition in the update_X_outside() functions -- same attributes, but dynamic programming
+     matrices are OutsideMatrix objects, and self.counts collects d(log Z)/d(log parameter).
+    '''
+    def __init__( self, partition, outside_funcs ):
+        self.partition = partition
+        self.Z_all = []
+        for Z in partition.Z_all:
+            name = Z.update_func.__name__[7:] # e.g., update_Z_BP --> Z_BP
+            X = OutsideMatrix( get_storage( Z ), outside_funcs[ 'update_%s_outside' % name ] )
+            setattr( self, name, X )
+            self.Z_all.append( X )
+        self.Z_BPq = {}
+        for base_pair_type in partition.base_pair_types:
+            update_func = lambda p, i, j, base_pair_type = base_pair_type: outside_funcs[ 'update_Z_BPq_outside' ]( p, i, j, base_pair_type )
+            self.Z_BPq[ base_pair_type ] = OutsideMatrix( get_storage( partition.Z_BPq[ base_pair_type ] ), update_func )
+        self.Z_final = OutsideMatrix( [ partition.Z_final.val( i ) for i in range( partition.N ) ], outside_funcs[ 'update_Z_final_outside' ] )
+        self.counts = defaultdict( float )
+
+    def __getattr__( self, name ):
+        # partition attributes do not change during the outside pass, so look each one up once
+        value = getattr( self.partition, name )
+        setattr( self, name, value )
+        return value
+
+def fill_outside_recursions( self ):
+    '''
+    Outside pass through the elements (i,j) with i < j, after the inside fill -- all N^2 elements
+     (calc_all_elements) are only needed for circles.
+    Fills in outside_counts, in the same format as outside_counts_vectorized from fill_outside().
+    '''
+    from zetafold.recursions import outside_recursions
+    assert( self.calc_all_elements or not self.circle )
+    outside_funcs = dict( (name, getattr( outside_recursions, name )) for name in dir( outside_recursions ) if name.endswith( '_outside' ) )
+    p = OutsidePartition( self, outside_funcs )
+    N = self.N
+
+    # d log Z_final(0) / d Z_final(0)
+    p.Z_final.bar[ 0 ] = 1.0 / p.Z_final.val( 0 )
+    p.Z_final.update( p, 0 )
+
+    # elements with i > j wrap around the circle, and are not used by Z_final(0).
+    # With banded storage, only the exterior loop Z_linear(0,j) can have outside values beyond the band.
+    width = N
+    if isinstance( p.Z_BP.Q, BandedArray ): width = p.Z_coax.Q.width if self.params.K_coax > 0.0 else p.Z_BP.Q.width
+    for offset in range( N-1, 0, -1 ):
+        for i in range( N - offset if offset < width else 1 ):
+            for Z in p.Z_all[::-1]: Z.update( p, i, i + offset )
+
+    # loops with no nucleotides (C_eff(i,i) = C_init)
+    for X in [ p.C_eff_basic, p.C_eff_no_BP_singlet, p.C_eff_no_coax_singlet, p.C_eff ]:
+        p.counts[ 'C_init' ] += sum( X.Q[i][i] * X.bar[i][i] for i in range( N ) )
+
+    base_pair_types = self.base_pair_types
+    motif_types = self.params.motif_types
+    self.outside_counts = dict( (tag, p.counts[ tag ]) for tag in [ 'l', 'l_BP', 'C_init', 'K_coax', 'l_coax', 'C_std' ] )
+    self.outside_counts[ 'base_pair_type' ] = np.array( [ -p.counts[ base_pair_type ] for base_pair_type in base_pair_types ] )
+    self.outside_counts[ 'stacked_pair' ]   = np.array( [ [ p.counts[ (bpt1,bpt2) ] for bpt2 in base_pair_types ] for bpt1 in base_pair_types ] )
+    self.outside_counts[ 'motif_type' ]     = np.array( [ p.counts[ motif_type ] for motif_type in motif_types ] )
@@ -0,0 +1,610 @@
+##################################################################################################
+# outside_recursions.py = generated by create_explicit_recursions.py from recursions.py.
+#
+# update_X_outside( self, i, j ) runs the loops of update_X, and passes the outside value X.bar(i,j) back
+#  to the elements in each term of X(i,j), adding up d(log Z)/d(log parameter) in self.counts.
+#  self is an OutsidePartition, with matrices that hold inside values Q and outside values bar -- see outside.py.
+##################################################################################################
+def update_Z_cut_outside( self, i, j ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if Z_cut.bar[i%N][j%N] == 0.0: return
+    offset = ( j - i ) % N
+    scale2 = self.scale**2 # i and j themselves are not in any subfragment
+    for c in range( i, i+offset ):
+        if not ligated[c%N]:
+            # strand 1  (i --> c), strand 2  (c+1 -- > j)
+            if c == i and (c+1)%N != j and ligated[(j-1)%N]:
+                count = Z_cut.bar[i%N][j%N] * Z_linear.Q[(c+1)%N][(j-1)%N] * scale2
+                if count > 0.0:
+                    Z_linear.bar[(c+1)%N][(j-1)%N] += count / Z_linear.Q[(c+1)%N][(j-1)%N]
+            if c != i and (c+1)%N == j and ligated[i%N]:
+                count = Z_cut.bar[i%N][j%N] * Z_linear.Q[(i+1)%N][c%N] * scale2
+                if count > 0.0:
+                    Z_linear.bar[(i+1)%N][c%N] += count / Z_linear.Q[(i+1)%N][c%N]
+            if c != i and (c+1)%N != j and ligated[i%N] and ligated[(j-1)%N]:
+                count = Z_cut.bar[i%N][j%N] * Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] * scale2
+                if count > 0.0:
+                    Z_linear.bar[(i+1)%N][c%N] += count / Z_linear.Q[(i+1)%N][c%N]
+                    Z_linear.bar[(c+1)%N][(j-1)%N] += count / Z_linear.Q[(c+1)%N][(j-1)%N]
+
+##################################################################################################
+def update_Z_BPq_outside( self, i, j, base_pair_type ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    offset = ( j - i ) % N
+
+    ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+
+    (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
+    if Z_BPq.bar[i%N][j%N] == 0.0: return
+
+    # nucleotides not covered by subfragments each need a factor of scale -- see scale_util.py
+    scale  = self.scale
+    scale2 = scale**2
+
+    if ligated[i%N] and ligated[(j-1)%N]:
+        # base pair closes a loop
+        #
+        #    ~~~~~~
+        #   ~      ~
+        # i+1      j-1
+        #   \       /
+        #    i ... j
+        #
+        count = Z_BPq.bar[i%N][j%N] * (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) * scale2
+        if count > 0.0:
+            C_eff_for_BP.bar[(i+1)%N][(j-1)%N] += count / C_eff_for_BP.Q[(i+1)%N][(j-1)%N]
+            self.counts[ 'l' ] += 2 * count
+            self.counts[ 'l_BP' ] += count
+            self.counts[ base_pair_type ] -= count
+
+        # base pair forms a stacked pair with previous pair
+        #
+        #  i+1 ... j-1
+        #    |     |
+        #    i ... j
+        #
+        # Note that base pair stacks (C_eff_stack) could also be handled by the MotifType object in the next code block --
+        #   only a modest (~10%) slowdown
+        for base_pair_type2 in self.possible_base_pair_types[(i+1)%N][(j-1)%N]:
+            Z_BPq2 = self.Z_BPq[base_pair_type2]
+            count = Z_BPq.bar[i%N][j%N] * (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] * scale2
+            if count > 0.0:
+                Z_BPq2.bar[(i+1)%N][(j-1)%N] += count / Z_BPq2.Q[(i+1)%N][(j-1)%N]
+                self.counts[ (base_pair_type,base_pair_type2) ] += count
+                self.counts[ base_pair_type ] -= count
+
+    possible_motif_types = self.possible_motif_types[i%N][j%N]
+    for motif_type in possible_motif_types[base_pair_type]:
+        match_base_pair_type_set = possible_motif_types[base_pair_type][ motif_type ]
+        if len(motif_type.strands) == 1: # hairpins (1-way junctions)
+            # base pair closes a hairpin
+            #            -----
+            #           |     |
+            #           i ... j
+            #          5' bpt  3'
+            #
+            count = Z_BPq.bar[i%N][j%N] * (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1)
+            if count > 0.0:
+                self.counts[ base_pair_type ] -= count
+                self.counts[ motif_type ] += count
+            pass
+        elif len(motif_type.strands) == 2: # internal loops (2-way junctions)
+            # base pair forms a motif with previous pair
+            #
+            # Example of 1x1 loop:
+            #             bpt0
+            #       i_next... j_next
+            #           |     |
+            #  strand0 i+1   j-1 strand1
+            #           |     |
+            #           i ... j
+            #          5' bpt1 3'
+            #
+            for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
+                Z_BPq_next = self.Z_BPq[base_pair_type_next]
+                count = Z_BPq.bar[i%N][j%N] * (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] * scale**( offset - (j_next - i_next) % N )
+                if count > 0.0:
+                    Z_BPq_next.bar[(i_next)%N][(j_next)%N] += count / Z_BPq_next.Q[(i_next)%N][(j_next)%N]
+                    self.counts[ base_pair_type ] -= count
+                    self.counts[ motif_type ] += count
+        # could certainly handle 3WJ in O(N^3) time as well
+        # but how about 4WJ? anyway to do without an O(N^4) cost?
+
+    # base pair brings together two strands that were previously disconnected
+    #
+    #   \       /
+    #    i ... j
+    #
+    count = Z_BPq.bar[i%N][j%N] * (C_std/Kdq) * Z_cut.Q[i%N][j%N]
+    if count > 0.0:
+        Z_cut.bar[i%N][j%N] += count / Z_cut.Q[i%N][j%N]
+        self.counts[ 'C_std' ] += count
+        self.counts[ base_pair_type ] -= count
+
+    if K_coax > 0.0:
+        if ligated[i%N] and ligated[(j-1)%N]:
+
+            # coaxial stack of bp (i,j) and (i+1,k)...  "left stack",  and closes loop on right.
+            #      ___
+            #     /   \
+            #  i+1 ... k - k+1 ~
+            #    |              ~
+            #    i ... j - j-1 ~
+            #
+            for k in range( i+2, i+offset-1 ):
+                if ligated[k%N]:
+                    count = Z_BPq.bar[i%N][j%N] * Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                    if count > 0.0:
+                        Z_BP.bar[(i+1)%N][k%N] += count / Z_BP.Q[(i+1)%N][k%N]
+                        C_eff_for_coax.bar[(k+1)%N][(j-1)%N] += count / C_eff_for_coax.Q[(k+1)%N][(j-1)%N]
+                        self.counts[ 'K_coax' ] += count
+                        self.counts[ 'l' ] += 2 * count
+                        self.counts[ 'l_coax' ] += count
+                        self.counts[ base_pair_type ] -= count
+
+            # coaxial stack of bp (i,j) and (k,j-1)...  close loop on left, and "right stack"
+            #            ___
+            #           /   \
+            #  ~ k-1 - k ... j-1
+            # ~              |
+            #  ~ i+1 - i ... j
+            #
+            for k in range( i+2, i+offset-1 ):
+                if ligated[(k-1)%N]:
+                    count = Z_BPq.bar[i%N][j%N] * C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq * scale2
+                    if count > 0.0:
+                        C_eff_for_coax.bar[(i+1)%N][(k-1)%N] += count / C_eff_for_coax.Q[(i+1)%N][(k-1)%N]
+                        Z_BP.bar[k%N][(j-1)%N] += count / Z_BP.Q[k%N][(j-1)%N]
+                        self.counts[ 'K_coax' ] += count
+                        self.counts[ 'l' ] += 2 * count
+                        self.counts[ 'l_coax' ] += count
+                        self.counts[ base_pair_type ] -= count
+
+        # "left stack" but no loop closed on right (free strands hanging off j end)
+        #      ___
+        #     /   \
+        #  i+1 ... k -
+        #    |
+        #    i ... j -
+        #
+        if ligated[i%N]:
+            for k in range( i+2, i+offset ):
+                count = Z_BPq.bar[i%N][j%N] * Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq
+                if count > 0.0:
+                    Z_BP.bar[(i+1)%N][k%N] += count / Z_BP.Q[(i+1)%N][k%N]
+                    Z_cut.bar[k%N][j%N] += count / Z_cut.Q[k%N][j%N]
+                    self.counts[ 'C_std' ] += count
+                    self.counts[ 'K_coax' ] += count
+                    self.counts[ base_pair_type ] -= count
+
+        # "right stack" but no loop closed on left (free strands hanging off i end)
+        #       ___
+        #      /   \
+        #   - k ... j-1
+        #           |
+        #   - i ... j
+        #
+        if ligated[(j-1)%N]:
+            for k in range( i, i+offset-1 ):
+                count = Z_BPq.bar[i%N][j%N] * Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq
+                if count > 0.0:
+                    Z_cut.bar[i%N][k%N] += count / Z_cut.Q[i%N][k%N]
+                    Z_BP.bar[k%N][(j-1)%N] += count / Z_BP.Q[k%N][(j-1)%N]
+                    self.counts[ 'C_std' ] += count
+                    self.counts[ 'K_coax' ] += count
+                    self.counts[ base_pair_type ] -= count
+
+##################################################################################################
+def update_Z_BP_outside( self, i, j ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+
+    for base_pair_type in self.possible_base_pair_types[i%N][j%N]:
+        Z_BPq = self.Z_BPq[base_pair_type]
+        count = Z_BP.bar[i%N][j%N] * Z_BPq.Q[i%N][j%N]
+        if count > 0.0:
+            Z_BPq.bar[i%N][j%N] += count / Z_BPq.Q[i%N][j%N]
+
+        Z_BPq.update( self, i, j )
+##################################################################################################
+def update_Z_coax_outside( self, i, j ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if Z_coax.bar[i%N][j%N] == 0.0: return
+    offset = ( j - i ) % N
+
+    if (offset == N-1) and ligated[j%N]: return
+
+    #  all structures that form coaxial stacks between (i,k) and (k+1,j) for some k
+    #
+    #       -- k - k+1 -
+    #      /   :    :   \
+    #      \   :    :   /
+    #       -- i    j --
+    #
+    if K_coax > 0:
+        for k in range( i+1, i+offset-1 ):
+            if ligated[k%N]:
+                if Z_BP.val(i,k) == 0.0: continue
+                if Z_BP.val(k+1,j) == 0.0: continue
+                count = Z_coax.bar[i%N][j%N] * Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax
+                if count > 0.0:
+                    Z_BP.bar[i%N][k%N] += count / Z_BP.Q[i%N][k%N]
+                    Z_BP.bar[(k+1)%N][j%N] += count / Z_BP.Q[(k+1)%N][j%N]
+                    self.counts[ 'K_coax' ] += count
+
+##################################################################################################
+def update_C_eff_basic_outside( self, i, j ):
+    offset = ( j - i ) % self.N
+
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if C_eff_basic.bar[i%N][j%N] == 0.0: return
+
+
+    # j is not base paired or coaxially stacked: Extension by one residue from j-1 to j.
+    #
+    #    i ~~~~~~ j-1 - j
+    #
+    allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j%N] )
+    if ligated[(j-1)%N] and allow_loop_extension:
+        count = C_eff_basic.bar[i%N][j%N] * C_eff.Q[i%N][(j-1)%N] * l * self.scale
+        if count > 0.0:
+            C_eff.bar[i%N][(j-1)%N] += count / C_eff.Q[i%N][(j-1)%N]
+            self.counts[ 'l' ] += count
+
+    exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j%N]
+
+    # j is base paired, and its partner is k > i. (look below for case with i and j base paired)
+    #                 ___
+    #                /   \
+    #    i ~~~~k-1 - k...j
+    #
+    C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
+    for k in range( i+1, i+offset):
+        if ligated[(k-1)%N]:
+            count = C_eff_basic.bar[i%N][j%N] * C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP
+            if count > 0.0:
+                C_eff_for_BP.bar[i%N][(k-1)%N] += count / C_eff_for_BP.Q[i%N][(k-1)%N]
+                Z_BP.bar[k%N][j%N] += count / Z_BP.Q[k%N][j%N]
+                self.counts[ 'l' ] += count
+                self.counts[ 'l_BP' ] += count
+
+    if K_coax > 0:
+        # j is coax-stacked, and its partner is k > i.  (look below for case with i and j coaxially stacked)
+        #               _______
+        #              / :   : \
+        #              \ :   : /
+        #    i ~~~~k-1 - k   j
+        #
+        C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]:
+                count = C_eff_basic.bar[i%N][j%N] * C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax
+                if count > 0.0:
+                    C_eff_for_coax.bar[i%N][(k-1)%N] += count / C_eff_for_coax.Q[i%N][(k-1)%N]
+                    Z_coax.bar[k%N][j%N] += count / Z_coax.Q[k%N][j%N]
+                    self.counts[ 'l' ] += count
+                    self.counts[ 'l_coax' ] += count
+
+##################################################################################################
+def update_C_eff_no_coax_singlet_outside( self, i, j ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if C_eff_no_coax_singlet.bar[i%N][j%N] == 0.0: return
+
+    # some helper arrays that prevent closure of any 3WJ with a single coaxial stack and single helix with not intervening loop nucleotides
+    count = C_eff_no_coax_singlet.bar[i%N][j%N] * C_eff_basic.Q[i%N][j%N]
+    if count > 0.0:
+        C_eff_basic.bar[i%N][j%N] += count / C_eff_basic.Q[i%N][j%N]
+    count = C_eff_no_coax_singlet.bar[i%N][j%N] * C_init * Z_BP.Q[i%N][j%N] * l_BP
+    if count > 0.0:
+        Z_BP.bar[i%N][j%N] += count / Z_BP.Q[i%N][j%N]
+        self.counts[ 'C_init' ] += count
+        self.counts[ 'l_BP' ] += count
+
+##################################################################################################
+def update_C_eff_no_BP_singlet_outside( self, i, j ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if C_eff_no_BP_singlet.bar[i%N][j%N] == 0.0: return
+
+    if K_coax > 0.0:
+        count = C_eff_no_BP_singlet.bar[i%N][j%N] * C_eff_basic.Q[i%N][j%N]
+        if count > 0.0:
+            C_eff_basic.bar[i%N][j%N] += count / C_eff_basic.Q[i%N][j%N]
+        count = C_eff_no_BP_singlet.bar[i%N][j%N] * C_init * Z_coax.Q[i%N][j%N] * l_coax
+        if count > 0.0:
+            Z_coax.bar[i%N][j%N] += count / Z_coax.Q[i%N][j%N]
+            self.counts[ 'C_init' ] += count
+            self.counts[ 'l_coax' ] += count
+
+##################################################################################################
+def update_C_eff_outside( self, i, j ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if C_eff.bar[i%N][j%N] == 0.0: return
+
+    count = C_eff.bar[i%N][j%N] * C_eff_basic.Q[i%N][j%N]
+    if count > 0.0:
+        C_eff_basic.bar[i%N][j%N] += count / C_eff_basic.Q[i%N][j%N]
+
+    # j is base paired, and its partner is i
+    #      ___
+    #     /   \
+    #  i+1 ... j-1
+    #    |     |
+    #    i ... j
+    #
+    count = C_eff.bar[i%N][j%N] * C_init * Z_BP.Q[i%N][j%N] * l_BP
+    if count > 0.0:
+        Z_BP.bar[i%N][j%N] += count / Z_BP.Q[i%N][j%N]
+        self.counts[ 'C_init' ] += count
+        self.counts[ 'l_BP' ] += count
+
+    if K_coax > 0.0:
+        # j is coax-stacked, and its partner is i.
+        #       ------------
+        #      /   :    :   \
+        #      \   :    :   /
+        #       -- i    j --
+        #
+        count = C_eff.bar[i%N][j%N] * C_init * Z_coax.Q[i%N][j%N] * l_coax
+        if count > 0.0:
+            Z_coax.bar[i%N][j%N] += count / Z_coax.Q[i%N][j%N]
+            self.counts[ 'C_init' ] += count
+            self.counts[ 'l_coax' ] += count
+
+##################################################################################################
+def update_Z_linear_outside( self, i, j ):
+    offset = ( j - i ) % self.N
+
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if Z_linear.bar[i%N][j%N] == 0.0: return
+
+    # j is not base paired: Extension by one residue from j-1 to j.
+    #
+    #    i ~~~~~~ j-1 - j
+    #
+    allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j%N] )
+    if ligated[(j-1)%N] and allow_loop_extension:
+        count = Z_linear.bar[i%N][j%N] * Z_linear.Q[i%N][(j-1)%N] * self.scale
+        if count > 0.0:
+            Z_linear.bar[i%N][(j-1)%N] += count / Z_linear.Q[i%N][(j-1)%N]
+
+    # j is base paired, and its partner is i
+    #     ___
+    #    /   \
+    #    i...j
+    #
+    count = Z_linear.bar[i%N][j%N] * Z_BP.Q[i%N][j%N]
+    if count > 0.0:
+        Z_BP.bar[i%N][j%N] += count / Z_BP.Q[i%N][j%N]
+
+    # j is base paired, and its partner is k > i
+    #                 ___
+    #                /   \
+    #    i ~~~~k-1 - k...j
+    #
+    for k in range( i+1, i+offset):
+        if ligated[(k-1)%N]:
+            count = Z_linear.bar[i%N][j%N] * Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N]
+            if count > 0.0:
+                Z_linear.bar[i%N][(k-1)%N] += count / Z_linear.Q[i%N][(k-1)%N]
+                Z_BP.bar[k%N][j%N] += count / Z_BP.Q[k%N][j%N]
+
+    if K_coax > 0.0:
+        # j is coax-stacked, and its partner is i.
+        #       ------------
+        #      /   :    :   \
+        #      \   :    :   /
+        #       -- i    j --
+        #
+        count = Z_linear.bar[i%N][j%N] * Z_coax.Q[i%N][j%N]
+        if count > 0.0:
+            Z_coax.bar[i%N][j%N] += count / Z_coax.Q[i%N][j%N]
+
+        # j is coax-stacked, and its partner is k > i.
+        #
+        #               _______
+        #              / :   : \
+        #              \ :   : /
+        #    i ~~~~k-1 - k   j
+        #
+        for k in range( i+1, i+offset):
+            if ligated[(k-1)%N]:
+                count = Z_linear.bar[i%N][j%N] * Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N]
+                if count > 0.0:
+                    Z_linear.bar[i%N][(k-1)%N] += count / Z_linear.Q[i%N][(k-1)%N]
+                    Z_coax.bar[k%N][j%N] += count / Z_coax.Q[k%N][j%N]
+
+
+##################################################################################################
+def update_Z_final_outside( self, i ):
+    # Z_final is total partition function, and is computed at end of filling dynamic programming arrays
+    # Get the answer (in N ways!) --> so final output is actually Z_final(i), an array.
+    # Equality of the array is tested in run_cross_checks()
+    (C_init, l, l_BP, K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+
+    Z_final = self.Z_final
+    if Z_final.bar[i%N] == 0.0: return
+    scale = self.scale
+    if not ligated[((i - 1))%N]:
+        #
+        #      i ------- i-1
+        #
+        #     or equivalently
+        #        ________
+        #       /        \
+        #       \        /
+        #        i-1    i
+        #
+        count = Z_final.bar[i%N] * Z_linear.Q[i%N][(i-1)%N]
+        if count > 0.0:
+            Z_linear.bar[i%N][(i-1)%N] += count / Z_linear.Q[i%N][(i-1)%N]
+    else:
+        # Need to 'ligate' across i-1 to i
+        # Scaling Z_final by Kd_lig/C_std to match previous literature conventions
+
+        # Need to remove Z_coax contribution from C_eff, since its covered by C_eff_stacked_pair below.
+        count = Z_final.bar[i%N] * C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std
+        if count > 0.0:
+            C_eff_no_coax_singlet.bar[i%N][(i-1)%N] += count / C_eff_no_coax_singlet.Q[i%N][(i-1)%N]
+            self.counts[ 'C_std' ] -= count
+            self.counts[ 'l' ] += count
+
+        #any split segments, combined independently
+        #
+        #   c+1 --- i-1 - i --- c
+        #               *
+        for c in range( i, i + N - 1):
+            if not ligated[c%N]:
+                count = Z_final.bar[i%N] * Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N]
+                if count > 0.0:
+                    Z_linear.bar[i%N][c%N] += count / Z_linear.Q[i%N][c%N]
+                    Z_linear.bar[(c+1)%N][(i-1)%N] += count / Z_linear.Q[(c+1)%N][(i-1)%N]
+
+        for j in range( i+1, (i + N - 1) ):
+            # base pair forms a stacked pair with previous pair
+            #
+            #              <--3'
+            #         - j+1 - j -
+            #  bpt2 |    :    :    ^ bpt1
+            #       V    :    :    |
+            #         - i-1 - i -
+            #               * 5'-->
+            #
+            if ligated[j%N]:
+                if Z_BP.val(i,j) > 0.0 and Z_BP.val(j+1,i-1) > 0.0:
+                    for base_pair_type in self.possible_base_pair_types[i%N][j%N]:
+                        if self.Z_BPq[base_pair_type].val(i,j) == 0.0: continue
+                        for base_pair_type2 in self.possible_base_pair_types[(j+1)%N][(i-1)%N]:
+                            if self.Z_BPq[base_pair_type2].val(j+1,i-1) == 0.0: continue
+                            Z_BPq1 = self.Z_BPq[base_pair_type]
+                            Z_BPq2 = self.Z_BPq[base_pair_type2]
+                            # could also use self.params.C_eff_stack[base_pair_type.flipped][base_pair_type2]  -- should be the same as below.
+                            count = Z_final.bar[i%N] * self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N]
+                            if count > 0.0:
+                                Z_BPq2.bar[(j+1)%N][(i-1)%N] += count / Z_BPq2.Q[(j+1)%N][(i-1)%N]
+                                Z_BPq1.bar[i%N][j%N] += count / Z_BPq1.Q[i%N][j%N]
+                                self.counts[ (base_pair_type2.flipped,base_pair_type) ] += count
+
+            # ligation allows an internal loop motif to form across i-1 to i
+            #
+            #           <--
+            #        - j_next ----------- j -
+            # bpt0 |      :               :   ^ bpt1
+            #      v      :               :   |
+            #        - k_next - i-1 - i - k -
+            #                       *  -->
+            #
+            #   where k = i, i+1, ... (i + strand_length-2),
+            #      i.e., ligation is inside last strand of motif
+            #
+            for k in range( i, i + self.max_motif_strand_length - 1 ):
+                for base_pair_type in self.possible_base_pair_types[j%N][k%N]:
+                    possible_motif_types = self.possible_motif_types[j%N][k%N]
+                    for motif_type in possible_motif_types[base_pair_type]:
+                        if len( motif_type.strands) != 2: continue
+                        if ( (k - i + 1) >= len( motif_type.strands[-1] ) ): continue
+                        match_base_pair_type_set = possible_motif_types[base_pair_type][motif_type]
+                        base_pair_type1 = base_pair_type.flipped
+                        for (base_pair_type0,j_next,k_next) in match_base_pair_type_set:
+                            Z_BPq0 = self.Z_BPq[base_pair_type0]
+                            Z_BPq1 = self.Z_BPq[base_pair_type1]
+                            count = Z_final.bar[i%N] * motif_type.C_eff * Z_BPq0.Q[(j_next)%N][(k_next)%N] * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - (k_next-j_next)%N - 2 )
+                            if count > 0.0:
+                                Z_BPq0.bar[(j_next)%N][(k_next)%N] += count / Z_BPq0.Q[(j_next)%N][(k_next)%N]
+                                Z_BPq1.bar[k%N][j%N] += count / Z_BPq1.Q[k%N][j%N]
+                                self.counts[ motif_type ] += count
+
+
+        # ligation allows a hairpin to close across i-1 to i
+        #
+        #        <--3'
+        #       ------- j -
+        #      |        :  ^ bpt1
+        #      |        :  |
+        #     i-1 - i - k -
+        #         * 5'-->
+        #   where k = i, i+1, ... (i + strand_length-2),
+        #      i.e., ligation is inside hairpin loop
+        #
+        for motif_type in self.params.motif_types:
+            if len( motif_type.strands) != 1: continue
+            L = len( motif_type.strands[0] ) # for a tetraloop this is 1+4+1 = 6
+            for k in range( i, i+L-1 ):
+                j = ( k - L + 1 ) % N
+                for base_pair_type in self.possible_base_pair_types[j%N][k%N]:
+                    # N.B. could be made a little faster if we cache which hairpins are allowed at each j,k and for those, keep base pairs.
+                    possible_motif_types = self.possible_motif_types[j%N][k%N]
+                    if not motif_type in possible_motif_types[ base_pair_type ]: continue
+                    Z_BPq1 = self.Z_BPq[base_pair_type.flipped]
+                    count = Z_final.bar[i%N] * motif_type.C_eff * Z_BPq1.Q[k%N][j%N] * scale**( N - (j-k)%N - 1 )
+                    if count > 0.0:
+                        Z_BPq1.bar[k%N][j%N] += count / Z_BPq1.Q[k%N][j%N]
+                        self.counts[ motif_type ] += count
+
+        if K_coax > 0:
+            C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
+
+            # New co-axial stack might form across ligation junction
+            for j in range( i + 1, i + N - 2):
+                # If the two coaxially stacked base pairs are connected by a loop.
+                #
+                #       ~~~~
+                #   -- k    j --
+                #  /   :    :   \
+                #  \   :    :   /
+                #   - i-1 - i --
+                #         *
+                for k in range( j + 2, i + N - 1):
+                    if not ligated[j%N]: continue
+                    if not ligated[(k-1)%N]: continue
+                    if Z_BP.val(i,j) == 0: continue
+                    if Z_BP.val(k,i-1) == 0: continue
+                    count = Z_final.bar[i%N] * Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax
+                    if count > 0.0:
+                        Z_BP.bar[i%N][j%N] += count / Z_BP.Q[i%N][j%N]
+                        C_eff_for_coax.bar[(j+1)%N][(k-1)%N] += count / C_eff_for_coax.Q[(j+1)%N][(k-1)%N]
+                        Z_BP.bar[k%N][(i-1)%N] += count / Z_BP.Q[k%N][(i-1)%N]
+                        self.counts[ 'K_coax' ] += count
+                        self.counts[ 'l' ] += 2 * count
+                        self.counts[ 'l_coax' ] += count
+
+                # If the two stacked base pairs are in split segments
+                #
+                #      \    /
+                #   -- k    j --
+                #  /   :    :   \
+                #  \   :    :   /
+                #   - i-1 - i --
+                #         *
+                for k in range( j + 1, i + N - 1):
+                    if Z_BP.val(i,j) == 0: continue
+                    if Z_BP.val(k,i-1) == 0: continue
+                    if (k-j)%N == 1 and ligated[j%N]: continue
+                    count = Z_final.bar[i%N] * Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax / scale**2
+                    if count > 0.0:
+                        Z_BP.bar[i%N][j%N] += count / Z_BP.Q[i%N][j%N]
+                        Z_cut.bar[j%N][k%N] += count / Z_cut.Q[j%N][k%N]
+                        Z_BP.bar[k%N][(i-1)%N] += count / Z_BP.Q[k%N][(i-1)%N]
+                        self.counts[ 'K_coax' ] += count
+
+
+##################################################################################################
+def unpack_variables( self ):
+    '''
+    This helper function just lets me write out equations without
+    using "self" which obscures connection to my handwritten equations
+    In C++, will just use convention of object variables like N_, sequence_.
+    '''
+    return self.params.get_variables() + \
+           ( self.N, self.sequence, self.ligated, self.all_ligated,  \
+             self.Z_BP,self.C_eff_basic,self.C_eff_no_BP_singlet,self.C_eff_no_coax_singlet,self.C_eff,\
+             self.Z_linear,self.Z_cut,self.Z_coax )
+
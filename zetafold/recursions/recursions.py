@@ -14,13 +14,14 @@ def update_Z_cut( self, i, j ):
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
     offset = ( j - i ) % N
+    scale2 = self.scale**2 # i and j themselves are not in any subfragment
     for c in range( i, i+offset ):
         if not ligated[c]:
             # strand 1  (i --> c), strand 2  (c+1 -- > j)
-            if c == i and (c+1)%N == j:                                 Z_cut[i][j].Q += 1.0
-            if c == i and (c+1)%N != j and ligated[j-1]:                Z_cut[i][j] += Z_linear[c+1][j-1]
-            if c != i and (c+1)%N == j and ligated[i]:                  Z_cut[i][j] += Z_linear[i+1][c]
-            if c != i and (c+1)%N != j and ligated[i] and ligated[j-1]: Z_cut[i][j] += Z_linear[i+1][c] * Z_linear[c+1][j-1]
+            if c == i and (c+1)%N == j:                                 Z_cut[i][j].Q += scale2
+            if c == i and (c+1)%N != j and ligated[j-1]:                Z_cut[i][j] += Z_linear[c+1][j-1] * scale2
+            if c != i and (c+1)%N == j and ligated[i]:                  Z_cut[i][j] += Z_linear[i+1][c] * scale2
+            if c != i and (c+1)%N != j and ligated[i] and ligated[j-1]: Z_cut[i][j] += Z_linear[i+1][c] * Z_linear[c+1][j-1] * scale2
 
 ##################################################################################################
 def update_Z_BPq( self, i, j, base_pair_type ):
@@ -37,6 +38,10 @@ def update_Z_BPq( self, i, j, base_pair_type ):
 
     (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
 
+    # nucleotides not covered by subfragments each need a factor of scale -- see scale_util.py
+    scale  = self.scale
+    scale2 = scale**2
+
     if ligated[i] and ligated[j-1]:
         # base pair closes a loop
         #
@@ -46,7 +51,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
         #   \       /
         #    i ... j
         #
-        Z_BPq[i][j]  += (1.0/Kdq ) * ( C_eff_for_BP[i+1][j-1] * l * l * l_BP)
+        Z_BPq[i][j]  += (1.0/Kdq ) * ( C_eff_for_BP[i+1][j-1] * l * l * l_BP) * scale2
 
         # base pair forms a stacked pair with previous pair
         #
@@ -58,7 +63,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
         #   only a modest (~10%) slowdown
         for base_pair_type2 in self.possible_base_pair_types[i+1][j-1]:
             Z_BPq2 = self.Z_BPq[base_pair_type2]
-            Z_BPq[i][j]  += (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2[i+1][j-1]
+            Z_BPq[i][j]  += (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2[i+1][j-1] * scale2
 
     possible_motif_types = self.possible_motif_types[i][j]
     for motif_type in possible_motif_types[base_pair_type]:
@@ -70,7 +75,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #           i ... j
             #          5' bpt  3'
             #
-            Z_BPq[i][j].Q += (1.0/Kdq ) * motif_type.C_eff
+            Z_BPq[i][j] += (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1)
             pass
         elif len(motif_type.strands) == 2: # internal loops (2-way junctions)
             # base pair forms a motif with previous pair
@@ -86,7 +91,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #
             for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
                 Z_BPq_next = self.Z_BPq[base_pair_type_next]
-                Z_BPq[i][j] += (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next[i_next][j_next]
+                Z_BPq[i][j] += (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next[i_next][j_next] * scale**( offset - (j_next - i_next) % N )
         # could certainly handle 3WJ in O(N^3) time as well
         # but how about 4WJ? anyway to do without an O(N^4) cost?
 
@@ -108,7 +113,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #    i ... j - j-1 ~
             #
             for k in range( i+2, i+offset-1 ):
-                if ligated[k]: Z_BPq[i][j] += Z_BP[i+1][k] * C_eff_for_coax[k+1][j-1] * l**2 * l_coax * K_coax / Kdq
+                if ligated[k]: Z_BPq[i][j] += Z_BP[i+1][k] * C_eff_for_coax[k+1][j-1] * l**2 * l_coax * K_coax / Kdq * scale2
 
             # coaxial stack of bp (i,j) and (k,j-1)...  close loop on left, and "right stack"
             #            ___
@@ -118,7 +123,7 @@ def update_Z_BPq( self, i, j, base_pair_type ):
             #  ~ i+1 - i ... j
             #
             for k in range( i+2, i+offset-1 ):
-                if ligated[k-1]: Z_BPq[i][j] += C_eff_for_coax[i+1][k-1] * Z_BP[k][j-1] * l**2 * l_coax * K_coax / Kdq
+                if ligated[k-1]: Z_BPq[i][j] += C_eff_for_coax[i+1][k-1] * Z_BP[k][j-1] * l**2 * l_coax * K_coax / Kdq * scale2
 
         # "left stack" but no loop closed on right (free strands hanging off j end)
         #      ___
@@ -205,7 +210,7 @@ def update_C_eff_basic( self, i, j ):
     #    i ~~~~~~ j-1 - j
     #
     allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j] )
-    if ligated[j-1] and allow_loop_extension: C_eff_basic[i][j] += C_eff[i][j-1] * l
+    if ligated[j-1] and allow_loop_extension: C_eff_basic[i][j] += C_eff[i][j-1] * l * self.scale
 
     exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j]
 
@@ -289,7 +294,7 @@ def update_Z_linear( self, i, j ):
     #    i ~~~~~~ j-1 - j
     #
     allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j] )
-    if ligated[j-1] and allow_loop_extension: Z_linear[i][j] += Z_linear[i][j-1]
+    if ligated[j-1] and allow_loop_extension: Z_linear[i][j] += Z_linear[i][j-1] * self.scale
 
     # j is base paired, and its partner is i
     #     ___
@@ -335,6 +340,7 @@ def update_Z_final( self, i ):
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
 
     Z_final = self.Z_final
+    scale = self.scale
     if not ligated[(i - 1)]:
         #
         #      i ------- i-1
@@ -372,9 +378,9 @@ def update_Z_final( self, i ):
             #
             if ligated[j]:
                 if Z_BP.val(i,j) > 0.0 and Z_BP.val(j+1,i-1) > 0.0:
-                    for base_pair_type in self.params.base_pair_types:
+                    for base_pair_type in self.possible_base_pair_types[i][j]:
                         if self.Z_BPq[base_pair_type].val(i,j) == 0.0: continue
-                        for base_pair_type2 in self.params.base_pair_types:
+                        for base_pair_type2 in self.possible_base_pair_types[j+1][i-1]:
                             if self.Z_BPq[base_pair_type2].val(j+1,i-1) == 0.0: continue
                             Z_BPq1 = self.Z_BPq[base_pair_type]
                             Z_BPq2 = self.Z_BPq[base_pair_type2]
@@ -404,7 +410,7 @@ def update_Z_final( self, i ):
                         for (base_pair_type0,j_next,k_next) in match_base_pair_type_set:
                             Z_BPq0 = self.Z_BPq[base_pair_type0]
                             Z_BPq1 = self.Z_BPq[base_pair_type1]
-                            Z_final[i]  += motif_type.C_eff * Z_BPq0[j_next][k_next] * Z_BPq1[k][j]
+                            Z_final[i]  += motif_type.C_eff * Z_BPq0[j_next][k_next] * Z_BPq1[k][j] * scale**( N - (j-k)%N - (k_next-j_next)%N - 2 )
 
 
         # ligation allows a hairpin to close across i-1 to i
@@ -428,7 +434,7 @@ def update_Z_final( self, i ):
                     possible_motif_types = self.possible_motif_types[j][k]
                     if not motif_type in possible_motif_types[ base_pair_type ]: continue
                     Z_BPq1 = self.Z_BPq[base_pair_type.flipped]
-                    Z_final[i]  += motif_type.C_eff * Z_BPq1[k][j]
+                    Z_final[i]  += motif_type.C_eff * Z_BPq1[k][j] * scale**( N - (j-k)%N - 1 )
 
         if K_coax > 0:
             C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
@@ -462,7 +468,7 @@ def update_Z_final( self, i ):
                     if Z_BP.val(i,j) == 0: continue
                     if Z_BP.val(k,i-1) == 0: continue
                     if (k-j)%N == 1 and ligated[j]: continue
-                    Z_final[i] += Z_BP[i][j] * Z_cut[j][k] * Z_BP[k][i-1] * K_coax
+                    Z_final[i] += Z_BP[i][j] * Z_cut[j][k] * Z_BP[k][i-1] * K_coax / scale**2
 
 
 ##################################################################################################
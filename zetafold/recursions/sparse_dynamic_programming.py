@@ -0,0 +1,163 @@
+#
+# Same interface as explicit_dynamic_programming.py, but only candidate base pairs (i,j) are stored --
+#  all other elements read out as 0.0.
+#
+# Used for Z_BPq, which is only updated at candidate base pairs, i.e., possible_base_pair_indices[ base_pair_type ]
+#  -- typically a small fraction of the N x N elements. Storage is compressed sparse row (CSR), set up by
+#  set_candidates() once candidates are known: the candidates in row i are k = row_start[i] ... row_start[i+1]-1,
+#  with sorted columns[k] = j and values[k]. Values are in an array.array, so they take 8 bytes each, read
+#  out as Python floats, and can be viewed as an ndarray with get_values(). Candidates in column j are listed
+#  (compressed sparse column, CSC) in column_rows and column_k, from column_start[j] to column_start[j+1]-1.
+#
+# Lookup of (i,j) is O(1), through a CandidateIndex shared by the Z_BPq of all base pair types.
+#
+import numpy as np
+from array import array
+from collections import defaultdict
+from zetafold.recursions.explicit_dynamic_programming import BacktrackRecords
+
+class CandidateIndex:
+    '''
+    For each element (i,j), which base pair type t has a candidate there, and where (k) in the candidates of t:
+      type_rows[i][j]  = t, or -1 if no candidate at (i,j), or -2 if several base pair types have candidates at (i,j)
+      index_rows[i][j] = k, if only one base pair type has a candidate at (i,j)
+      multiple[t]      = { (i,j): k } for elements where several base pair types have candidates
+    Rows are array.array, 5 bytes per element in all, shared by the Z_BPq of all base pair types.
+    '''
+    def __init__( self, N, candidates ):
+        '''
+        candidates = list of ( I, J ) for each base pair type, as in possible_base_pair_indices.
+        '''
+        assert( len( candidates ) < 128 )
+        num_types = np.zeros( (N,N), dtype = np.int8 )
+        for ( I, J ) in candidates: num_types[ I, J ] += 1
+        types = -np.ones( (N,N), dtype = np.int8 )
+        index = -np.ones( (N,N), dtype = np.int32 )
+        self.multiple = []
+        for ( t, ( I, J ) ) in enumerate( candidates ):
+            single = ( num_types[ I, J ] == 1 )
+            K = np.arange( len( I ) )
+            ( types[ I[ single ], J[ single ] ], index[ I[ single ], J[ single ] ] ) = ( t, K[ single ] )
+            self.multiple.append( dict( zip( zip( I[ ~single ].tolist(), J[ ~single ].tolist() ), K[ ~single ].tolist() ) ) )
+        types[ num_types > 1 ] = -2
+        self.type_rows  = [ array( 'b', types[ i ].tolist() ) for i in range( N ) ]
+        self.index_rows = [ array( 'i', index[ i ].tolist() ) for i in range( N ) ]
+
+class SparseMatrixRow:
+    '''
+    Row i of a sparse DynamicProgrammingMatrix, so that Q[i][j] works as for lists of lists.
+    '''
+    def __init__( self, Z, i ):
+        ( self.i, self.t, self.values ) = ( i, Z.base_pair_type_index, Z.values )
+        self.types = Z.candidate_index.type_rows[ i ]
+        self.index = Z.candidate_index.index_rows[ i ]
+        self.multiple = Z.candidate_index.multiple[ self.t ]
+        ( self.columns, self.start, self.stop ) = ( Z.columns, Z.row_start[ i ], Z.row_start[ i+1 ] )
+
+    def find( self, j ):
+        '''
+        k with columns[k] = j, or -1 if (i,j) is not a candidate
+        '''
+        t = self.types[ j ]
+        if t == self.t: return self.index[ j ]
+        if t == -2: return self.multiple.get( ( self.i, j ), -1 )
+        return -1
+
+    def __getitem__( self, j ):
+        t = self.types[ j ]
+        if t == self.t: return self.values[ self.index[ j ] ]
+        if t == -2:
+            k = self.multiple.get( ( self.i, j ), -1 )
+            if k >= 0: return self.values[ k ]
+        return 0.0
+
+    def __setitem__( self, j, val ):
+        k = self.find( j )
+        if k < 0:
+            assert( val == 0.0 ) # only candidates can be nonzero
+            return
+        self.values[ k ] = val
+
+    def items( self ):
+        return zip( self.columns[ self.start:self.stop ], self.values[ self.start:self.stop ] )
+
+class DynamicProgrammingMatrix:
+    '''
+    Dynamic Programming 2-D Matrix, stored sparsely, that automatically:
+      knows how to update values at i,j
+    '''
+    def __init__( self, N, val = 0.0, diag_val = 0.0, DPlist = None, update_func = None, options = None, name = None ):
+        assert( val == 0.0 and diag_val == 0.0 )
+        self.N = N
+        candidates = ( np.zeros( 0, dtype = int ), np.zeros( 0, dtype = int ) )
+        self.set_candidates( CandidateIndex( N, [ candidates ] ), 0, candidates )
+
+        self.backtrack_info = [ defaultdict( BacktrackRecords ) for i in range( N ) ] # only filled by get_backtrack_info()
+        self.backtrack_info_updated = set()
+
+        if DPlist != None: DPlist.append( self )
+        self.update_func = update_func
+
+        self.name = name
+
+    def set_candidates( self, candidate_index, base_pair_type_index, candidates ):
+        '''
+        Store elements (i,j) for candidates = ( I, J ), arrays sorted by i, then j (as in possible_base_pair_indices)
+         of base pair type number base_pair_type_index in candidate_index (a CandidateIndex). All values start at 0.0.
+        '''
+        ( I, J ) = candidates
+        ( self.candidate_index, self.base_pair_type_index ) = ( candidate_index, base_pair_type_index )
+        self.row_start = np.searchsorted( I, np.arange( self.N + 1 ) ).tolist()
+        self.columns = array( 'i', J.tolist() )
+        by_column = np.lexsort( ( I, J ) )
+        self.column_start = np.searchsorted( J[ by_column ], np.arange( self.N + 1 ) ).tolist()
+        self.column_rows = array( 'i', I[ by_column ].tolist() )
+        self.column_k    = array( 'i', by_column.tolist() )
+        self.values = array( 'd', [ 0.0 ] ) * len( J )
+        self.Q = [ SparseMatrixRow( self, i ) for i in range( self.N ) ]
+
+    def get_values( self ):
+        '''
+        values as an ndarray, sharing memory -- in the order of the candidates in set_candidates().
+        '''
+        return np.frombuffer( self.values, dtype = np.float64 )
+
+    def val( self, i, j ): return self.Q[i%self.N][j%self.N]
+    def set_val( self, i, j, val ): self.Q[i%self.N][j%self.N] = val
+
+    def update( self, partition, i, j ):
+        self.Q[ i ][ j ] = 0
+        if partition.options.calc_backtrack_info: self.backtrack_info[ i ][ j ] = BacktrackRecords()
+        self.update_func( partition, i, j )
+
+    def get_backtrack_info( self, partition, i, j ):
+        if not (i,j) in self.backtrack_info_updated:
+            partition.options.calc_backtrack_info = True
+            self.update( partition, i, j )
+            partition.options.calc_backtrack_info = False
+            self.backtrack_info_updated.add( (i,j) )
+        return self.backtrack_info[i][j]
+
+    def row( self, i ):
+        '''
+        Stored elements (j, value) in row i
+        '''
+        return self.Q[i].items()
+
+    def column( self, j ):
+        '''
+        Stored elements (i, value) in column j
+        '''
+        ( start, stop ) = ( self.column_start[ j ], self.column_start[ j+1 ] )
+        return [ ( i, self.values[ k ] ) for ( i, k ) in zip( self.column_rows[ start:stop ], self.column_k[ start:stop ] ) ]
+
+    def scale_by_offset( self, factor ):
+        '''
+        Multiply each element (i,j) in place by factor[ (j - i) % N ]
+        '''
+        I = np.repeat( np.arange( self.N ), np.diff( self.row_start ) )
+        J = np.frombuffer( self.columns, dtype = np.dtype( self.columns.typecode ) )
+        self.get_values()[:] *= np.asarray( factor )[ ( J - I ) % self.N ]
+
+    def __len__( self ):
+        return self.N
@@ -0,0 +1,196 @@
+##################################################################################################
+# vectorized_recursions.py = same recursions as explicit_recursions.py, but the inner loops over
+#                             the split point k are replaced by masked dot products over rows and
+#                             columns of NumPy-backed matrices (see array_dynamic_programming.py).
+#
+# Only the O(N) inner loops are rewritten here -- everything else (and all backtracking, which
+#  needs each contribution separately) is handed off to explicit_recursions.py.
+# If you edit recursions.py, make sure to make the same change here, and update RECURSIONS_CHECKSUM.
+##################################################################################################
+import numpy as np
+from zetafold.recursions import explicit_recursions
+from zetafold.recursions.explicit_recursions import unpack_variables
+
+# checksum of recursions.py that this file matches -- see checksum.py
+RECURSIONS_CHECKSUM = 'fbb60b6b9b15fb81d6a1c7acd0f3b8c7'
+
+def span( start, stop, N ):
+    '''
+    Indices start, start+1, ... stop-1, modulo N.
+    Returned as a slice (fast, no copy) unless the range wraps around the end of the sequence.
+    '''
+    if start >= N:
+        start -= N
+        stop  -= N
+    if stop <= N: return slice( start, stop )
+    return np.arange( start, stop ) % N
+
+def get_ligated_array( self ):
+    '''
+    ligated as a float array of 1's and 0's, so that it can be used as a mask in dot products.
+    '''
+    if getattr( self, 'ligated_array', None ) is None or len( self.ligated_array ) != self.N:
+        self.ligated_array = np.array( [ float(self.ligated[n]) for n in range(self.N) ] )
+    return self.ligated_array
+
+##################################################################################################
+def update_Z_BPq( self, i, j, base_pair_type ):
+    '''
+    Z_BPq is the partition function for all structures that base pair i and j with base_pair_type
+    Relies on previous Z contributions available for subfragments, and Z_cut for this fragment i,j
+    '''
+    if self.options.calc_backtrack_info: return explicit_recursions.update_Z_BPq( self, i, j, base_pair_type )
+
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    offset = ( j - i ) % N
+
+    ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+
+    (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
+    scale  = self.scale
+    scale2 = scale**2
+
+    contribs = []
+    if ligated[i%N] and ligated[(j-1)%N]:
+        # base pair closes a loop
+        contribs.append( (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) * scale2 )
+
+        # base pair forms a stacked pair with previous pair
+        for base_pair_type2 in self.possible_base_pair_types[(i+1)%N][(j-1)%N]:
+            Z_BPq2 = self.Z_BPq[base_pair_type2]
+            contribs.append( (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq2.Q[(i+1)%N][(j-1)%N] * scale2 )
+
+    possible_motif_types = self.possible_motif_types[i%N][j%N]
+    for motif_type in possible_motif_types[base_pair_type]:
+        match_base_pair_type_set = possible_motif_types[base_pair_type][ motif_type ]
+        if len(motif_type.strands) == 1: # hairpins (1-way junctions)
+            contribs.append( (1.0/Kdq ) * motif_type.C_eff * scale**(offset+1))
+        elif len(motif_type.strands) == 2: # internal loops (2-way junctions)
+            for (base_pair_type_next, i_next, j_next) in match_base_pair_type_set:
+                Z_BPq_next = self.Z_BPq[base_pair_type_next]
+                contribs.append( (1.0/Kdq ) * motif_type.C_eff * Z_BPq_next.Q[(i_next)%N][(j_next)%N] * scale**( offset - (j_next - i_next) % N ) )
+
+    # base pair brings together two strands that were previously disconnected
+    contribs.append( (C_std/Kdq) * Z_cut.Q[i%N][j%N] )
+
+    if K_coax > 0.0:
+        lig = get_ligated_array( self )
+        if ligated[i%N] and ligated[(j-1)%N] and offset > 3:
+            # coaxial stack of bp (i,j) and (i+1,k)...  "left stack",  and closes loop on right.
+            #   k = i+2 ... j-2
+            k  = span( i+2, i+offset-1, N )
+            k1 = span( i+3, i+offset,   N )
+            contribs.append( np.dot( Z_BP.Q[(i+1)%N, k] * lig[k], C_eff_for_coax.Q[k1, (j-1)%N] ) * l**2 * l_coax * K_coax / Kdq * scale2 )
+
+            # coaxial stack of bp (i,j) and (k,j-1)...  close loop on left, and "right stack"
+            #   k = i+2 ... j-2
+            km1 = span( i+1, i+offset-2, N )
+            k   = span( i+2, i+offset-1, N )
+            contribs.append( np.dot( C_eff_for_coax.Q[(i+1)%N, km1] * lig[km1], Z_BP.Q[k, (j-1)%N] ) * l**2 * l_coax * K_coax / Kdq * scale2 )
+
+        # "left stack" but no loop closed on right (free strands hanging off j end)
+        #   k = i+2 ... j-1
+        if ligated[i%N] and offset > 2:
+            k = span( i+2, i+offset, N )
+            contribs.append( np.dot( Z_BP.Q[(i+1)%N, k], Z_cut.Q[k, j%N] ) * C_std * K_coax / Kdq )
+
+        # "right stack" but no loop closed on left (free strands hanging off i end)
+        #   k = i ... j-2
+        if ligated[(j-1)%N] and offset > 1:
+            k = span( i, i+offset-1, N )
+            contribs.append( np.dot( Z_cut.Q[i%N, k], Z_BP.Q[k, (j-1)%N] ) * C_std * K_coax / Kdq )
+
+    Z_BPq.Q[i%N][j%N] = sum( contribs )
+
+##################################################################################################
+def update_Z_coax( self, i, j ):
+    '''
+    Z_coax(i,j) is the partition function for all structures that form coaxial stacks between (i,k) and (k+1,j) for some k
+    '''
+    if self.options.calc_backtrack_info: return explicit_recursions.update_Z_coax( self, i, j )
+
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    offset = ( j - i ) % N
+
+    if (offset == N-1) and ligated[j%N]: return
+
+    #  all structures that form coaxial stacks between (i,k) and (k+1,j), k = i+1 ... j-2
+    if K_coax > 0 and offset > 2:
+        lig = get_ligated_array( self )
+        k  = span( i+1, i+offset-1, N )
+        k1 = span( i+2, i+offset,   N )
+        Z_coax.Q[i%N][j%N] = np.dot( Z_BP.Q[i%N, k] * lig[k], Z_BP.Q[k1, j%N] ) * K_coax
+
+##################################################################################################
+def update_C_eff_basic( self, i, j ):
+    '''
+    C_eff tracks the effective molarity of a loop starting at i and ending at j
+    Relies on previous Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear available for subfragments.
+    Relies on Z_BP being already filled out for i,j
+    '''
+    if self.options.calc_backtrack_info: return explicit_recursions.update_C_eff_basic( self, i, j )
+
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    offset = ( j - i ) % N
+    lig = get_ligated_array( self )
+
+    contribs = []
+
+    # j is not base paired or coaxially stacked: Extension by one residue from j-1 to j.
+    allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j%N] )
+    if ligated[(j-1)%N] and allow_loop_extension: contribs.append( C_eff.Q[i%N][(j-1)%N] * l * self.scale )
+
+    exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j%N]
+
+    # j is base paired (or coax-stacked), and its partner is k > i.   k = i+1 ... j-1
+    km1 = span( i,   i+offset-1, N )
+    k   = span( i+1, i+offset,   N )
+    C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
+    contribs.append( np.dot( C_eff_for_BP.Q[i%N, km1] * lig[km1], Z_BP.Q[k, j%N] ) * l * l_BP )
+
+    if K_coax > 0:
+        C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
+        contribs.append( np.dot( C_eff_for_coax.Q[i%N, km1] * lig[km1], Z_coax.Q[k, j%N] ) * l * l_coax )
+
+    C_eff_basic.Q[i%N][j%N] = sum( contribs )
+
+##################################################################################################
+def update_Z_linear( self, i, j ):
+    '''
+    Z_linear tracks the total partition function from i to j, assuming all intervening residues are covalently connected (or base-paired).
+    Relies on previous Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear available for subfragments.
+    Relies on Z_BP being already filled out for i,j
+    '''
+    if self.options.calc_backtrack_info: return explicit_recursions.update_Z_linear( self, i, j )
+
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    offset = ( j - i ) % N
+    lig = get_ligated_array( self )
+
+    contribs = []
+
+    # j is not base paired: Extension by one residue from j-1 to j.
+    allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j%N] )
+    if ligated[(j-1)%N] and allow_loop_extension: contribs.append( Z_linear.Q[i%N][(j-1)%N] * self.scale )
+
+    # j is base paired, and its partner is i
+    contribs.append( Z_BP.Q[i%N][j%N] )
+
+    # j is base paired, and its partner is k > i.   k = i+1 ... j-1
+    km1 = span( i,   i+offset-1, N )
+    k   = span( i+1, i+offset,   N )
+    Z_linear_ligated = Z_linear.Q[i%N, km1] * lig[km1]
+    contribs.append( np.dot( Z_linear_ligated, Z_BP.Q[k, j%N] ) )
+
+    if K_coax > 0.0:
+        # j is coax-stacked, and its partner is i.
+        contribs.append( Z_coax.Q[i%N][j%N] )
+
+        # j is coax-stacked, and its partner is k > i.
+        contribs.append( np.dot( Z_linear_ligated, Z_coax.Q[k, j%N] ) )
+
+    Z_linear.Q[i%N][j%N] = sum( contribs )
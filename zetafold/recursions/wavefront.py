@@ -0,0 +1,190 @@
+##################################################################################################
+# wavefront.py = fills dynamic programming matrices one anti-diagonal ('offset' = j - i) at a time.
+#
+# Every cell (i,j) with the same offset depends only on cells with smaller offsets (or on
+#  cells at the same (i,j) that are updated earlier in Z_all), so a whole diagonal of each matrix
+#  can be computed at once with NumPy gathers over the split point k. The recursions are the
+#  same as in explicit_recursions.py -- if you edit recursions.py, make the same change here, and update
+#  RECURSIONS_CHECKSUM.
+#
+# Matrices are the NumPy-backed ones from array_dynamic_programming.py, with their update_func's
+#  still pointing to explicit_recursions.py, so that backtracking (which recomputes single cells)
+#  works as usual. Z_BPq for all base pair types share one T x N x N array.
+##################################################################################################
+import numpy as np
+from zetafold.recursions.explicit_recursions import unpack_variables
+from zetafold.util.scale_util import rescale_if_needed
+
+# checksum of recursions.py that this file matches -- see checksum.py
+RECURSIONS_CHECKSUM = 'fbb60b6b9b15fb81d6a1c7acd0f3b8c7'
+
+def initialize_wavefront( self ):
+    '''
+    Precompute information that does not change during the fill:
+      Z_BPq_array           = T x N x N array holding Z_BPq for all T base pair types
+                                (each self.Z_BPq[bpt].Q is a view into it)
+      possible_mask         = T x N x N, True if base_pair_type t possible at i,j
+      hairpin_C_eff         = T x N x N, sum of C_eff of hairpins closed by base_pair_type t at i,j
+      internal_loops        = for each offset, arrays (t, i, C_eff, t_next, i_next, j_next) for internal loop motifs
+      C_eff_stack_array     = T x T array of C_eff_stack
+      Kd_array              = T, Kd for each base_pair_type
+      ligated_array         = N, 1.0 if ligated, 0.0 at cutpoints
+      allow_extension_array = N, 0.0 if loop extension into j is blocked by a forced base pair
+    '''
+    from zetafold.partition import get_possible_motif_arrays, split_by_offset
+    N = self.N
+    base_pair_types = self.base_pair_types
+    T = len( base_pair_types )
+
+    self.Z_BPq_array = np.zeros( (T,N,N) )
+    for (t,base_pair_type) in enumerate( base_pair_types ):
+        self.Z_BPq_array[t] = self.Z_BPq[ base_pair_type ].Q
+        self.Z_BPq[ base_pair_type ].Q = self.Z_BPq_array[t]
+
+    self.possible_mask = np.zeros( (T,N,N), dtype = bool )
+    for (t,base_pair_type) in enumerate( base_pair_types ):
+        self.possible_mask[ t ][ self.possible_base_pair_indices[ base_pair_type ] ] = True
+
+    ( t, i, j, m, t_next, i_next, j_next ) = get_possible_motif_arrays( self )
+    motif_C_eff = np.array( [ motif_type.C_eff for motif_type in self.params.motif_types ] )[ m ]
+    hairpin = ( t_next < 0 )
+    self.hairpin_C_eff = np.zeros( (T,N,N) )
+    np.add.at( self.hairpin_C_eff, ( t[ hairpin ], i[ hairpin ], j[ hairpin ] ), motif_C_eff[ hairpin ] )
+    self.internal_loops = split_by_offset( np.array( [ t, i, motif_C_eff, t_next, i_next, j_next ], dtype = float ).T[ ~hairpin ], ( ( j - i ) % N )[ ~hairpin ], N )
+
+    self.C_eff_stack_array = np.array( [ [ self.params.C_eff_stack[bpt1][bpt2] for bpt2 in base_pair_types ] for bpt1 in base_pair_types ] ).reshape( T, T )
+    self.Kd_array = np.array( [ base_pair_type.Kd for base_pair_type in base_pair_types ] )
+    self.ligated_array = np.array( [ float(self.ligated[n]) for n in range(N) ] )
+    self.allow_extension_array = np.ones( N )
+    if self.in_forced_base_pair:
+        for n in range( N ):
+            if self.in_forced_base_pair[n]: self.allow_extension_array[n] = 0.0
+
+def fill_wavefront( self ):
+    '''
+    Do the dynamic programming, one diagonal at a time.
+    '''
+    initialize_wavefront( self )
+    for offset in range( 1, self.N ):
+        update_diagonal( self, offset )
+        rescale_if_needed( self, offset )
+
+def split_points( I, start, stop, N ):
+    '''
+    For each i in I (along columns), the split points k = i+start ... i+stop-1 (along rows), modulo N
+    '''
+    return ( I[None,:] + np.arange( start, stop )[:,None] ) % N
+
+def update_diagonal( self, offset ):
+    '''
+    Update all matrices at (i, i+offset) for every i at once.
+    Same math as the update_* functions in explicit_recursions.py, in the same order as Z_all.
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    d = offset
+    n = N if self.calc_all_elements else N - d
+    I = np.arange( n )
+    J = ( I + d ) % N
+    Ip1 = ( I + 1 ) % N
+    Jm1 = ( J - 1 ) % N
+    lig = self.ligated_array
+    lig_i, lig_jm1 = lig[ I ], lig[ Jm1 ]
+    closes_loop = lig_i * lig_jm1
+    scale  = self.scale
+    scale2 = scale**2
+
+    ##############################
+    # Z_cut
+    # cutpoint c = i + m, m = 0 ... offset-1; strand 1 is i --> c, strand 2 is c+1 --> j
+    M = np.arange( d )[:,None]
+    C = ( I[None,:] + M ) % N
+    Z_left  = np.where( M == 0,   1.0, lig_i   * Z_linear.Q[ Ip1, C ] )
+    Z_right = np.where( M == d-1, 1.0, lig_jm1 * Z_linear.Q[ (C+1) % N, Jm1 ] )
+    Z_cut.Q[ I, J ] = ( ( 1.0 - lig[C] ) * Z_left * Z_right ).sum( axis = 0 ) * scale2
+
+    ##############################
+    # Z_BPq for all base pair types. Numerators shared by all types get divided by Kdq at the end.
+    ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+    Z_BPq_array = self.Z_BPq_array
+    T = len( self.base_pair_types )
+
+    # base pair closes a loop, or brings together two strands that were previously disconnected
+    numerator = closes_loop * C_eff_for_BP.Q[ Ip1, Jm1 ] * l * l * l_BP * scale2 + C_std * Z_cut.Q[ I, J ]
+
+    if K_coax > 0.0:
+        # coaxial stack of bp (i,j) and (i+1,k) [k = i+2 ... j-2] and closes loop on right.
+        K = split_points( I, 2, d-1, N )
+        numerator += closes_loop * ( lig[K] * Z_BP.Q[ Ip1, K ] * C_eff_for_coax.Q[ (K+1)%N, Jm1 ] ).sum( axis = 0 ) * l**2 * l_coax * K_coax * scale2
+        # coaxial stack of bp (i,j) and (k,j-1) [k = i+2 ... j-2], and closes loop on left.
+        numerator += closes_loop * ( lig[(K-1)%N] * C_eff_for_coax.Q[ Ip1, (K-1)%N ] * Z_BP.Q[ K, Jm1 ] ).sum( axis = 0 ) * l**2 * l_coax * K_coax * scale2
+        # "left stack" but no loop closed on right [k = i+2 ... j-1]
+        K = split_points( I, 2, d, N )
+        numerator += lig_i * ( Z_BP.Q[ Ip1, K ] * Z_cut.Q[ K, J ] ).sum( axis = 0 ) * C_std * K_coax
+        # "right stack" but no loop closed on left [k = i ... j-2]
+        K = split_points( I, 0, d-1, N )
+        numerator += lig_jm1 * ( Z_cut.Q[ I, K ] * Z_BP.Q[ K, Jm1 ] ).sum( axis = 0 ) * C_std * K_coax
+
+    # base pair forms a stacked pair with previous pair
+    Z_BPq_numerator = numerator[None,:] + closes_loop * np.dot( self.C_eff_stack_array, Z_BPq_array[ :, Ip1, Jm1 ] ) * scale2
+
+    # hairpins
+    Z_BPq_numerator += self.hairpin_C_eff[ :, I, J ] * scale**( d+1 )
+
+    # internal loops -- scatter C_eff * Z_BPq_next into (t,i)
+    internal_loops = self.internal_loops[ d ]
+    if len( internal_loops ) > 0:
+        ( t, i, motif_C_eff, t_next, i_next, j_next ) = internal_loops.T
+        ( t, i, t_next, i_next, j_next ) = [ x.astype( int ) for x in ( t, i, t_next, i_next, j_next ) ]
+        keep = ( i < n )
+        vals = motif_C_eff[keep] * Z_BPq_array[ t_next[keep], i_next[keep], j_next[keep] ] * scale**( d - ( j_next[keep] - i_next[keep] ) % N )
+        Z_BPq_numerator += np.bincount( t[keep] * n + i[keep], weights = vals, minlength = T*n ).reshape( T, n )
+
+    Z_BPq_diag = self.possible_mask[ :, I, J ] * Z_BPq_numerator / self.Kd_array[:,None]
+    Z_BPq_array[ :, I, J ] = Z_BPq_diag
+
+    ##############################
+    # Z_BP
+    Z_BP.Q[ I, J ] = Z_BPq_diag.sum( axis = 0 )
+
+    ##############################
+    # Z_coax: coaxial stacks between (i,k) and (k+1,j), k = i+1 ... j-2
+    if K_coax > 0:
+        K = split_points( I, 1, d-1, N )
+        Z_coax_diag = ( lig[K] * Z_BP.Q[ I, K ] * Z_BP.Q[ (K+1)%N, J ] ).sum( axis = 0 ) * K_coax
+        if d == N-1: Z_coax_diag *= ( 1.0 - lig[J] )
+        Z_coax.Q[ I, J ] = Z_coax_diag
+
+    ##############################
+    # C_eff_basic
+    allow_loop_extension = self.allow_extension_array[ J ]
+    C_eff_basic_diag = lig_jm1 * allow_loop_extension * C_eff.Q[ I, Jm1 ] * l * scale
+
+    # j is base paired or coax-stacked, and its partner is k > i [k = i+1 ... j-1]
+    K = split_points( I, 1, d, N )
+    Km1 = ( K - 1 ) % N
+    C_eff_for_BP_Q, C_eff_for_coax_Q = C_eff.Q[ I, Km1 ], C_eff.Q[ I, Km1 ]
+    if d == N-1 and not allow_strained_3WJ:
+        exclude_strained_3WJ = ( lig[J] > 0 )
+        C_eff_for_BP_Q   = np.where( exclude_strained_3WJ, C_eff_no_coax_singlet.Q[ I, Km1 ], C_eff_for_BP_Q )
+        C_eff_for_coax_Q = np.where( exclude_strained_3WJ, C_eff_no_BP_singlet.Q[ I, Km1 ], C_eff_for_coax_Q )
+    C_eff_basic_diag += ( lig[Km1] * C_eff_for_BP_Q * Z_BP.Q[ K, J ] ).sum( axis = 0 ) * l * l_BP
+    if K_coax > 0:
+        C_eff_basic_diag += ( lig[Km1] * C_eff_for_coax_Q * Z_coax.Q[ K, J ] ).sum( axis = 0 ) * l * l_coax
+    C_eff_basic.Q[ I, J ] = C_eff_basic_diag
+
+    ##############################
+    # C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff
+    C_eff_no_coax_singlet.Q[ I, J ] = C_eff_basic_diag + C_init * Z_BP.Q[ I, J ] * l_BP
+    if K_coax > 0.0:
+        C_eff_no_BP_singlet.Q[ I, J ] = C_eff_basic_diag + C_init * Z_coax.Q[ I, J ] * l_coax
+    C_eff.Q[ I, J ] = C_eff_basic_diag + C_init * Z_BP.Q[ I, J ] * l_BP + ( C_init * Z_coax.Q[ I, J ] * l_coax if K_coax > 0.0 else 0.0 )
+
+    ##############################
+    # Z_linear
+    Z_linear_diag = lig_jm1 * allow_loop_extension * Z_linear.Q[ I, Jm1 ] * scale + Z_BP.Q[ I, J ]
+    Z_linear_ligated = lig[Km1] * Z_linear.Q[ I, Km1 ]
+    Z_linear_diag += ( Z_linear_ligated * Z_BP.Q[ K, J ] ).sum( axis = 0 )
+    if K_coax > 0.0:
+        Z_linear_diag += Z_coax.Q[ I, J ] + ( Z_linear_ligated * Z_coax.Q[ K, J ] ).sum( axis = 0 )
+    Z_linear.Q[ I, J ] = Z_linear_diag
@@ -8,6 +8,7 @@ from .partition import partition
 from .score_structure import score_structure
 from .util.constants import KT_IN_KCAL
 from scipy.optimize import check_grad
+from multiprocessing import Pool
 
 def calc_dG_gap( training_example ):
     '''
@@ -16,11 +17,12 @@ def calc_dG_gap( training_example ):
     '''
     ( sequence, structure, force_base_pairs, params, train_parameters, allow_extra_base_pairs ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.train_parameters, training_example.allow_extra_base_pairs )
     dG_structure = score_structure( sequence, structure, params = params, allow_extra_base_pairs = allow_extra_base_pairs  )
-    p = partition( sequence, params = params, suppress_all_output = True, mfe = True, structure = force_base_pairs, allow_extra_base_pairs = allow_extra_base_pairs )
+    p = partition( sequence, params = params, suppress_all_output = True, mfe = not training_example.production, structure = force_base_pairs, allow_extra_base_pairs = allow_extra_base_pairs, sequence_setup = training_example.sequence_setup )
     dG = p.dG
     dG_gap = dG_structure - dG # will be a positive number, best case zero.
-    print(structure, training_example.name, '[target]')
-    print(p.struct_MFE, training_example.name, '[mfe]', dG_gap)
+    if not training_example.production:
+        print(structure, training_example.name, '[target]')
+        print(p.struct_MFE, training_example.name, '[mfe]', dG_gap)
     return dG_gap
 
 def calc_dG_gap_deriv( training_example ):
@@ -31,10 +33,10 @@ def calc_dG_gap_deriv( training_example ):
     '''
     ( sequence, structure, force_base_pairs, params, train_parameters, allow_extra_base_pairs ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.train_parameters, training_example.allow_extra_base_pairs )
     (dG_structure, log_derivs_structure ) = score_structure( sequence, structure, params = params, deriv_params = train_parameters, allow_extra_base_pairs = allow_extra_base_pairs )
-    p = partition( sequence, params = params, suppress_all_output = True, mfe = True, structure = force_base_pairs, allow_extra_base_pairs = allow_extra_base_pairs, deriv_params = train_parameters )
+    p = partition( sequence, params = params, suppress_all_output = True, mfe = not training_example.production, structure = force_base_pairs, allow_extra_base_pairs = allow_extra_base_pairs, deriv_params = train_parameters, sequence_setup = training_example.sequence_setup )
     log_derivs = p.log_derivs
     dG_gap = dG_structure - p.dG
-    print(p.struct_MFE, training_example.name, dG_gap, ' in deriv' )
+    if not training_example.production: print(p.struct_MFE, training_example.name, dG_gap, ' in deriv' )
     return KT_IN_KCAL * ( np.array( log_derivs ) - np.array( log_derivs_structure ) )
 
 def pack_variables( x, params, train_parameters, training_examples = None, allow_extra_base_pairs = False):
@@ -55,12 +57,13 @@ def pack_variables( x, params, train_parameters, training_examples = None, allow
 def free_energy_gap( x, params, train_parameters, training_examples, allow_extra_base_pairs, priors, pool, outfile ):
     '''
     Main Loss function: Sum delta-G gaps over all training-examples, wrapping around calc_dG_gap.
-    Handles parallelization using multiprocessing 'pool'.
+    Handles parallelization using 'pool' from get_training_pool().
     '''
     pack_variables( x, params, train_parameters, training_examples, allow_extra_base_pairs )
-    params.output_to_file( 'current.params' )
-    print('\n',np.exp(x))
-    all_dG_gap = pool.map( calc_dG_gap, training_examples )
+    if not training_examples[0].production:
+        params.output_to_file( 'current.params' )
+        print('\n',np.exp(x))
+    all_dG_gap = pool.map( run_training_task, get_training_tasks( calc_dG_gap, x, training_examples ) )
     sum_dG_gap = sum( all_dG_gap )
     output_info( outfile, x, sum_dG_gap )
     loss = sum_dG_gap
@@ -70,14 +73,152 @@ def free_energy_gap( x, params, train_parameters, training_examples, allow_extra
 def free_energy_gap_deriv( x, params, train_parameters, training_examples, allow_extra_base_pairs, priors, pool ):
     '''
     Main gradient function: Derivative of delta-G gaps w.r.t. all training parameters, summed over all training-examples, wrapping around calc_dG_gap.
-    Handles parallelization using multiprocessing 'pool'.
+    Handles parallelization using 'pool' from get_training_pool().
     '''
     pack_variables( x, params, train_parameters, training_examples, allow_extra_base_pairs )
-    all_dG_gap_deriv = pool.map( calc_dG_gap_deriv, training_examples )
+    all_dG_gap_deriv = pool.map( run_training_task, get_training_tasks( calc_dG_gap_deriv, x, training_examples ) )
     deriv = sum( all_dG_gap_deriv )
     if priors: deriv += priors(x)[1]
     return deriv
 
+def calc_dG_gap_and_deriv( training_example ):
+    '''
+    For one training_example, calculate both the delta-G gap (as in calc_dG_gap) and its derivatives w.r.t. all
+     training parameters (as in calc_dG_gap_deriv), with one score_structure() and one partition().
+    '''
+    ( sequence, structure, force_base_pairs, params, train_parameters, allow_extra_base_pairs ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.train_parameters, training_example.allow_extra_base_pairs )
+    (dG_structure, log_derivs_structure ) = score_structure( sequence, structure, params = params, deriv_params = train_parameters, allow_extra_base_pairs = allow_extra_base_pairs )
+    p = partition( sequence, params = params, suppress_all_output = True, mfe = not training_example.production, structure = force_base_pairs, allow_extra_base_pairs = allow_extra_base_pairs, deriv_params = train_parameters, sequence_setup = training_example.sequence_setup )
+    dG_gap = dG_structure - p.dG # will be a positive number, best case zero.
+    if not training_example.production:
+        print(structure, training_example.name, '[target]')
+        print(p.struct_MFE, training_example.name, '[mfe]', dG_gap)
+    return ( dG_gap, KT_IN_KCAL * ( np.array( p.log_derivs ) - np.array( log_derivs_structure ) ) )
+
+def calc_mfe_report( training_example ):
+    '''
+    For one training_example, target structure, MFE structure, and delta-G gap -- diagnostics for report_training().
+    '''
+    ( sequence, structure, force_base_pairs, params, allow_extra_base_pairs ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.allow_extra_base_pairs )
+    dG_structure = score_structure( sequence, structure, params = params, allow_extra_base_pairs = allow_extra_base_pairs  )
+    p = partition( sequence, params = params, suppress_all_output = True, mfe = True, structure = force_base_pairs, allow_extra_base_pairs = allow_extra_base_pairs, sequence_setup = training_example.sequence_setup )
+    return ( structure, p.struct_MFE, dG_structure - p.dG )
+
+def free_energy_gap_and_deriv( x, params, train_parameters, training_examples, allow_extra_base_pairs, priors, pool, outfile ):
+    '''
+    Loss and gradient together (for minimize with jac = True), wrapping around calc_dG_gap_and_deriv --
+     each training example is evaluated once, instead of once in free_energy_gap and again in free_energy_gap_deriv.
+    Handles parallelization using 'pool' from get_training_pool().
+    '''
+    pack_variables( x, params, train_parameters, training_examples, allow_extra_base_pairs )
+    if not training_examples[0].production:
+        params.output_to_file( 'current.params' )
+        print('\n',np.exp(x))
+    all_dG_gap_and_deriv = pool.map( run_training_task, get_training_tasks( calc_dG_gap_and_deriv, x, training_examples ) )
+    sum_dG_gap = sum( dG_gap for (dG_gap, dG_gap_deriv) in all_dG_gap_and_deriv )
+    output_info( outfile, x, sum_dG_gap )
+    loss  = sum_dG_gap
+    deriv = sum( dG_gap_deriv for (dG_gap, dG_gap_deriv) in all_dG_gap_and_deriv )
+    if priors:
+        ( prior_val, prior_deriv ) = priors(x)
+        loss  += prior_val
+        deriv = deriv + prior_deriv
+    return ( loss, deriv )
+
+def memoize_loss_and_grad( loss_and_grad ):
+    '''
+    Cache ( loss, gradient ) for every x visited -- minimize() and line searches can come back to the same x.
+    '''
+    cache = {}
+    def memoized_loss_and_grad( x ):
+        key = tuple( np.asarray( x, dtype = float ) )
+        if not key in cache: cache[ key ] = loss_and_grad( x )
+        ( loss, deriv ) = cache[ key ]
+        return ( loss, np.array( deriv ) ) # copy, in case caller modifies gradient in place
+    return memoized_loss_and_grad
+
+##################################################################################################
+# Training pool: long-lived workers that each hold their own copy of params and the training examples
+#  (set up once, by initialize_training_worker). Each evaluation then only sends the log-parameter
+#  values x and the index of each example, instead of pickling every TrainingExample, with its params
+#  (base pair types, motif types, C_eff_stack...), on every call.
+##################################################################################################
+training_worker = {} # params, train_parameters, training_examples, and x for this process
+
+def initialize_training_worker( params, train_parameters, training_examples, allow_extra_base_pairs, production = False ):
+    '''
+    Runs once in each worker process of the training pool (and in this process).
+    production = True skips MFE backtracking and output to stdout in the loss and gradient
+     (see report_training() for diagnostics instead).
+    Each training example also gets a sequence_setup, filled by its first partition() in this process --
+     sequence information and possible base pair and motif types do not change with parameter values.
+    '''
+    training_worker[ 'params' ] = params
+    training_worker[ 'train_parameters' ] = train_parameters
+    training_worker[ 'training_examples' ] = training_examples
+    training_worker[ 'x' ] = None
+    for training_example in training_examples:
+        training_example.params = params
+        training_example.train_parameters = train_parameters
+        training_example.allow_extra_base_pairs = allow_extra_base_pairs
+        training_example.production = production
+        training_example.sequence_setup = {}
+
+def get_training_pool( jobs, params, train_parameters, training_examples, allow_extra_base_pairs, production = False ):
+    '''
+    Pool of jobs training workers for free_energy_gap() and friends.
+    This process is set up like a worker too, so that its training examples carry the same settings,
+     and builtin map can be used instead of the pool.
+    '''
+    initargs = ( params, train_parameters, training_examples, allow_extra_base_pairs, production )
+    initialize_training_worker( *initargs )
+    if jobs > 1: return Pool( jobs, initializer = initialize_training_worker, initargs = initargs )
+
+def get_training_tasks( calc_func, x, training_examples ):
+    '''
+    One task per training example: ( calc_func, x, index of example ) -- workers already have the examples.
+    '''
+    return [ ( calc_func, np.array( x ), n ) for n in range( len( training_examples ) ) ]
+
+def run_training_task( task ):
+    '''
+    Evaluate calc_func (e.g., calc_dG_gap_and_deriv) for one training example held by this worker, at log-parameters x.
+    Parameters are only reset if x changed since the last task.
+    '''
+    ( calc_func, x, n ) = task
+    if training_worker[ 'x' ] is None or not np.array_equal( training_worker[ 'x' ], x ):
+        pack_variables( x, training_worker[ 'params' ], training_worker[ 'train_parameters' ] )
+        training_worker[ 'x' ] = x
+    return calc_func( training_worker[ 'training_examples' ][ n ] )
+
+def report_training( x, params, train_parameters, training_examples, pool, report_file, iteration ):
+    '''
+    Diagnostics for production training: parameter values, and target and MFE structures with delta-G gap
+     for each training example, appended to report_file. Also updates current.params.
+    '''
+    if report_file == None: return
+    pack_variables( x, params, train_parameters )
+    params.output_to_file( 'current.params' )
+    all_reports = pool.map( run_training_task, get_training_tasks( calc_mfe_report, x, training_examples ) )
+    fid = open( report_file, 'a' )
+    fid.write( 'Iteration %s\n' % iteration )
+    for (param_tag, val) in zip( train_parameters, x ): fid.write( '%25s %12.6f\n' % (param_tag, np.exp( val ) ) )
+    for (training_example, (structure, struct_MFE, dG_gap)) in zip( training_examples, all_reports ):
+        fid.write( '%s %s [target]\n' % (structure, training_example.name) )
+        fid.write( '%s %s [mfe] %12.6f\n' % (struct_MFE, training_example.name, dG_gap) )
+    fid.write( '\n' )
+    fid.close()
+
+def get_report_callback( report_every, report ):
+    '''
+    Callback for minimize() that runs report( x, iteration ) every report_every iterations (never, if 0).
+    '''
+    iteration = [ 0 ]
+    def callback( x ):
+        iteration[ 0 ] += 1
+        if report_every > 0 and iteration[ 0 ] % report_every == 0: report( x, iteration[ 0 ] )
+    return callback
+
 BOUND_DELTA = 1.0 # tighter deltas (e.g., 0.1) lead to overflow
 
 def eval_priors( x_list, bounds_list ):
@@ -10,11 +10,14 @@ def _show_results( self ):
     write_result( 'sequence',self.sequence, self.ligated, fid )
     write_result( 'input structure',self.structure, self.ligated, fid )
     write_result( 'calculate gap structure',self.calc_gap_structure, self.ligated, fid )
-    write_result( '(pseudo)MFE',self.struct_MFE, self.ligated, fid )
+    write_result( 'MFE',self.struct_MFE, self.ligated, fid )
     write_result( 'stochastic',self.struct_stochastic, self.ligated, fid )
+    write_result( 'k_best',self.struct_k_best, self.ligated, fid )
     write_result( 'enumerate',self.struct_enumerate, self.ligated, fid )
     print('Z =',self.Z)
     print('dG (kcal/mol) =',self.dG, ' [full]')
+    if self.dG_MFE != None: print('dG (kcal/mol) =',self.dG_MFE, ' [MFE]')
+    if self.num_states != None: print('Number of model states =',self.num_states)
     if self.dG_gap:
         print('dG (kcal/mol) =',self.dG_gap + self.dG, ' [input structure]' )
         print('dG (kcal/mol) =',self.dG_gap, ' [free energy gap]' )
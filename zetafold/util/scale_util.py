@@ -0,0 +1,74 @@
+#
+# Keeping dynamic programming values in floating point range for long sequences.
+#
+# Partition functions grow exponentially with length, and overflow doubles for a few hundred nucleotides.
+# Every matrix element (i,j) is therefore stored multiplied by scale**L, where L = (j-i)%N + 1 is the
+#  number of nucleotides in the subfragment, and Z_final holds Z * scale**N.
+# Since a product of subfragments that tile i..j picks up exactly scale**L, most recursions need no change;
+#  only terms where nucleotides are not covered by any subfragment (loop extensions, hairpins,
+#  closing base pairs, ...) or are covered twice (Z_cut overlaps) get an explicit factor of scale.
+# scale starts at 1.0 (so short sequences give bit-identical results) and is lowered on the fly
+#  whenever a diagonal of Z_linear gets too big.
+#
+from math import log, exp
+import numpy as np
+
+LOG_SCALE_THRESHOLD = 100.0
+
+def rescale_if_needed( self, offset, all_offsets = False ):
+    '''
+    Called after all matrices are filled for the diagonal offset = j - i.
+    If Z_linear on this diagonal exceeds exp( LOG_SCALE_THRESHOLD ), rescale all filled elements so that
+     its maximum becomes 1.
+    all_offsets = True also rescales elements at larger offsets, which must then be either zero or
+     already filled (e.g., copied from a previous window in local_fold.py).
+    '''
+    N = self.N
+    n = N if self.calc_all_elements else N - offset
+    if hasattr( self.Z_linear, 'diagonal' ):
+        Z_max = self.Z_linear.diagonal( offset ).max()
+    elif hasattr( self.Z_linear, 'Q' ) and hasattr( self.Z_linear.Q, 'shape' ):
+        I = np.arange( n )
+        Z_max = self.Z_linear.Q[ I, (I + offset) % N ].max()
+    else:
+        Z_max = max( self.Z_linear.val( i, i + offset ) for i in range( n ) )
+    if Z_max <= exp( LOG_SCALE_THRESHOLD ): return
+    rescale( self, N - 1 if all_offsets else offset, exp( -log( Z_max ) / ( offset + 1 ) ) )
+
+def rescale( self, max_offset, r ):
+    '''
+    Multiply every element (i,j) with (j-i)%N <= max_offset by r**( (j-i)%N + 1 ), and scale by r.
+    Elements with larger offsets have not been filled yet, and are left alone.
+    '''
+    N = self.N
+    factor = [ r**( offset + 1 ) if offset <= max_offset else 1.0 for offset in range( N ) ]
+    factor_matrix = None
+    for Z in self.Z_all + list( self.Z_BPq.values() ):
+        if hasattr( Z, 'scale_by_offset' ):
+            Z.scale_by_offset( factor ) # banded storage
+        elif hasattr( Z, 'Q' ) and hasattr( Z.Q, 'shape' ):
+            if factor_matrix is None:
+                I = np.arange( N )
+                factor_matrix = np.array( factor )[ ( I[None,:] - I[:,None] ) % N ]
+            Z.Q *= factor_matrix # in place -- Z_BPq may be views into one big array (wavefront.py)
+        elif hasattr( Z, 'Q' ):
+            for i in range( N ): Z.Q[i] = [ q * factor[ (j - i) % N ] for (j,q) in enumerate( Z.Q[i] ) ]
+        else:
+            for i in range( N ):
+                for j in range( N ): Z.set_val( i, j, Z.val( i, j ) * factor[ (j - i) % N ] )
+    self.scale *= r
+
+def get_Z_and_log_Z( self ):
+    '''
+    Undo scaling of Z_final = Z * scale**N.
+    Returns ( Z, log Z ). Z may be inf for long sequences, but log Z is always finite (None if Z = 0).
+    '''
+    Z_scaled = self.Z_final.val( 0 )
+    if Z_scaled <= 0.0: return ( 0.0, None )
+    if self.scale == 1.0: return ( Z_scaled, log( Z_scaled ) )
+    log_Z = log( Z_scaled ) - self.N * log( self.scale )
+    try:
+        Z = exp( log_Z )
+    except OverflowError:
+        Z = float( 'inf' )
+    return ( Z, log_Z )
@@ -1,3 +1,5 @@
+import numpy as np
+
 def secstruct_from_bps( bps, N ):
     '''
     Convert list of base pairs to dot-paren string. N is length of RNA.
@@ -27,6 +29,64 @@ def bps_from_secstruct( secstruct ):
     bps_list.sort()
     return bps_list
 
+class ForcedBasePairs:
+    '''
+    Answers allow_base_pair[m][n] for a structure whose base pairs are forced, without an N x N matrix:
+
+      partner[n] = base pair partner of n in the forced structure, or -1
+      domain[n]  = index of innermost forced pair enclosing n, or -1 (outside all forced pairs)
+
+    If allow_extra_base_pairs is False, only the forced pairs are allowed. Otherwise, a pair (m,n) is also allowed
+     if neither m nor n is in a forced pair and the pair does not cross any forced pair -- since the forced
+     pairs are nested, that is just domain[m] == domain[n]. Set up in O(N + P) for P forced pairs.
+    allowed() does the same for NumPy arrays of m and n.
+    '''
+    def __init__( self, bp_list, N, allow_extra_base_pairs = False ):
+        self.N = N
+        self.allow_extra_base_pairs = allow_extra_base_pairs
+        self.partner = [ -1 ] * N
+        for i,j in bp_list:
+            self.partner[ i ] = j
+            self.partner[ j ] = i
+        self.domain = [ -1 ] * N
+        enclosing = [ -1 ]
+        for n in range( N ):
+            if self.partner[ n ] > n: enclosing.append( n )
+            self.domain[ n ] = enclosing[ -1 ]
+            if 0 <= self.partner[ n ] < n: enclosing.pop()
+        self.partner_array = np.array( self.partner )
+        self.domain_array  = np.array( self.domain )
+
+    def allowed( self, m, n ):
+        m = m % self.N
+        n = n % self.N
+        allowed = ( self.partner_array[ m ] == n )
+        if self.allow_extra_base_pairs:
+            allowed |= ( self.partner_array[ m ] < 0 ) & ( self.partner_array[ n ] < 0 ) & ( self.domain_array[ m ] == self.domain_array[ n ] )
+        return allowed
+
+    def __getitem__( self, m ):
+        return ForcedBasePairsRow( self, m )
+
+    def __len__( self ):
+        return self.N
+
+class ForcedBasePairsRow:
+    '''
+    allow_base_pair[m] -- so that allow_base_pair[m][n] works as for a matrix
+    '''
+    def __init__( self, forced_base_pairs, m ):
+        self.forced_base_pairs = forced_base_pairs
+        self.m = m % forced_base_pairs.N
+
+    def __getitem__( self, n ):
+        forced_base_pairs = self.forced_base_pairs
+        n = n % forced_base_pairs.N
+        partner = forced_base_pairs.partner
+        if partner[ self.m ] == n: return True
+        if not forced_base_pairs.allow_extra_base_pairs: return False
+        return partner[ self.m ] < 0 and partner[ n ] < 0 and forced_base_pairs.domain[ self.m ] == forced_base_pairs.domain[ n ]
+
 def get_structure_string( structure ):
     if structure == None: return None
     if isinstance( structure, list ): structure = ''.join( structure )
@@ -0,0 +1,66 @@
+##################################################################################################
+# All dynamic programming recursions are sums over contributions that are products of weights.
+#  Changing what 'sum' means, or what the weights are, gives other quantities from the same recursions:
+#
+#   'sum'   = sum-product over Boltzmann weights -> partition function Z [default]
+#   'max'   = max-product over Boltzmann weights -> Boltzmann weight of minimum free energy (MFE) structure.
+#               Backtracking through maximum contributions then gives the exact MFE structure.
+#   'count' = sum-product with every allowed weight set to 1 -> number of model states. Note that this is
+#               not the number of distinct secondary structures: each way to derive a set of base pairs (with
+#               or without coaxial stacks, motifs, etc.) counts separately.
+#
+# The sum is used through partition.options.sum by explicit_recursions.py (and by += in recursions.py),
+#  and through partition.options.add, its elementwise version for NumPy arrays, by banded.py.
+#  Other engines (numpy arrays, wavefront, jit, outside) only do 'sum'.
+##################################################################################################
+import copy
+import numpy as np
+
+semirings = [ 'sum', 'max', 'count' ]
+
+def max_sum( contribs ):
+    '''
+    'sum' for max-product -- zero (no structures) if no contributions.
+    '''
+    if len( contribs ) == 0: return 0.0
+    return max( contribs )
+
+def get_semiring_sum( semiring ):
+    assert( semiring in semirings )
+    if semiring == 'max': return max_sum
+    return sum
+
+def get_semiring_add( semiring ):
+    '''
+    Elementwise 'sum' of NumPy arrays, as a ufunc -- add.reduce() and add.at() then give sums over contributions.
+    '''
+    assert( semiring in semirings )
+    if semiring == 'max': return np.maximum
+    return np.add
+
+def array_sum( add, contribs ):
+    '''
+    'sum' with ufunc add (see get_semiring_add) over axis 0 of contribs -- an array, or a list of arrays of same shape.
+     Zero (no structures) if there are no contributions.
+    '''
+    contribs = np.asarray( contribs )
+    if len( contribs ) == 0: return np.zeros( contribs.shape[1:] )
+    return add.reduce( contribs, axis = 0 )
+
+def get_semiring_params( params, semiring ):
+    '''
+    Parameters to fill dynamic programming matrices in semiring --
+     for 'count', a copy of params with all weights 1 (or 0, for weights that forbid a contribution).
+    '''
+    assert( semiring in semirings )
+    if semiring != 'count': return params
+    def unit( val ): return 1.0 if val > 0.0 else 0.0
+    count_params = copy.deepcopy( params )
+    count_params.C_init = count_params.l = count_params.l_BP = count_params.l_coax = count_params.C_std = 1.0
+    count_params.K_coax = unit( params.K_coax )
+    for base_pair_type in count_params.base_pair_types: base_pair_type.Kd = 1.0
+    for base_pair_type1 in count_params.C_eff_stack:
+        for base_pair_type2 in count_params.C_eff_stack[ base_pair_type1 ]:
+            count_params.C_eff_stack[ base_pair_type1 ][ base_pair_type2 ] = unit( count_params.C_eff_stack[ base_pair_type1 ][ base_pair_type2 ] )
+    for motif_type in count_params.motif_types: motif_type.C_eff = unit( motif_type.C_eff )
+    return count_params
@@ -1,4 +1,5 @@
 from .wrapped_array import *
+import numpy as np
 
 def initialize_sequence_and_ligated( sequences, circle, use_wrapped_array = False ):
     if isinstance( sequences, str ): sequences = [sequences ]
@@ -44,22 +45,63 @@ def get_num_strand_connections( sequences, circle ):
     assert( num_strand_connections >= -1 )
     return num_strand_connections
 
+##################################################################################################
+def get_sequence_codes( sequence ):
+    '''
+    Integer code (ASCII value) for each character in sequence, as a NumPy array, so that
+     base pairs and motif strands can be matched over the whole sequence at once.
+    '''
+    return np.array( [ ord( c ) for c in sequence ], dtype = int )
+
 ##################################################################################################
 def initialize_all_ligated( ligated ):
     '''
     all_ligated is needed to keep track of whether an apical loop is long enough
     to be 'closed' into a hairpin by base pair formation.
-    TODO: alternatively could create a 'hairpin_OK' matrix -- that
-          would be more analogous to pre-scanning for protein/ligand binding sites too.
+    all_ligated[i][j] = no cutpoint exists between i and j, answered in O(1) by a CutpointIndex.
+    '''
+    return CutpointIndex( ligated )
+
+class CutpointIndex:
+    '''
+    Same queries as an N x N matrix all_ligated, i.e. all_ligated[i][j] is True if there is no cutpoint in
+     i, i+1, ... j-1 (wrapping around past N-1), but stored in O(N) memory:
+
+      cutpoints           = sorted positions n that are not ligated to n+1
+      next_cutpoint_offset = for each i, offset d >= 0 to first cutpoint i+d at or after i (N if none)
+
+    Then all_ligated[i][j] is just (j - i) % N <= next_cutpoint_offset[i]. no_cutpoint() does the same for
+     NumPy arrays of i and j.
+    '''
+    def __init__( self, ligated ):
+        N = len( ligated )
+        self.N = N
+        self.cutpoints = [ n for n in range( N ) if not ligated[n] ]
+        self.next_cutpoint_offset = [ N ] * N
+        if len( self.cutpoints ) > 0:
+            offset = N
+            for n in range( 2*N-1, -1, -1 ): # two passes, to wrap around
+                offset = 0 if not ligated[ n % N ] else offset + 1
+                if n < N: self.next_cutpoint_offset[ n ] = offset
+        self.next_cutpoint_offset_array = np.array( self.next_cutpoint_offset )
+
+    def no_cutpoint( self, i, j ):
+        return ( j - i ) % self.N <= self.next_cutpoint_offset_array[ i % self.N ]
+
+    def __getitem__( self, i ):
+        return CutpointIndexRow( self, i )
+
+    def __len__( self ):
+        return self.N
+
+class CutpointIndexRow:
+    '''
+    all_ligated[i] -- so that all_ligated[i][j] works as for a matrix
     '''
-    N = len( ligated )
-    all_ligated = initialize_matrix( N, True )
-    for i in range( N ): #index of subfragment
-        found_cutpoint = False
-        all_ligated[ i ][ i ] = True
-        for offset in range( N ): #length of subfragment
-            j = (i + offset) % N;  # N cyclizes
-            all_ligated[ i ][ j ] = ( not found_cutpoint )
-            if not ligated[ j ]: found_cutpoint = True
-    return all_ligated
+    def __init__( self, cutpoint_index, i ):
+        self.N = cutpoint_index.N
+        self.i = i % self.N
+        self.next_cutpoint_offset = cutpoint_index.next_cutpoint_offset[ self.i ]
 
+    def __getitem__( self, j ):
+        return ( j - self.i ) % self.N <= self.next_cutpoint_offset
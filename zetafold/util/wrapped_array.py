@@ -21,3 +21,50 @@ def initialize_matrix( N, val = None, wrapped = True ):
         X[ i ] = WrappedArray( N ) if wrapped else [None]*N
         for j in range( N ): X[ i ][ j ] = val
     return X
+
+##################################################################################################
+class SparseRow( dict ):
+    '''
+    Row of a matrix in which only some elements are stored -- all others read out as default
+    (which should not be modified by the caller).
+    '''
+    def __init__( self, default ):
+        dict.__init__( self )
+        self.default = default
+    def __missing__( self, idx ):
+        return self.default
+
+class LazySparseRow( SparseRow ):
+    '''
+    SparseRow with stored elements at columns, made by get_element( idx ) the first time they are looked up
+     (and then removed from columns).
+    '''
+    def __init__( self, default, columns, get_element ):
+        SparseRow.__init__( self, default )
+        self.columns = columns
+        self.get_element = get_element
+    def __missing__( self, idx ):
+        if not idx in self.columns: return self.default
+        item = self[ idx ] = self.get_element( idx )
+        del self.columns[ idx ]
+        return item
+    def items( self ):
+        for idx in list( self.columns ): self[ idx ]
+        return dict.items( self )
+
+##################################################################################################
+class LazyMatrix:
+    '''
+    Matrix read out one element at a time, e.g. X[i][j], whose rows are made by get_row( i ) the first
+     time they are looked up (and then kept). Row index is taken modulo N.
+    '''
+    def __init__( self, N, get_row ):
+        self.rows = [ None ] * N
+        self.N = N
+        self.get_row = get_row
+    def __getitem__( self, idx ):
+        i = idx % self.N
+        if self.rows[ i ] is None: self.rows[ i ] = self.get_row( i )
+        return self.rows[ i ]
+    def __len__( self ):
+        return self.N